@@ -0,0 +1,110 @@
+"""
+Measures the cold-start time of the CLI and of importing every module class, and checks it against a time budget.
+
+Every measurement runs in a fresh interpreter, so nothing is cached between them. The start-up time of a bare
+interpreter is subtracted. Importing a module class must also not load torch or transformers, which are only needed once
+a model is created.
+
+Usage: python -m benchmarks.import_time [--repeats N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Budgets in seconds on top of the bare interpreter start-up.
+CLI_BUDGET = 0.5
+MODULE_BUDGETS: Dict[str, float] = {
+    "SatelliteLoader": 3.0,
+    "WaterPreprocessing": 1.0,
+}
+DEFAULT_MODULE_BUDGET = 0.5
+
+# Packages that must only be imported when a model is created.
+HEAVY_PACKAGES = ["torch", "transformers"]
+
+# Prefix of the output line listing the heavy packages a measured command loaded, so other output such as the help
+# text of the CLI is not mistaken for them.
+HEAVY_MARKER = "HEAVY:"
+
+
+def measure(arguments: List[str], repeats: int) -> Tuple[float, str]:
+    """
+    Run a Python command in fresh interpreters and return its fastest wall time and the output of the last run.
+
+    :param arguments: Arguments passed to the interpreter.
+    :param repeats: Number of runs.
+    :return: The fastest wall time in seconds and the standard output of the last run.
+    :raises RuntimeError: If the command fails.
+    """
+    best = float("inf")
+    output = ""
+    for _ in range(repeats):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, *arguments], cwd=REPOSITORY_ROOT, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}")
+        best = min(best, elapsed)
+        output = process.stdout
+    return best, output
+
+
+def heavy_packages(output: str) -> List[str]:
+    """
+    Get the heavy packages a measured command reported on its marker line.
+
+    :param output: The standard output of the command.
+    :return: The loaded heavy packages.
+    :raises RuntimeError: If the output has no marker line.
+    """
+    for line in reversed(output.splitlines()):
+        if line.startswith(HEAVY_MARKER):
+            return [package for package in line[len(HEAVY_MARKER):].split() if package in HEAVY_PACKAGES]
+    raise RuntimeError(f"no {HEAVY_MARKER} line in the output")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check the import time of the CLI and of every module against a budget.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs per measurement; the fastest one counts.")
+    arguments = parser.parse_args()
+
+    sys.path.insert(0, REPOSITORY_ROOT)
+    from modules import module_names
+
+    baseline, _ = measure(["-c", "pass"], arguments.repeats)
+    failures = 0
+
+    def report(name: str, arguments_: List[str], budget: float) -> None:
+        nonlocal failures
+        try:
+            elapsed, output = measure(arguments_, arguments.repeats)
+            heavy = heavy_packages(output)
+        except RuntimeError as error:
+            print(f"{name:<20} FAILED  {error}")
+            failures += 1
+            return
+
+        elapsed -= baseline
+        status = "ok" if elapsed <= budget and not heavy else "OVER"
+        failures += status != "ok"
+        note = f" (imports {', '.join(heavy)})" if heavy else ""
+        print(f"{name:<20} {status:<7} {elapsed * 1000:8.1f} ms / {budget * 1000:.0f} ms{note}")
+
+    check_heavy = f"import sys; print({HEAVY_MARKER!r}, *[name for name in {HEAVY_PACKAGES!r} if name in sys.modules])"
+    print(f"Interpreter start-up: {baseline * 1000:.1f} ms")
+    report("CLI", ["-c", f"import sys; sys.argv = ['main.py', '--help']\ntry:\n    import main; main.parse_arguments()\nexcept SystemExit:\n    pass\n{check_heavy}"], CLI_BUDGET)
+
+    for name in module_names():
+        code = f"from modules import get_module_class; get_module_class({name!r})\n{check_heavy}"
+        report(name, ["-c", code], MODULE_BUDGETS.get(name, DEFAULT_MODULE_BUDGET))
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
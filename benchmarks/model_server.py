@@ -0,0 +1,115 @@
+"""
+Benchmark of the resident model server with stub models, run on a CPU.
+
+Several client processes send multi_run requests of the same analysis at the same time, as concurrent pipeline
+processes do. They use the real model classes as thin clients with a response cache, which must not load the models,
+while the server answers with stub models. Merging concurrent requests into shared micro-batches is compared with
+running every request on its own.
+
+Usage: python -m benchmarks.model_server [--clients N] [--requests N] [--prompts N] [--call-latency S]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+from benchmarks.stubs import register_stub_models
+from models import create_model
+from models.response_cache import ResponseCache
+from models.server import ModelClient, ModelServer, set_model_client
+
+
+def run_client(socket_path: str, requests: int, prompts: int, batch_size: int, barrier: multiprocessing.Barrier) -> None:
+    """
+    Send requests like a pipeline process does, through the real InternLM class as thin client.
+
+    :param socket_path: Path of the socket of the server.
+    :param requests: Number of multi_run calls.
+    :param prompts: Number of prompts per call.
+    :param batch_size: Micro-batch size, applied to the model on the server.
+    :param barrier: Barrier all clients start at together.
+    """
+    set_model_client(ModelClient(socket_path))
+    model = create_model("InternLM")
+    # A thin client must not load the weights, not even to compute the keys of its response cache.
+    model.load = refuse_load
+    model.batch_size = batch_size
+    with tempfile.TemporaryDirectory() as cache_dir:
+        model.response_cache = ResponseCache(cache_dir)
+        barrier.wait()
+        for request in range(requests):
+            results = model.multi_run("Describe the location.", [f"Question {request}.{index}" for index in range(prompts)])
+            if len(results) != prompts:
+                raise RuntimeError(f"Expected {prompts} results, got {len(results)}")
+
+
+def refuse_load() -> dict:
+    """Stand-in for Model.load of the clients, which fails the benchmark if a client loads its model."""
+    raise RuntimeError("A client of the model server loaded its model")
+
+
+def measure(batch_window: float, arguments: argparse.Namespace) -> tuple[float, ModelServer]:
+    """
+    Serve the clients and measure the time until all of them are done.
+
+    :param batch_window: Batch window of the server in seconds.
+    :param arguments: Parsed command line arguments.
+    :return: The elapsed time in seconds and the server.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "models.sock")
+        server = ModelServer(socket_path, batch_window=batch_window)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(arguments.clients + 1)
+        processes: List[multiprocessing.Process] = [
+            context.Process(target=run_client, args=(socket_path, arguments.requests, arguments.prompts, arguments.batch_size, barrier))
+            for _ in range(arguments.clients)]
+        for process in processes:
+            process.start()
+
+        barrier.wait()
+        start = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        server.shutdown()
+        thread.join()
+
+    if any(process.exitcode != 0 for process in processes):
+        raise RuntimeError("A client failed")
+    return elapsed, server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark request batching of the model server with stub models.")
+    parser.add_argument("--clients", type=int, default=4, help="Number of concurrent client processes.")
+    parser.add_argument("--requests", type=int, default=5, help="Number of multi_run calls per client.")
+    parser.add_argument("--prompts", type=int, default=3, help="Number of prompts per call.")
+    parser.add_argument("--call-latency", type=float, default=0.05, help="Simulated seconds per generate call.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Micro-batch size the clients request.")
+    parser.add_argument("--batch-window", type=float, default=0.01, help="Batch window of the server in seconds.")
+    arguments = parser.parse_args()
+
+    register_stub_models(call_latency=arguments.call_latency)
+
+    # Without a batch window, only requests that queued up while the previous batch ran are merged.
+    total = arguments.clients * arguments.requests
+    for window in sorted({0.0, arguments.batch_window}):
+        elapsed, server = measure(window, arguments)
+        print(f"batch window {window * 1000:4.0f} ms: {total / elapsed:8.1f} requests/s, "
+              f"{server.requests / max(server.batches, 1):5.2f} requests per batch")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""
+CPU-runnable benchmark suite of the pipeline with stub models and synthetic satellite images.
+
+Scenarios:
+- pipeline: the full module graph of main.py, scheduled by run_batch, at several location counts and image sizes.
+- module_io: publishing, persisting and loading artifacts through a module.
+- water_preprocessing: the WaterPreprocessing module on the synthetic water image.
+- multi_run: Model.multi_run_one_result of a stub perception model one prompt at a time and in micro-batches.
+- prefix_reuse: Model.multi_run_one_result of a stub perception model in micro-batches and with the image and system
+  prompt prefilled once, reporting the prefilled tokens of both.
+
+Every metric is compared with the baseline stored in baselines.json, and the suite fails if one got worse by more than
+the tolerance. Baselines depend on the machine, so update them with --update-baselines after changing it.
+
+Usage: python -m benchmarks.pipeline_suite [--locations 1 4] [--sizes 512 2048] [--scenarios ...] [--update-baselines]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, override
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.stubs import FIXTURE_IMAGES, FixtureLoader, StubPerceptionModel, register_stub_models, \
+    unregister_stub_models, write_fixtures
+from models.manager import ModelManager, set_model_manager
+from modules import create_module
+from modules.context import RunContext
+from modules.module import Module, ModuleResult
+from modules.water_preprocessing import WaterPreprocessing
+from pipeline import Tracer, run_batch, set_tracer
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "baselines.json")
+
+# Prompts of RGBAnalysis, whose multi_run_one_result call is the largest one of a run.
+MULTI_RUN_PROMPTS = 14
+
+
+class Metric:
+    """A measured value together with its unit and whether higher values are better."""
+
+    def __init__(self, value: float, unit: str, higher_is_better: bool):
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+
+    def regression(self, baseline: float, tolerance: float) -> bool:
+        """
+        Check whether the value is worse than a baseline by more than a tolerance.
+
+        :param baseline: The baseline value.
+        :param tolerance: Allowed relative deviation, e.g. 0.25 for 25 %.
+        :return: True if the value regressed.
+        """
+        if self.higher_is_better:
+            return self.value < baseline * (1 - tolerance)
+        return self.value > baseline * (1 + tolerance)
+
+
+class ArtifactModule(Module):
+    """Module that only publishes and consumes the artifacts of the module I/O scenario."""
+
+    def __init__(self):
+        super().__init__("ArtifactModule")
+
+    @override
+    def main(self) -> ModuleResult:
+        return ModuleResult.OK
+
+
+def percentile(values: List[float], share: float) -> float:
+    """Return the value below which the given share of the values lies, interpolating between them."""
+    return float(np.percentile(values, share * 100))
+
+
+def benchmark_pipeline(root: str, fixture_dir: str, locations: int, workers: int) -> Dict[str, Metric]:
+    """
+    Run the module graph of main.py for several locations and measure throughput and per-location latency.
+
+    The latency of a location is taken from the run span of its exported trace.
+
+    :param root: Directory below which the data of the runs is stored.
+    :param fixture_dir: Directory of the fixture images.
+    :param locations: Number of locations.
+    :param workers: Maximum number of modules running at the same time.
+    :return: The metrics of the scenario.
+    """
+    from main import PIPELINE_MODULES
+
+    def create_modules() -> List[Module]:
+        return [FixtureLoader(fixture_dir) if name == "SatelliteLoader" else create_module(name) for name in PIPELINE_MODULES]
+
+    names = [f"Location{index}" for index in range(locations)]
+    trace_dir = os.path.join(root, "traces")
+    set_model_manager(ModelManager())
+    set_tracer(Tracer())
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = run_batch(names, create_modules, root=root, max_workers=workers, resource_limits={"gpu": 1}, trace_dir=trace_dir)
+    elapsed = time.perf_counter() - start
+
+    failed = [f"{location}/{module}" for location, modules in results.items() for module, result in modules.items() if result.name != "OK"]
+    if failed:
+        raise RuntimeError(f"Modules did not finish successfully: {', '.join(failed)}")
+
+    latencies = []
+    for name in names:
+        with open(os.path.join(trace_dir, f"{name}.trace.json"), "r", encoding="utf-8") as file:
+            events = json.load(file)["traceEvents"]
+        latencies.extend(event["dur"] / 1e6 for event in events if event.get("cat") == "run")
+
+    return {
+        "throughput": Metric(locations / elapsed, "locations/s", True),
+        "latency_p50": Metric(percentile(latencies, 0.5), "s", False),
+        "latency_p95": Metric(percentile(latencies, 0.95), "s", False),
+    }
+
+
+def benchmark_module_io(root: str, fixture_dir: str, repeats: int) -> Dict[str, Metric]:
+    """
+    Measure publishing and persisting the fixture images and a text artifact, and loading them in a fresh run.
+
+    :param root: Directory below which the data of the runs is stored.
+    :param fixture_dir: Directory of the fixture images.
+    :param repeats: Number of round trips.
+    :return: The metrics of the scenario.
+    """
+    images = {name: np.asarray(Image.open(os.path.join(fixture_dir, name))) for name in FIXTURE_IMAGES}
+    text = "Synthetic analysis. " * 2000
+
+    writes, reads = [], []
+    for repeat in range(repeats):
+        location = f"IO{repeat}"
+        module = ArtifactModule()
+        module.context = RunContext(location, root)
+
+        start = time.perf_counter()
+        for name, image in images.items():
+            module.publish(f"io_{name}", image)
+        module.save_to_file("io_analysis.txt", text)
+        module.artifacts.close()
+        writes.append(time.perf_counter() - start)
+
+        module.context = RunContext(location, root)
+        start = time.perf_counter()
+        for name in images:
+            module.artifacts.array(f"io_{name}")
+        module.load_from_file("io_analysis.txt")
+        reads.append(time.perf_counter() - start)
+
+    return {
+        "write_latency": Metric(statistics.median(writes), "s", False),
+        "read_latency": Metric(statistics.median(reads), "s", False),
+    }
+
+
+def benchmark_water_preprocessing(root: str, fixture_dir: str, size: int, repeats: int) -> Dict[str, Metric]:
+    """
+    Measure the WaterPreprocessing module on the synthetic water image.
+
+    :param root: Directory below which the data of the runs is stored.
+    :param fixture_dir: Directory of the fixture images.
+    :param size: Width and height of the fixture images.
+    :param repeats: Number of runs.
+    :return: The metrics of the scenario.
+    """
+    timings = []
+    for repeat in range(repeats):
+        context = RunContext(f"Water{repeat}", root)
+        loader = FixtureLoader(fixture_dir)
+        loader.context = context
+        loader.main()
+
+        module = WaterPreprocessing()
+        module.context = context
+        start = time.perf_counter()
+        module.main()
+        context.artifacts.close()
+        timings.append(time.perf_counter() - start)
+
+    latency = statistics.median(timings)
+    return {
+        "latency": Metric(latency, "s", False),
+        "throughput": Metric(size * size / latency / 1e6, "Mpx/s", True),
+    }
+
+
+def benchmark_multi_run(fixture_dir: str, batch_size: int, call_latency: float, token_latency: float, repeats: int) -> Dict[str, Metric]:
+    """
+    Measure Model.multi_run_one_result of a stub perception model on the prompts of an analysis.
+
+    :param fixture_dir: Directory of the fixture images.
+    :param batch_size: Micro-batch size of the model.
+    :param call_latency: Simulated seconds per generate call.
+    :param token_latency: Simulated seconds per generated token.
+    :param repeats: Number of runs.
+    :return: The metrics of the scenario.
+    """
+    set_model_manager(ModelManager())
+    prompts = [f"Question {index} about the image?" for index in range(MULTI_RUN_PROMPTS)]
+    timings = []
+    for _ in range(repeats):
+        model = StubPerceptionModel(call_latency, token_latency)
+        model.batch_size = batch_size
+        model.image_paths = [os.path.join(fixture_dir, "rgb.png")]
+        start = time.perf_counter()
+        model.multi_run_one_result("", prompts)
+        timings.append(time.perf_counter() - start)
+
+    latency = statistics.median(timings)
+    return {
+        "latency": Metric(latency, "s", False),
+        "throughput": Metric(len(prompts) / latency, "prompts/s", True),
+    }
+
+
+def benchmark_prefix_reuse(fixture_dir: str, reuse_prefix: bool, call_latency: float, token_latency: float, repeats: int) -> Dict[str, Metric]:
+    """
+    Measure Model.multi_run_one_result of a stub perception model with and without prefilling the shared prefix once.
+
+    The stub perception model batches by default, so the pipeline scenarios are unaffected by prefix reuse.
+
+    :param fixture_dir: Directory of the fixture images.
+    :param reuse_prefix: Whether the model prefills the image and the system prompt once for all prompts.
+    :param call_latency: Simulated seconds per generate call.
+    :param token_latency: Simulated seconds per generated token.
+    :param repeats: Number of runs.
+    :return: The metrics of the scenario.
+    """
+    set_model_manager(ModelManager())
+    system_prompt = "You are an expert for satellite images. Answer the question about the image in one sentence."
+    prompts = [f"Question {index} about the image?" for index in range(MULTI_RUN_PROMPTS)]
+    timings, prefill_tokens = [], []
+    for _ in range(repeats):
+        model = StubPerceptionModel(call_latency, token_latency)
+        model.batch_size = 4
+        model.reuse_prefix = reuse_prefix
+        model.image_paths = [os.path.join(fixture_dir, "rgb.png")]
+        start = time.perf_counter()
+        model.multi_run_one_result(system_prompt, prompts)
+        timings.append(time.perf_counter() - start)
+        prefill_tokens.append(model.prefill_tokens)
+
+    return {
+        "latency": Metric(statistics.median(timings), "s", False),
+        "prefill_tokens": Metric(statistics.median(prefill_tokens), "tokens", False),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on a CPU with stub models and synthetic images.")
+    parser.add_argument("--scenarios", nargs="+", default=["pipeline", "module_io", "water_preprocessing", "multi_run", "prefix_reuse"],
+                        help="Scenarios to run.")
+    parser.add_argument("--locations", type=int, nargs="+", default=[1, 4], help="Location counts of the pipeline scenario.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 2048], help="Widths and heights of the synthetic images.")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum number of modules running at the same time.")
+    parser.add_argument("--call-latency", type=float, default=0.02, help="Simulated seconds per generate call.")
+    parser.add_argument("--token-latency", type=float, default=0.0005, help="Simulated seconds per generated token.")
+    parser.add_argument("--load-latency", type=float, default=0.1, help="Simulated seconds per model load.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs of the single-module scenarios.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression against the baselines.")
+    parser.add_argument("--baselines", default=BASELINES_PATH, help="File the baselines are stored in.")
+    parser.add_argument("--update-baselines", action="store_true", help="Store the measured values as new baselines.")
+    arguments = parser.parse_args()
+
+    register_stub_models(arguments.call_latency, arguments.token_latency, arguments.load_latency)
+    metrics: Dict[str, Metric] = {}
+
+    def record(prefix: str, measure: Callable[[], Dict[str, Metric]]) -> None:
+        for name, metric in measure().items():
+            metrics[f"{prefix}.{name}"] = metric
+            print(f"{prefix + '.' + name:<48} {metric.value:10.4f} {metric.unit}")
+
+    try:
+        for size in arguments.sizes:
+            with tempfile.TemporaryDirectory() as root:
+                fixture_dir = os.path.join(root, "fixtures")
+                write_fixtures(fixture_dir, size)
+
+                if "pipeline" in arguments.scenarios:
+                    for locations in arguments.locations:
+                        record(f"pipeline.{size}px.{locations}loc",
+                               lambda: benchmark_pipeline(os.path.join(root, f"pipeline{locations}"), fixture_dir, locations, arguments.workers))
+                if "module_io" in arguments.scenarios:
+                    record(f"module_io.{size}px", lambda: benchmark_module_io(os.path.join(root, "io"), fixture_dir, arguments.repeats))
+                if "water_preprocessing" in arguments.scenarios:
+                    record(f"water_preprocessing.{size}px",
+                           lambda: benchmark_water_preprocessing(os.path.join(root, "water"), fixture_dir, size, arguments.repeats))
+                if "multi_run" in arguments.scenarios:
+                    for batch_size in (1, 4):
+                        record(f"multi_run.{size}px.batch{batch_size}",
+                               lambda: benchmark_multi_run(fixture_dir, batch_size, arguments.call_latency, arguments.token_latency, arguments.repeats))
+                if "prefix_reuse" in arguments.scenarios:
+                    for reuse_prefix in (False, True):
+                        record(f"prefix_reuse.{size}px.{'reuse' if reuse_prefix else 'batch4'}",
+                               lambda: benchmark_prefix_reuse(fixture_dir, reuse_prefix, arguments.call_latency, arguments.token_latency, arguments.repeats))
+    finally:
+        unregister_stub_models()
+
+    baselines = {}
+    if os.path.exists(arguments.baselines):
+        with open(arguments.baselines, "r", encoding="utf-8") as file:
+            baselines = json.load(file)
+
+    if arguments.update_baselines:
+        baselines.update({name: {"value": round(metric.value, 6), "unit": metric.unit, "higher_is_better": metric.higher_is_better}
+                          for name, metric in metrics.items()})
+        with open(arguments.baselines, "w", encoding="utf-8") as file:
+            json.dump(dict(sorted(baselines.items())), file, indent=2)
+            file.write("\n")
+        print(f"Updated {len(metrics)} baselines in {arguments.baselines}")
+        return 0
+
+    regressions = [name for name, metric in metrics.items()
+                   if name in baselines and metric.regression(baselines[name]["value"], arguments.tolerance)]
+    for name in regressions:
+        print(f"REGRESSION {name}: {metrics[name].value:.4f} {metrics[name].unit}, baseline {baselines[name]['value']:.4f}")
+    missing = [name for name in metrics if name not in baselines]
+    if missing:
+        print(f"No baseline for {len(missing)} metrics, store them with --update-baselines")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Local stand-in for the Sentinel Hub Process API that serves synthetic tiles, and a benchmark of the tiled download
+against it.
+
+The stand-in renders every output as a smooth function of the longitude and latitude of the pixel centers, so a mosaic
+of sub-requests must equal a single request for the whole bounding box. It can delay responses and fail a share of them
+with 503 to exercise the retries.
+
+Usage: python -m benchmarks.sentinel_stand_in [--size N] [--max-request-size N] [--workers N] [--latency S] [--failure-rate P]
+"""
+import argparse
+import io
+import json
+import random
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+import cv2
+import numpy as np
+import requests
+
+from satellite.mosaic import MosaicDownloader
+from satellite.process_api import PROCESS_API_PATH, ProcessApiClient
+
+BENCHMARK_BOUNDS = (10.95, 49.56, 11.05, 49.62)
+
+
+def render_outputs(payload: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """
+    Render the synthetic images of a Process API request.
+
+    :param payload: Body of the request.
+    :return: The image of every requested output by identifier, in OpenCV channel order. Index outputs are float32.
+    """
+    west, south, east, north = payload["input"]["bounds"]["bbox"]
+    width, height = payload["output"]["width"], payload["output"]["height"]
+    longitudes = west + (np.arange(width) + 0.5) * (east - west) / width
+    latitudes = north - (np.arange(height) + 0.5) * (north - south) / height
+    lon, lat = np.meshgrid(longitudes, latitudes)
+
+    def wave(values: np.ndarray) -> np.ndarray:
+        return (127.5 + 127.5 * np.sin(values)).astype(np.uint8)
+
+    images = {
+        "rgb": np.dstack([wave(lon * 400), wave(lat * 500), wave((lon + lat) * 300)]),
+        "moisture_index": np.sin(lon * 200 + lat * 100).astype(np.float32),
+        "water_index": np.sin(lon * 250 + lat * 350).astype(np.float32),
+    }
+    return {response["identifier"]: images[response["identifier"]] for response in payload["output"]["responses"]}
+
+
+def encode_tar(images: Dict[str, np.ndarray], formats: Dict[str, str]) -> bytes:
+    """
+    Pack images into a tar archive, as the Process API does for requests with several outputs.
+
+    :param images: The image of every output by identifier.
+    :param formats: MIME type of every output by identifier.
+    :return: The archive.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for identifier, image in images.items():
+            extension = ".tif" if formats[identifier] == "image/tiff" else ".png"
+            data = cv2.imencode(extension, image)[1].tobytes()
+            info = tarfile.TarInfo(f"{identifier}{extension}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class StandInServer:
+    """A Process API stand-in running on a local port in a background thread."""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        """
+        Initialize the server.
+
+        :param latency: Delay of every response in seconds.
+        :param failure_rate: Share of requests answered with 503 Service Unavailable.
+        :param seed: Seed of the random failures.
+        """
+        self.requests = 0
+        self.failures = 0
+        server = self
+        random_generator = random.Random(seed)
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep(latency)
+                with lock:
+                    server.requests += 1
+                    fail = random_generator.random() < failure_rate
+                    server.failures += fail
+
+                if self.path != PROCESS_API_PATH or fail:
+                    self.send_response(404 if self.path != PROCESS_API_PATH else 503)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                formats = {response["identifier"]: response["format"]["type"] for response in payload["output"]["responses"]}
+                body = encode_tar(render_outputs(payload), formats)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-tar")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StandInServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the tiled Process API download against a local stand-in.")
+    parser.add_argument("--size", type=int, default=2048, help="Width and height of the downloaded images.")
+    parser.add_argument("--max-request-size", type=int, default=512, help="Maximum width and height of a sub-request.")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum number of concurrent sub-requests.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated latency of every response in seconds.")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="Share of responses failing with 503.")
+    arguments = parser.parse_args()
+
+    outputs = ["rgb", "moisture_index", "water_index"]
+    formats = {"moisture_index": "image/tiff", "water_index": "image/tiff"}
+    time_interval = ("2024-01-01", "2024-12-31")
+
+    with StandInServer(latency=arguments.latency, failure_rate=arguments.failure_rate) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        client = ProcessApiClient(requests.Session(), base_url=server.url, backoff=0.01)
+        reference = MosaicDownloader(client, max_request_size=arguments.size, max_workers=1) \
+            .download(BENCHMARK_BOUNDS, arguments.size, arguments.size, "", time_interval, outputs, directory, formats=formats)
+        reference = {name: np.array(mosaic) for name, mosaic in reference.items()}
+
+        timings = {}
+        for workers in sorted({1, arguments.workers}):
+            start = time.perf_counter()
+            mosaics = MosaicDownloader(client, max_request_size=arguments.max_request_size, max_workers=workers) \
+                .download(BENCHMARK_BOUNDS, arguments.size, arguments.size, "", time_interval, outputs, directory, formats=formats)
+            timings[workers] = time.perf_counter() - start
+
+            # Float outputs of a tile may differ from the whole image in the last bits of the pixel coordinates.
+            mismatches = [name for name in outputs if not np.allclose(mosaics[name], reference[name], rtol=0, atol=1e-5)]
+            if mismatches:
+                print(f"Mosaic differs from a single request: {', '.join(mismatches)}")
+                return 1
+
+        print(f"{server.requests} requests, {server.failures} failed and retried")
+        for workers, elapsed in timings.items():
+            print(f"{workers:>3} workers: {elapsed:6.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Deterministic stand-ins for the models and the satellite download, so the pipeline runs on a CPU without model weights
+or Sentinel Hub credentials.
+
+The stub models answer every prompt with a text derived from the prompt and their inputs, after sleeping for a
+configurable time that simulates loading, prefill and decoding. A micro-batch pays the latency of one generate call, as
+batched prompts share their decoding steps on an accelerator.
+"""
+import hashlib
+import os
+import shutil
+import time
+from typing import Any, Dict, List, override
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from benchmarks.water_mask import synthetic_water_index
+from models import register_model
+from models.model import Model
+from models.perception.perception_model import PerceptionModel
+from models.prefix_session import PrefixTimings
+from modules.module import Module, ModuleResult
+from pipeline.tracing import tracer
+from processing.visualization import MOISTURE_RAMP, color_ramp
+
+# Models the pipeline modules create, replaced by stubs while benchmarking.
+STUBBED_MODELS = ["InternLM", "ThreeSixtyVLModel"]
+
+FIXTURE_IMAGES = ["rgb.png", "moisture.png", "water.png"]
+
+# Tokens an input image takes up in the prompts of the stub perception model, the 24 x 24 patches of the 360VL encoder.
+IMAGE_TOKENS = 576
+
+
+class StubGeneration:
+    """
+    Simulated generation shared by the stub models.
+
+    The latency of a generate call is call_latency + tokens * token_latency, independent of the number of prompts in it.
+    With a shared prefix, the prefix is prefilled in one call and every prompt is then decoded on its own. The prompt
+    tokens prefilled so far, including the tokens of the input images, are counted in prefill_tokens.
+    """
+
+    def configure(self, call_latency: float, token_latency: float, load_latency: float, tokens: int) -> None:
+        """
+        Configure the simulated latencies.
+
+        :param call_latency: Seconds every generate call takes, e.g. for the prefill.
+        :param token_latency: Seconds every generated token takes.
+        :param load_latency: Seconds loading the model takes.
+        :param tokens: Number of tokens generated per prompt.
+        """
+        self.call_latency = call_latency
+        self.token_latency = token_latency
+        self.load_latency = load_latency
+        self.tokens = tokens
+        self.prefill_tokens = 0
+        # Benchmarks measure the generation, so responses are never served from a cache.
+        self.response_cache = None
+
+    def load(self) -> Dict[str, Any]:
+        time.sleep(self.load_latency)
+        return {"model": None, "tokenizer": None}
+
+    def run_batch(self, system_prompt: str, prompts: List[str]) -> List[str]:
+        # Acquiring the components goes through the model manager like a real model.
+        _ = self.components
+        inputs = self.stub_inputs()
+
+        time.sleep(self.call_latency + self.tokens * self.token_latency)
+        prompt_tokens = sum(self.input_tokens() + len(f"{system_prompt} {prompt}".split()) for prompt in prompts)
+        self.prefill_tokens += prompt_tokens
+        tracer().count(prompt_tokens=prompt_tokens, generated_tokens=self.tokens * len(prompts))
+
+        return [self.respond(system_prompt, prompt, inputs) for prompt in prompts]
+
+    def run_with_shared_prefix(self, system_prompt: str, prompts: List[str]) -> List[str]:
+        _ = self.components
+        inputs = self.stub_inputs()
+
+        # The inputs and the system prompt form the shared prefix, prefilled once. The questions are decoded one by one.
+        timings = PrefixTimings()
+        timings.prefix_tokens = self.input_tokens() + len(system_prompt.split())
+        timings.suffix_tokens = sum(len(prompt.split()) for prompt in prompts)
+        timings.decode_tokens = self.tokens * len(prompts)
+        timings.questions = len(prompts)
+
+        start = time.perf_counter()
+        time.sleep(self.call_latency)
+        timings.prefix_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        time.sleep(self.tokens * self.token_latency * len(prompts))
+        timings.decode_seconds = time.perf_counter() - start
+
+        self.last_prefix_timings = timings
+        self.prefill_tokens += timings.prefix_tokens + timings.suffix_tokens
+        tracer().count(prompt_tokens=timings.prefix_tokens + timings.suffix_tokens, generated_tokens=timings.decode_tokens,
+                       prefill_seconds=timings.prefix_seconds, decode_seconds=timings.decode_seconds)
+        return [self.respond(system_prompt, prompt, inputs) for prompt in prompts]
+
+    def inference(self, system_prompt: str, prompt: str) -> str:
+        return self.run_batch(system_prompt, [prompt])[0]
+
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        # The stub models have no tokenizer and count words instead, as in run_batch.
+        return [len(text.split()) for text in texts]
+
+    def input_tokens(self) -> int:
+        """
+        Count the tokens the inputs besides the prompts occupy in every prompt.
+
+        :return: The number of tokens.
+        """
+        return 0
+
+    def stub_inputs(self) -> str:
+        """
+        Describe the inputs besides the prompts, so that the responses depend on them.
+
+        :return: A description of the inputs.
+        """
+        return ""
+
+    def respond(self, system_prompt: str, prompt: str, inputs: str) -> str:
+        """
+        Create the deterministic response to a prompt.
+
+        :param system_prompt: The system prompt.
+        :param prompt: The user prompt.
+        :param inputs: The description of the further inputs.
+        :return: The response.
+        """
+        digest = hashlib.sha256(f"{self.name}\0{system_prompt}\0{prompt}\0{inputs}".encode("utf-8")).hexdigest()
+        return f"{prompt.split('?')[0][:40]}: answer {digest[:12]}{inputs}"
+
+
+class StubModel(StubGeneration, Model):
+    """Stand-in for the language model of the climate report."""
+
+    def __init__(self, call_latency: float = 0.0, token_latency: float = 0.0, load_latency: float = 0.0, tokens: int = 64):
+        super().__init__("stub/language-model")
+        # The context length of InternLM 2.5, which the stub stands in for.
+        self.context_length = 32768
+        self.configure(call_latency, token_latency, load_latency, tokens)
+
+
+class StubPerceptionModel(StubGeneration, PerceptionModel):
+    """
+    Stand-in for the vision-language model of the image analyses, which loads its input images like the real one:
+    as RGB from the image pool, reduced to the 336 pixel input size of the 360VL vision encoder.
+    """
+
+    def __init__(self, call_latency: float = 0.0, token_latency: float = 0.0, load_latency: float = 0.0, tokens: int = 64):
+        super().__init__("stub/perception-model")
+        self.pre_resize = True
+        self.configure(call_latency, token_latency, load_latency, tokens)
+
+    @override
+    def input_size(self) -> int | None:
+        return 336
+
+    @override
+    def input_tokens(self) -> int:
+        return IMAGE_TOKENS * len(self.image_paths or self.images)
+
+    def stub_inputs(self) -> str:
+        return "".join(f" [image {image.width}x{image.height}]" for image in self.load_images())
+
+
+def register_stub_models(call_latency: float = 0.0, token_latency: float = 0.0, load_latency: float = 0.0, tokens: int = 64) -> None:
+    """
+    Make create_model return stub models instead of the real ones.
+
+    :param call_latency: Seconds every generate call takes.
+    :param token_latency: Seconds every generated token takes.
+    :param load_latency: Seconds loading a model takes.
+    :param tokens: Number of tokens generated per prompt.
+    """
+    register_model("InternLM", lambda: StubModel(call_latency, token_latency, load_latency, tokens))
+    register_model("ThreeSixtyVLModel", lambda: StubPerceptionModel(call_latency, token_latency, load_latency, tokens))
+
+
+def unregister_stub_models() -> None:
+    """Make create_model return the real models again."""
+    for name in STUBBED_MODELS:
+        register_model(name, None)
+
+
+def write_fixtures(directory: str, size: int, seed: int = 0) -> None:
+    """
+    Write synthetic satellite images as they are stored after a manual download.
+
+    :param directory: Directory the images are written to. It is created if necessary.
+    :param size: Width and height of the images in pixels.
+    :param seed: Seed of the random generator.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    # Smooth fields plus noise, so the PNGs neither compress trivially nor consist of noise only.
+    coordinates = np.linspace(0, 8 * np.pi, size, dtype=np.float32)
+    x, y = np.meshgrid(coordinates, coordinates)
+    field = np.sin(x + rng.uniform(0, np.pi)) * np.cos(y * 0.7)
+    noise = rng.normal(0, 0.1, (size, size, 3)).astype(np.float32)
+
+    rgb = np.clip(127.5 + 100 * field[..., None] + 40 * noise, 0, 255).astype(np.uint8)
+    Image.fromarray(rgb).save(os.path.join(directory, "rgb.png"))
+
+    moisture = color_ramp(np.clip(field * 0.6 + noise[..., 0], -1, 1), MOISTURE_RAMP)
+    Image.fromarray(moisture).save(os.path.join(directory, "moisture.png"))
+
+    cv2.imwrite(os.path.join(directory, "water.png"), synthetic_water_index(size, seed))
+
+
+class FixtureLoader(Module):
+    """Stand-in for SatelliteLoader that links the satellite data directory of the run to a directory of fixtures."""
+
+    def __init__(self, fixture_dir: str):
+        """
+        Initialize the module.
+
+        :param fixture_dir: Directory containing the fixture images, see write_fixtures.
+        """
+        super().__init__("SatelliteLoader", {"LocationExtraction"}, resources={"network"})
+        self.fixture_dir = os.path.realpath(fixture_dir)
+
+    @override
+    def main(self) -> ModuleResult:
+        satellite_dir = self.context.satellite_dir
+        if os.path.islink(satellite_dir):
+            os.remove(satellite_dir)
+        elif os.path.isdir(satellite_dir):
+            shutil.rmtree(satellite_dir)
+
+        os.makedirs(os.path.dirname(satellite_dir), exist_ok=True)
+        os.symlink(self.fixture_dir, satellite_dir, target_is_directory=True)
+        return ModuleResult.OK
@@ -0,0 +1,103 @@
+"""
+Compares the per-label component filter of the original water preprocessing with the lookup-table filter of the
+WaterMaskEngine on synthetic water index images, and checks that both produce the same mask.
+
+The per-label filter touches every pixel once per component, so it is only run on the small image by default.
+
+Usage: python -m benchmarks.water_mask [--sizes 1024 8192] [--legacy-max-size N] [--repeats N]
+"""
+import argparse
+import sys
+import time
+from typing import Callable, List
+
+import cv2
+import numpy as np
+
+from processing.water_mask import WaterMaskEngine
+
+
+def synthetic_water_index(size: int, seed: int = 0) -> np.ndarray:
+    """
+    Create a grayscale water index image with a river, a few lakes and many small blobs.
+
+    :param size: Width and height of the image in pixels.
+    :param seed: Seed of the random generator.
+    :return: 8-bit grayscale image.
+    """
+    rng = np.random.default_rng(seed)
+    # Square blobs are removed by the area filter, elongated ones such as ditches are kept by the aspect ratio filter.
+    image = np.zeros((size, size), dtype=np.uint8)
+    for kernel_size in [(5, 5), (11, 3)]:
+        specks = (rng.random((size, size)) < 0.0005).astype(np.uint8) * 255
+        image |= cv2.dilate(specks, cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size))
+
+    columns = np.arange(size)
+    river = (size / 2 + size / 8 * np.sin(columns / size * 4 * np.pi)).astype(int)
+    for offset in range(-max(size // 200, 2), max(size // 200, 2) + 1):
+        image[np.clip(river + offset, 0, size - 1), columns] = 200
+
+    for _ in range(8):
+        center = tuple(int(value) for value in rng.integers(0, size, 2))
+        cv2.circle(image, center, int(rng.integers(size // 100 + 5, size // 20 + 10)), 180, -1)
+    return image
+
+
+def legacy_filter(engine: WaterMaskEngine, binary: np.ndarray) -> np.ndarray:
+    """The original component filter, which compares the whole label image once per component."""
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    area_filtered = np.zeros_like(binary)
+
+    for i in range(1, num_labels):
+        area = stats[i, cv2.CC_STAT_AREA]
+        width = stats[i, cv2.CC_STAT_WIDTH]
+        height = stats[i, cv2.CC_STAT_HEIGHT]
+        aspect_ratio = float(width) / height if height > 0 else 0
+
+        if area >= engine.min_area or aspect_ratio >= engine.min_aspect_ratio:
+            area_filtered[labels == i] = 255
+    return area_filtered
+
+
+def fastest(function: Callable[[], np.ndarray], repeats: int) -> float:
+    """Return the fastest wall time of a function in seconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the water mask component filter.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 8192], help="Image sizes in pixels.")
+    parser.add_argument("--legacy-max-size", type=int, default=1024, help="Largest size the per-label filter is run on.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs per measurement; the fastest one counts.")
+    arguments = parser.parse_args()
+
+    engine = WaterMaskEngine()
+    mismatches: List[int] = []
+
+    for size in arguments.sizes:
+        binary = engine.clean(engine.binarize(synthetic_water_index(size)))
+        components = cv2.connectedComponentsWithStats(binary, connectivity=8)[0] - 1
+
+        lut_time = fastest(lambda: engine.filter_components(binary), arguments.repeats)
+        total_time = fastest(lambda: engine.process(synthetic_water_index(size)), 1)
+        line = f"{size:>5}² {components:>7} components  lookup table {lut_time * 1000:9.1f} ms  full mask {total_time * 1000:9.1f} ms"
+
+        if size <= arguments.legacy_max_size:
+            legacy_time = fastest(lambda: legacy_filter(engine, binary), arguments.repeats)
+            if not np.array_equal(legacy_filter(engine, binary), engine.filter_components(binary)):
+                mismatches.append(size)
+            line += f"  per label {legacy_time * 1000:9.1f} ms  speed-up {legacy_time / lut_time:6.1f}x"
+        print(line)
+
+    for size in mismatches:
+        print(f"Mismatch between the filters at {size}²")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
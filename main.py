@@ -1,82 +1,127 @@
-from collections import deque
-from enum import Enum, auto
-
-from modules import MoistureAnalysis, RGBAnalysis, SatelliteLoader, LocationExtraction, ClimateReport, WaterPreprocessing, WaterAnalysis, WaterRGBAnalysis
-from modules.module import ModuleResult
-
-
-class DependencyResult(Enum):
-    """Enum to represent the result of a dependency check."""
-    ALL_SATISFIED = auto()
-    MISSING = auto()
-    STOP_PIPELINE = auto()
+import argparse
+from typing import Any, Dict, List, Set
+
+from models.device import DeviceConfig, set_device_config
+from models.manager import ModelManager, set_model_manager
+from models.response_cache import ResponseCache, set_default_response_cache
+from models.server import DEFAULT_SOCKET_PATH, ModelClient, set_model_client
+from modules import create_module, create_with_dependencies, module_names
+from modules.module import Module
+from pipeline import Tracer, load_locations, run_batch, set_tracer
+from satellite.geocoding import GeocodeCache, Geocoder, set_default_geocoder
+
+
+PIPELINE_MODULES = ["LocationExtraction",
+                    "MoistureAnalysis",
+                    "ClimateReport",
+                    "RGBAnalysis",
+                    "WaterPreprocessing",
+                    "WaterAnalysis",
+                    "WaterRGBAnalysis",
+                    "SatelliteLoader"]
+
+
+def create_modules(targets: Set[str] = None, soft_dependencies: bool = False, options: Dict[str, Dict[str, Any]] = None) -> List[Module]:
+    """
+    Create a fresh set of pipeline modules. Module classes and their dependencies are imported on first use.
+
+    :param targets: Names of the modules whose results are needed, or None for all pipeline modules. Only the targets and
+        the modules they depend on are created.
+    :param soft_dependencies: Whether the targets also need their soft dependencies.
+    :param options: Constructor keyword arguments by module name, e.g. {"ClimateReport": {"max_seconds": 600}}.
+    :return: The modules in pipeline order.
+    """
+    options = options if options is not None else {}
+
+    def create(name: str) -> Module:
+        return create_module(name, **options.get(name, {}))
+
+    if targets is None:
+        return [create(name) for name in PIPELINE_MODULES]
+    modules = create_with_dependencies(targets, soft_dependencies=soft_dependencies, create=create)
+    return sorted(modules, key=lambda module: PIPELINE_MODULES.index(module.name) if module.name in PIPELINE_MODULES else len(PIPELINE_MODULES))
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the EcoScapes module pipeline.")
+    parser.add_argument("locations", nargs="*", help="Names of the locations to process.")
+    parser.add_argument("--locations-file", help="File with one location name per line.")
+    parser.add_argument("--root", default=".", help="Directory below which the data of all runs is stored.")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum number of modules running at the same time.")
+    parser.add_argument("--gpu-slots", type=int, default=1, help="Maximum number of GPU modules running at the same time.")
+    parser.add_argument("--device", default="auto", help="Torch device the models run on, e.g. cuda or cpu. By default, an available accelerator is used.")
+    parser.add_argument("--dtype", help="Torch dtype of the model weights, e.g. bfloat16. By default, float16 on CUDA and float32 elsewhere.")
+    parser.add_argument("--quantization", choices=["auto", "4bit", "int8", "none"], default="auto", help="Quantization of the model weights: 4bit with bitsandbytes on CUDA, dynamic int8 on the CPU.")
+    parser.add_argument("--threads", type=int, help="Number of threads torch parallelizes a single operation with.")
+    parser.add_argument("--interop-threads", type=int, help="Number of threads torch runs independent operations on.")
+    parser.add_argument("--model-memory-budget", type=float, help="Maximum memory in GiB the models resident on the accelerator may use. Without a budget, loaded models are kept for the whole batch.")
+    parser.add_argument("--model-server", nargs="?", const=DEFAULT_SOCKET_PATH, help="Generate through a resident model server listening on this socket instead of loading the models in the process, see models/server.py.")
+    parser.add_argument("--response-cache", default="./model_cache", help="Directory of the persistent model response cache.")
+    parser.add_argument("--response-cache-size", type=int, default=1024, help="Maximum size of the model response cache in MiB.")
+    parser.add_argument("--no-response-cache", action="store_true", help="Always run the models instead of reusing cached responses.")
+    parser.add_argument("--geocode-cache", default="./geocode_cache.sqlite3", help="Database of the persistent geocode cache.")
+    parser.add_argument("--gazetteer", help="Offline gazetteer to import into the geocode cache, a CSV file or a GeoNames dump.")
+    parser.add_argument("--gazetteer-country", default="Germany", help="Country of the gazetteer places that do not name one.")
+    parser.add_argument("--offline-geocoding", action="store_true", help="Only use cached and imported places instead of querying Nominatim.")
+    parser.add_argument("--report-max-seconds", type=float, help="Maximum time in seconds the climate report is generated for. The report generated so far is kept.")
+    parser.add_argument("--report-max-tokens", type=int, help="Maximum number of tokens of the climate report.")
+    parser.add_argument("--target", nargs="+", choices=module_names(), metavar="MODULE", help="Only run these modules and the modules they depend on, e.g. WaterPreprocessing for the water mask alone.")
+    parser.add_argument("--with-soft-dependencies", action="store_true", help="With --target, also run the soft dependencies of the targets and their dependencies.")
+    parser.add_argument("--no-incremental", action="store_true", help="Run every module, even if its results of an earlier run are up to date.")
+    parser.add_argument("--invalidate", nargs="+", default=[], metavar="MODULE", help="Run these modules and everything downstream of them, even if their results are up to date.")
+    parser.add_argument("--trace-dir", help="Directory the Chrome trace of every run is written to, viewable in chrome://tracing or Perfetto.")
+    parser.add_argument("--no-tracing", action="store_true", help="Do not record timings, memory and token counts of the modules and models.")
+    return parser.parse_args()
 
 
 def main():
-    modules = [LocationExtraction(),
-               MoistureAnalysis(),
-               ClimateReport(),
-               RGBAnalysis(),
-               WaterPreprocessing(),
-               WaterAnalysis(),
-               WaterRGBAnalysis(),
-               SatelliteLoader()]
-
-    # Sets to keep track of run and failed modules
-    run_set = set()
-    failed_set = set()
-
-    # Dictionary for quick module lookup by name
-    module_dict = {module.name: module for module in modules}
-
-    # Stack to manage module processing order
-    module_deque = deque(modules)
-
-    def check_dependencies(module) -> DependencyResult:
-        """Check if all dependencies and soft dependencies of the module have been run."""
-        dependencies = module.dependencies
-        soft_dependencies = module.soft_dependencies
-
-        if any(dep in failed_set for dep in dependencies):
-            print(f"Skipping {module.name} as one or more hard dependencies failed or requested a stop of their dependency pipeline.")
-            return DependencyResult.STOP_PIPELINE
-        elif not all(dep in run_set for dep in dependencies):
-            missing_deps = [module_dict[dep] for dep in dependencies if dep not in run_set]
-            module_deque.extend(missing_deps)
-            return DependencyResult.MISSING
-        elif not all(soft_dep in run_set or soft_dep in failed_set for soft_dep in soft_dependencies):
-            missing_soft_deps = [module_dict[soft_dep] for soft_dep in soft_dependencies if soft_dep not in run_set and soft_dep not in failed_set]
-            module_deque.extend(missing_soft_deps)
-            return DependencyResult.MISSING
-        return DependencyResult.ALL_SATISFIED
-
-    def execute_module(module) -> None:
-        """Execute the module and handle the result."""
-        print(f"Running module {module.name}")
-        match module.main():
-            case ModuleResult.OK:
-                print(f"Module {module.name} finished successfully")
-                run_set.add(module.name)
-            case ModuleResult.ERROR:
-                print(f"Module {module.name} failed with an error")
-                failed_set.add(module.name)
-            case ModuleResult.STOP_PIPELINE:
-                print(f"Module {module.name} requested to stop its pipeline")
-                failed_set.add(module.name)
-
-    while module_deque:
-        module = module_deque.pop()
-
-        if module.name in run_set or module.name in failed_set:
-            continue
-
-        match check_dependencies(module):
-            case DependencyResult.ALL_SATISFIED:
-                execute_module(module)
-            case DependencyResult.MISSING:
-                module_deque.appendleft(module)
-            case DependencyResult.STOP_PIPELINE:
-                failed_set.add(module.name)
+    arguments = parse_arguments()
+
+    locations = list(arguments.locations)
+    if arguments.locations_file:
+        locations.extend(load_locations(arguments.locations_file))
+    if not locations:
+        locations = ["Erlangen"]
+
+    set_device_config(DeviceConfig(arguments.device, arguments.dtype, None if arguments.quantization == "none" else arguments.quantization,
+                                   arguments.threads, arguments.interop_threads))
+    if arguments.model_memory_budget is not None:
+        set_model_manager(ModelManager(memory_budget=int(arguments.model_memory_budget * 1024 ** 3)))
+
+    if arguments.model_server:
+        set_model_client(ModelClient(arguments.model_server))
+
+    geocode_cache = GeocodeCache(arguments.geocode_cache)
+    if arguments.gazetteer:
+        print(f"Imported {geocode_cache.import_gazetteer(arguments.gazetteer, country=arguments.gazetteer_country)} places from {arguments.gazetteer}")
+    set_default_geocoder(Geocoder(geocode_cache, offline=arguments.offline_geocoding))
+
+    response_cache = None
+    if not arguments.no_response_cache:
+        response_cache = ResponseCache(arguments.response_cache, max_bytes=arguments.response_cache_size * 1024 * 1024)
+    set_default_response_cache(response_cache)
+
+    if arguments.no_tracing:
+        set_tracer(Tracer(enabled=False))
+
+    targets = set(arguments.target) if arguments.target else None
+    options = {"ClimateReport": {"max_seconds": arguments.report_max_seconds, "max_tokens": arguments.report_max_tokens}}
+    announced = targets is None
+
+    def module_factory() -> List[Module]:
+        nonlocal announced
+        modules = create_modules(targets, arguments.with_soft_dependencies, options)
+        # Announced with the modules of the first run, as every run creates the same ones.
+        if not announced:
+            print(f"Running {', '.join(module.name for module in modules)} for the targets {', '.join(sorted(targets))}")
+            announced = True
+        return modules
+
+    run_batch(locations, module_factory, root=arguments.root, max_workers=arguments.workers, resource_limits={"gpu": arguments.gpu_slots},
+              trace_dir=arguments.trace_dir, incremental=not arguments.no_incremental, invalidate=set(arguments.invalidate))
+
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.hits} hits, {response_cache.misses} misses")
 
 
 if __name__ == "__main__":
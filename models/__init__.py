@@ -1,6 +1,69 @@
-from models.intern_lm import InternLM
-from models.llama_three import LlamaThree
-from models.model import Model
-from models.phi_three_small import PhiThreeSmall
+import importlib
+from typing import Callable, Dict
 
-__all__ = ["Model", "InternLM"]
+# Model classes by name, mapped to the submodule defining them. Submodules are only imported once a model is requested,
+# so torch and transformers are only loaded by modules that actually run a model.
+MODELS: Dict[str, str] = {
+    "InternLM": "models.intern_lm",
+    "Model": "models.model",
+    "PerceptionModel": "models.perception.perception_model",
+    "ThreeSixtyVLModel": "models.perception.three_sixty_vl",
+}
+
+_factories: Dict[str, Callable[[], "Model"]] = {}
+
+
+def get_model_class(name: str) -> type:
+    """
+    Imports and returns a model class by name.
+
+    Args:
+        name (str): The name of the model class.
+
+    Returns:
+        type: The model class.
+
+    Raises:
+        KeyError: If no model class with this name exists.
+    """
+    if name not in MODELS:
+        raise KeyError(f"Unknown model: {name}")
+    return getattr(importlib.import_module(MODELS[name]), name)
+
+
+def register_model(name: str, factory: Callable[[], "Model"] | None) -> None:
+    """
+    Registers a factory that create_model uses instead of the model class, e.g. to substitute stub models.
+
+    Args:
+        name (str): The name of the model class.
+        factory (Callable[[], Model] | None): The factory creating the model, or None to remove a registered factory.
+    """
+    if factory is None:
+        _factories.pop(name, None)
+    else:
+        _factories[name] = factory
+
+
+def create_model(name: str) -> "Model":
+    """
+    Creates a model by name, importing its dependencies on first use.
+
+    Args:
+        name (str): The name of the model class.
+
+    Returns:
+        Model: A new instance of the model.
+    """
+    if name in _factories:
+        return _factories[name]()
+    return get_model_class(name)()
+
+
+def __getattr__(name: str):
+    if name in MODELS:
+        return get_model_class(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["Model", "InternLM", "create_model", "get_model_class", "register_model"]
@@ -0,0 +1,201 @@
+import math
+import time
+from typing import Any, Dict, List
+
+from pipeline.tracing import tracer
+
+SUMMARY_SYSTEM_PROMPT = ("You condense analyses of satellite images for a climate scientist."
+                         " Keep every concrete fact: places, directions, distances, sizes and densities. Do not add anything.")
+
+# Approximate number of English words per token, used to phrase the length limit of a summary.
+WORDS_PER_TOKEN = 0.75
+
+
+class StageStats:
+    """
+    Token counts and wall time of one stage of building a prompt or generating from it.
+
+    Attributes:
+        name (str): The name of the stage, e.g. "map" or "report".
+        input_tokens (int): The number of tokens the stage read.
+        output_tokens (int): The number of tokens the stage produced.
+        seconds (float): The wall time of the stage.
+        calls (int): The number of prompts the model answered in the stage.
+    """
+
+    def __init__(self, name: str, input_tokens: int, output_tokens: int, seconds: float, calls: int = 0) -> None:
+        self.name: str = name
+        self.input_tokens: int = input_tokens
+        self.output_tokens: int = output_tokens
+        self.seconds: float = seconds
+        self.calls: int = calls
+
+
+class ContextBuilder:
+    """
+    Packs named text sections into a prompt that fits a token budget, measured with the tokenizer of the model that
+    answers the prompt.
+
+    Sections that fit are kept verbatim. Otherwise, the budget is shared between the sections, with sections shorter
+    than their share keeping their full text, and the longer sections are summarized map-reduce style: each is split
+    into chunks that are summarized independently, all chunks of all sections in one batched multi_run call, and the
+    joined summaries are summarized again until they fit. Text that still does not fit after the last round is cut off.
+
+    Attributes:
+        stats (List[StageStats]): The stages of the last build, in order.
+    """
+
+    def __init__(self, model: Any, prompt_budget: int, chunk_tokens: int = 4096, max_rounds: int = 3, min_summary_tokens: int = 64) -> None:
+        """
+        Initializes the builder.
+
+        Args:
+            model (Model): The model that answers the prompt, which also counts tokens and writes the summaries.
+            prompt_budget (int): The maximum number of tokens of system prompt and prompt together.
+            chunk_tokens (int): The maximum number of tokens of a chunk summarized in one prompt.
+            max_rounds (int): The maximum number of summarization rounds before the sections are cut off.
+            min_summary_tokens (int): The minimum length of a chunk summary in tokens.
+        """
+        self.model: Any = model
+        self.prompt_budget: int = prompt_budget
+        self.chunk_tokens: int = chunk_tokens
+        self.max_rounds: int = max_rounds
+        self.min_summary_tokens: int = min_summary_tokens
+        self.stats: List[StageStats] = []
+
+    def build(self, system_prompt: str, instructions: str, sections: Dict[str, str]) -> str:
+        """
+        Builds a prompt from instructions followed by the sections, as " The <name>: <text>" each.
+
+        Args:
+            system_prompt (str): The system prompt the prompt is answered with, which counts against the budget.
+            instructions (str): The instructions that start the prompt and are always kept verbatim.
+            sections (Dict[str, str]): The texts to pack by name, in prompt order.
+
+        Returns:
+            str: The prompt.
+        """
+        self.stats = []
+        start = time.perf_counter()
+        with tracer().span("measure", "stage") as span:
+            fixed, *lengths = self.model.token_lengths([f"{system_prompt} {instructions}" + "".join(f" The {name}: " for name in sections),
+                                                        *sections.values()])
+            self._record("measure", span, start, sum(lengths) + fixed, sum(lengths) + fixed)
+
+        texts = dict(sections)
+        tokens = dict(zip(sections, lengths))
+        shares = self._shares(tokens, self.prompt_budget - fixed)
+
+        for round_index in range(self.max_rounds):
+            over = [name for name in texts if tokens[name] > shares[name]]
+            if not over:
+                break
+            if not self._summarize("map" if round_index == 0 else "reduce", over, texts, tokens, shares):
+                break
+
+        for name in texts:
+            if tokens[name] > shares[name]:
+                print(f"The {name} still has {tokens[name]} tokens after summarizing, cutting it off at {shares[name]}")
+                texts[name] = texts[name][:len(texts[name]) * max(shares[name], 0) // tokens[name]]
+                tokens[name] = shares[name]
+
+        return instructions + "".join(f" The {name}: {text}" for name, text in texts.items())
+
+    def record_stage(self, name: str, input_tokens: int, output_tokens: int, seconds: float, calls: int = 0) -> None:
+        """
+        Adds a stage that ran outside the builder, e.g. generating the final answer, to the stats.
+
+        Args:
+            name (str): The name of the stage.
+            input_tokens (int): The number of tokens the stage read.
+            output_tokens (int): The number of tokens the stage produced.
+            seconds (float): The wall time of the stage.
+            calls (int): The number of prompts the model answered in the stage.
+        """
+        self.stats.append(StageStats(name, input_tokens, output_tokens, seconds, calls))
+
+    def summary(self) -> str:
+        """
+        Formats a table of the stages of the last build.
+
+        Returns:
+            str: The table.
+        """
+        lines = [f"{'stage':<10} {'calls':>6} {'in tok':>8} {'out tok':>8} {'wall s':>8}"]
+        for stage in self.stats:
+            lines.append(f"{stage.name:<10} {stage.calls:>6} {stage.input_tokens:>8} {stage.output_tokens:>8} {stage.seconds:>8.2f}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _shares(tokens: Dict[str, int], available: int) -> Dict[str, int]:
+        """Shares the available tokens between the sections, giving sections shorter than an equal share their full length."""
+        shares = {}
+        remaining = max(available, 0)
+        pending = sorted(tokens, key=tokens.__getitem__)
+        while pending:
+            name = pending.pop(0)
+            shares[name] = min(tokens[name], remaining // (len(pending) + 1))
+            remaining -= shares[name]
+        return shares
+
+    def _summarize(self, stage: str, names: List[str], texts: Dict[str, str], tokens: Dict[str, int], shares: Dict[str, int]) -> bool:
+        """
+        Runs one summarization round over the sections that exceed their share and replaces their texts.
+
+        Returns:
+            bool: Whether the round made the sections shorter, i.e. whether another round can help.
+        """
+        start = time.perf_counter()
+        with tracer().span(stage, "stage") as span:
+            chunks = {name: self._chunks(texts[name]) for name in names}
+            prompts, owners, limits = [], [], []
+            for name in names:
+                for chunk, length in chunks[name]:
+                    # Every chunk may keep its proportion of the share of its section.
+                    limit = max(self.min_summary_tokens, shares[name] * length // max(tokens[name], 1))
+                    prompts.append(f"Summarize this part of the {name} in at most {int(limit * WORDS_PER_TOKEN)} words:\n\n{chunk}")
+                    owners.append(name)
+                    limits.append(limit)
+
+            max_new_tokens = self.model.max_new_tokens
+            self.model.max_new_tokens = max(limits)
+            try:
+                summaries = self.model.multi_run(SUMMARY_SYSTEM_PROMPT, prompts)
+            finally:
+                self.model.max_new_tokens = max_new_tokens
+
+            before = sum(tokens[name] for name in names)
+            for name in names:
+                texts[name] = "\n".join(summary for summary, owner in zip(summaries, owners) if owner == name)
+            for name, length in zip(names, self.model.token_lengths([texts[name] for name in names])):
+                tokens[name] = length
+            after = sum(tokens[name] for name in names)
+            self._record(stage, span, start, before, after, len(prompts))
+        return after < before
+
+    def _chunks(self, text: str) -> List[tuple[str, int]]:
+        """Splits a text at line breaks into chunks of at most chunk_tokens tokens, splitting longer lines at spaces."""
+        lines = [line for line in text.split("\n") if line.strip()]
+        pieces = []
+        for line, length in zip(lines, self.model.token_lengths(lines)):
+            if length <= self.chunk_tokens:
+                pieces.append((line, length))
+                continue
+            words = line.split(" ")
+            parts = math.ceil(length / self.chunk_tokens)
+            size = math.ceil(len(words) / parts)
+            pieces.extend((" ".join(words[index:index + size]), length // parts) for index in range(0, len(words), size))
+
+        chunks: List[tuple[str, int]] = []
+        for piece, length in pieces:
+            if chunks and chunks[-1][1] + length <= self.chunk_tokens:
+                chunks[-1] = (chunks[-1][0] + "\n" + piece, chunks[-1][1] + length)
+            else:
+                chunks.append((piece, length))
+        return chunks
+
+    def _record(self, stage: str, span: Any, start: float, input_tokens: int, output_tokens: int, calls: int = 0) -> None:
+        """Adds a stage to the stats and its token counts to its span."""
+        self.stats.append(StageStats(stage, input_tokens, output_tokens, time.perf_counter() - start, calls))
+        if span is not None:
+            span.args.update(input_tokens=input_tokens, output_tokens=output_tokens, calls=calls)
@@ -0,0 +1,215 @@
+import importlib.util
+from typing import Any
+
+# Quantizations a device configuration supports. "4bit" loads the weights with bitsandbytes and needs a CUDA device,
+# "int8" quantizes the linear layers dynamically after loading and runs on a CPU.
+QUANTIZATIONS = ("4bit", "int8")
+
+
+class DeviceConfig:
+    """
+    Where and how the models of a process run: on an accelerator or on the CPU, in which dtype, with which quantization
+    and how many CPU threads.
+
+    Everything left to "auto" or None is chosen once torch is available: CUDA if it is available, else Apple's MPS,
+    else the CPU. On CUDA, weights are quantized to 4 bit with bitsandbytes if it is installed and computed in float16.
+    On other devices, the models run unquantized in float32, as half precision is slow on most CPUs.
+
+    Attributes:
+        intra_op_threads (int | None): The number of threads torch parallelizes a single operation with, or None for its default.
+        inter_op_threads (int | None): The number of threads torch runs independent operations on, or None for its default.
+    """
+
+    def __init__(self, device: str = "auto", dtype: str | None = None, quantization: str | None = "auto",
+                 intra_op_threads: int | None = None, inter_op_threads: int | None = None) -> None:
+        """
+        Initializes the configuration.
+
+        Args:
+            device (str): The torch device, e.g. "cuda", "cuda:1" or "cpu", or "auto" to choose one.
+            dtype (str | None): The name of the torch dtype of weights and image inputs, e.g. "bfloat16", or None to choose one.
+            quantization (str | None): "4bit", "int8", None for no quantization or "auto" to choose one.
+            intra_op_threads (int | None): The number of threads torch parallelizes a single operation with, or None for its default.
+            inter_op_threads (int | None): The number of threads torch runs independent operations on, or None for its default.
+
+        Raises:
+            ValueError: If the quantization is unknown or a thread count is below 1.
+        """
+        if quantization not in (*QUANTIZATIONS, "auto", None):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        for threads in (intra_op_threads, inter_op_threads):
+            if threads is not None and threads < 1:
+                raise ValueError(f"Thread counts must be at least 1, got {threads}")
+
+        self._device: str = device
+        self._dtype: str | None = dtype
+        self._quantization: str | None = quantization
+        self.intra_op_threads: int | None = intra_op_threads
+        self.inter_op_threads: int | None = inter_op_threads
+
+    @property
+    def device(self) -> str:
+        """
+        Gets the torch device the models run on.
+
+        Returns:
+            str: The device, e.g. "cuda" or "cpu".
+        """
+        if self._device != "auto":
+            return self._device
+
+        import torch
+
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+        return "cpu"
+
+    @property
+    def accelerator(self) -> bool:
+        """
+        Checks whether the models run on an accelerator, whose memory the model manager has to budget.
+
+        Returns:
+            bool: True unless the device is the CPU.
+        """
+        return self.device != "cpu"
+
+    @property
+    def quantization(self) -> str | None:
+        """
+        Gets the quantization of the weights.
+
+        Returns:
+            str | None: "4bit", "int8" or None.
+        """
+        if self._quantization != "auto":
+            return self._quantization
+        if self.device.startswith("cuda") and importlib.util.find_spec("bitsandbytes") is not None:
+            return "4bit"
+        return None
+
+    @property
+    def dtype(self) -> Any:
+        """
+        Gets the dtype of the weights and of floating point inputs such as images.
+
+        Returns:
+            torch.dtype: The dtype.
+        """
+        import torch
+
+        if self._dtype is not None:
+            return getattr(torch, self._dtype)
+        # Dynamic int8 quantization only replaces float32 linear layers.
+        if self.device.startswith("cuda") and self.quantization != "int8":
+            return torch.float16
+        return torch.float32
+
+    def quantization_config(self) -> Any:
+        """
+        Gets the quantization config passed to from_pretrained.
+
+        Returns:
+            BitsAndBytesConfig | None: The bitsandbytes config for 4-bit weights, or None if the weights are not quantized while loading.
+        """
+        if self.quantization != "4bit":
+            return None
+
+        from transformers import BitsAndBytesConfig
+
+        return BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=self.dtype)
+
+    def load_kwargs(self) -> dict[str, Any]:
+        """
+        Gets the keyword arguments for from_pretrained that load the weights for the device.
+
+        Returns:
+            dict[str, Any]: The quantization config, dtype and device map.
+        """
+        return {
+            "quantization_config": self.quantization_config(),
+            "torch_dtype": self.dtype,
+            # Accelerators may spread large models over several devices, otherwise the weights are loaded into host memory.
+            "device_map": "auto" if self.device == "cuda" else (self.device if self.accelerator else None),
+            "low_cpu_mem_usage": True,
+        }
+
+    def prepare(self, model: Any) -> Any:
+        """
+        Finishes loading a model for the device: applies dynamic quantization and the thread counts.
+
+        Args:
+            model (Any): The loaded transformers model.
+
+        Returns:
+            Any: The model to run.
+        """
+        self.apply_threads()
+        if self.quantization == "int8":
+            import torch
+
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    def to_device(self, tensor: Any, floating: bool = False) -> Any:
+        """
+        Moves an input tensor to the device.
+
+        Args:
+            tensor (torch.Tensor): The tensor.
+            floating (bool): Whether to convert the tensor to the dtype of the configuration, e.g. for images.
+
+        Returns:
+            torch.Tensor: The tensor on the device.
+        """
+        device = self.device
+        if floating:
+            return tensor.to(device=device, dtype=self.dtype, non_blocking=self.accelerator)
+        return tensor.to(device=device, non_blocking=self.accelerator)
+
+    def apply_threads(self) -> None:
+        """Sets the thread counts of torch for the process, if they are configured."""
+        if self.intra_op_threads is None and self.inter_op_threads is None:
+            return
+
+        import torch
+
+        if self.intra_op_threads is not None:
+            torch.set_num_threads(self.intra_op_threads)
+        if self.inter_op_threads is not None and torch.get_num_interop_threads() != self.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError:
+                # torch only allows this before it ran its first parallel operation.
+                print(f"Cannot change the number of inter-op threads to {self.inter_op_threads} after torch started working")
+
+    def __repr__(self) -> str:
+        return (f"DeviceConfig(device={self._device!r}, dtype={self._dtype!r}, quantization={self._quantization!r}, "
+                f"intra_op_threads={self.intra_op_threads!r}, inter_op_threads={self.inter_op_threads!r})")
+
+
+_config = DeviceConfig()
+
+
+def device_config() -> DeviceConfig:
+    """
+    Gets the device configuration new models of the process use.
+
+    Returns:
+        DeviceConfig: The configuration.
+    """
+    return _config
+
+
+def set_device_config(config: DeviceConfig) -> None:
+    """
+    Sets the device configuration new models of the process use and applies its thread counts.
+
+    Args:
+        config (DeviceConfig): The configuration.
+    """
+    global _config
+    _config = config
+    config.apply_threads()
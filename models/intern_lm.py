@@ -1,26 +1,64 @@
+from typing import Any
+
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
 from models.model import Model
 
+# The default meta_instruction InternLM's chat method sends as system message ahead of every conversation.
+META_INSTRUCTION = ("You are an AI assistant whose name is InternLM (书生·浦语).\n"
+                    "- InternLM (书生·浦语) is a conversational language AI that is developed by Shanghai AI Laboratory (上海人工智能实验室). "
+                    "It is designed to be helpful, honest, and harmless.\n"
+                    "- InternLM (书生·浦语) can understand and communicate fluently in the language chosen by the user such as English and 中文.")
 
-class InternLM(Model):
-    model = None
-    tokenizer = None
 
+# The chat template of InternLM with an empty user turn, see batch_inputs.
+EMPTY_CHAT = f"<s><|im_start|>system\n{META_INSTRUCTION}<|im_end|>\n<|im_start|>user\n<|im_end|>\n<|im_start|>assistant\n"
+
+
+class InternLM(Model):
     def __init__(self) -> None:
         super().__init__("internlm/internlm2_5-7b-chat")
+        self.context_length = 32768
+
+    def load(self) -> dict[str, Any]:
+        model = AutoModelForCausalLM.from_pretrained(self.name, **self.device_config.load_kwargs(), trust_remote_code=True)
+        model = self.device_config.prepare(model)
+
+        tokenizer = AutoTokenizer.from_pretrained(self.name, trust_remote_code=True)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+        return {"model": model, "tokenizer": tokenizer}
+
+    def sampling_kwargs(self) -> dict[str, Any]:
+        # The sampling parameters of InternLM's chat method.
+        return {
+            "max_new_tokens": self.max_new_tokens,
+            "do_sample": True,
+            "temperature": 0.8,
+            "top_p": 0.8,
+        }
+
+    def generation_kwargs(self) -> dict[str, Any]:
+        # The stop tokens of InternLM's chat method.
+        return {
+            **self.sampling_kwargs(),
+            "eos_token_id": [self.tokenizer.eos_token_id, self.tokenizer.convert_tokens_to_ids("<|im_end|>")],
+            "pad_token_id": self.tokenizer.pad_token_id,
+        }
+
+    def batch_inputs(self, system_prompt: str, prompts: list[str]) -> dict[str, Any]:
+        # Rendered like the prompts of InternLM's chat method, which prepends its meta_instruction as system message.
+        conversations = [[{"role": "system", "content": META_INSTRUCTION}, {"role": "user", "content": system_prompt + " " + prompt}]
+                         for prompt in prompts]
 
-        if InternLM.model is None or InternLM.tokenizer is None:
-            InternLM.model = AutoModelForCausalLM.from_pretrained(
-                self.name,
-                quantization_config=self.quantization_config,
-                device_map="auto",
-                low_cpu_mem_usage=True,
-                trust_remote_code=True,
-            )
+        self.tokenizer.padding_side = "left"
+        inputs = self.tokenizer.apply_chat_template(conversations, add_generation_prompt=True, padding=True, return_tensors="pt", return_dict=True)
+        return {name: tensor.to(self.model.device) for name, tensor in inputs.items()}
 
-            InternLM.tokenizer = AutoTokenizer.from_pretrained(self.name, trust_remote_code=True)
+    def template_tokens(self) -> int:
+        # Counted with the tokenizer of the model, which reads the role markers as the special tokens they are.
+        return self.token_lengths([EMPTY_CHAT])[0]
 
-    def run(self, system_prompt: str, prompt: str) -> str:
-        response, _ = InternLM.model.chat(self.tokenizer, system_prompt + " " + prompt, history=[], max_new_tokens=self.max_new_tokens)
-        return response
+    def inference(self, system_prompt: str, prompt: str) -> str:
+        return self.run_batch(system_prompt, [prompt])[0]
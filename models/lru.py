@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class ByteLRUCache:
+    """
+    Thread-safe least-recently-used cache that is bounded by the total size of its values in bytes.
+
+    Attributes:
+        max_bytes (int): The maximum total size of all cached values.
+        hits (int): The number of lookups that found a value.
+        misses (int): The number of lookups that did not find a value.
+    """
+
+    def __init__(self, max_bytes: int, size_of: Callable[[Any], int]) -> None:
+        """
+        Initializes the cache.
+
+        Args:
+            max_bytes (int): The maximum total size of all cached values.
+            size_of (Callable[[Any], int]): Returns the size of a value in bytes.
+        """
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._size_of = size_of
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._current_bytes: int = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current_bytes(self) -> int:
+        """
+        Gets the total size of all cached values.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return self._current_bytes
+
+    def get(self, key: Hashable) -> Any | None:
+        """
+        Gets a value and marks it as most recently used.
+
+        Args:
+            key (Hashable): The key of the value.
+
+        Returns:
+            Any | None: The cached value, or None if the key is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Caches a value, evicting least recently used values until the cache fits into its byte budget.
+        Values larger than the whole budget are not cached.
+
+        Args:
+            key (Hashable): The key of the value.
+            value (Any): The value to cache.
+        """
+        size = self._size_of(value)
+
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size)
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def pop(self, key: Hashable) -> Any | None:
+        """
+        Removes a value from the cache.
+
+        Args:
+            key (Hashable): The key of the value.
+
+        Returns:
+            Any | None: The removed value, or None if the key was not cached.
+        """
+        with self._lock:
+            return self._remove(key)
+
+    def clear(self) -> None:
+        """
+        Removes all values from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key: Hashable) -> Any | None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._current_bytes -= entry[1]
+        return entry[0]
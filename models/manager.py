@@ -0,0 +1,254 @@
+import gc
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from models.device import DeviceConfig, device_config
+
+
+def component_footprint(components: Dict[str, Any]) -> int:
+    """
+    Estimates the memory used by the loaded components of a model.
+
+    Args:
+        components (Dict[str, Any]): The loaded components, e.g. the transformers model and its tokenizer.
+
+    Returns:
+        int: The estimated footprint in bytes.
+    """
+    footprint = 0
+    for component in components.values():
+        if hasattr(component, "get_memory_footprint"):
+            footprint += component.get_memory_footprint()
+        elif hasattr(component, "parameters"):
+            footprint += sum(parameter.element_size() * parameter.nelement() for parameter in component.parameters())
+    return footprint
+
+
+class ResidentModel:
+    """
+    Bookkeeping of one model known to the manager.
+
+    Attributes:
+        components (Dict[str, Any] | None): The loaded components, or None if the model is not loaded.
+        footprint (int): The footprint of the components in bytes, measured at the last load.
+        consumers (int): The number of scheduled modules that still need the model.
+        offloaded (bool): Whether the components have been moved to host memory.
+        last_used (float): The time the model was last acquired.
+        device (str): The device the model runs on.
+        loading (threading.Lock): Held while the model is loaded or moved back to the accelerator.
+    """
+
+    def __init__(self) -> None:
+        self.components: Dict[str, Any] | None = None
+        self.footprint: int = 0
+        self.consumers: int = 0
+        self.offloaded: bool = False
+        self.last_used: float = 0.0
+        self.device: str = "cpu"
+        self.loading = threading.Lock()
+
+
+class ModelManager:
+    """
+    Keeps track of the loaded models, the modules that still need them and their memory footprint.
+
+    Models are loaded on demand when they are acquired. Once a memory budget is set, loading a model first makes room by
+    unloading models that no scheduled module needs anymore and then, in least-recently-used order, by offloading or
+    unloading models that are needed later and are reloaded on demand. Models whose last consumer finished are unloaded
+    right away. Without a budget, models stay loaded for the lifetime of the process. Models running on the CPU do not
+    count against the budget, which only limits accelerator memory.
+
+    Loading a model only blocks the threads acquiring that same model, which wait for the load instead of starting
+    another one. Models that are already loaded remain available meanwhile.
+    """
+
+    def __init__(self, memory_budget: int | None = None, offload: bool = True) -> None:
+        """
+        Initializes the manager.
+
+        Args:
+            memory_budget (int | None): The maximum total footprint of models resident on the accelerator in bytes, or None for no limit.
+            offload (bool): Whether models that are still needed are moved to host memory instead of being unloaded when making room.
+        """
+        self.memory_budget: int | None = memory_budget
+        self.offload: bool = offload
+        self._models: Dict[str, ResidentModel] = {}
+        self._lock = threading.RLock()
+
+    def expect(self, name: str, count: int = 1) -> None:
+        """
+        Registers modules that are scheduled to use a model.
+
+        Args:
+            name (str): The name of the model class.
+            count (int): The number of scheduled modules.
+        """
+        with self._lock:
+            self._entry(name).consumers += count
+
+    def release(self, name: str) -> None:
+        """
+        Marks one scheduled use of a model as done. If a memory budget is set and no scheduled module needs the model
+        anymore, it is unloaded.
+
+        Args:
+            name (str): The name of the model class.
+        """
+        with self._lock:
+            entry = self._entry(name)
+            entry.consumers = max(entry.consumers - 1, 0)
+            if entry.consumers == 0 and self.memory_budget is not None:
+                self.unload(name)
+
+    def acquire(self, name: str, loader: Callable[[], Dict[str, Any]], config: DeviceConfig | None = None) -> Dict[str, Any]:
+        """
+        Gets the loaded components of a model, loading it or moving it back to the accelerator if necessary.
+
+        Args:
+            name (str): The name of the model class.
+            loader (Callable[[], Dict[str, Any]]): Loads the components of the model.
+            config (DeviceConfig | None): The device configuration the loader uses, or None for the one of the process.
+
+        Returns:
+            Dict[str, Any]: The loaded components.
+        """
+        with self._lock:
+            entry = self._entry(name)
+            entry.last_used = time.monotonic()
+            if entry.components is not None and not entry.offloaded:
+                return entry.components
+        device = (config if config is not None else device_config()).device
+
+        with entry.loading:
+            with self._lock:
+                # Another thread may have loaded the model while this one waited.
+                if entry.components is not None and not entry.offloaded:
+                    return entry.components
+                # The footprint of the last load is the best estimate before loading again.
+                self._make_room(entry.footprint, exclude=name)
+                components = entry.components
+
+            if components is not None:
+                print(f"Moving model {name} back to the accelerator")
+                if self._move(components, entry.device):
+                    with self._lock:
+                        entry.offloaded = False
+                    return components
+                self.unload(name)
+
+            print(f"Loading model {name}")
+            # Imported here, as the pipeline package imports the model manager.
+            from pipeline.tracing import tracer
+
+            # Loaded without holding the lock of the manager, which would block every other model for minutes.
+            with tracer().span(name, "model_load"):
+                components = loader()
+
+            with self._lock:
+                entry.components = components
+                entry.offloaded = False
+                entry.device = device
+                entry.footprint = component_footprint(components) if device != "cpu" else 0
+                self._make_room(0, exclude=name)
+            return components
+
+    def unload(self, name: str) -> None:
+        """
+        Unloads a model and frees its memory. It is loaded again when it is acquired the next time.
+
+        Args:
+            name (str): The name of the model class.
+        """
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None or entry.components is None:
+                return
+
+            print(f"Unloading model {name}")
+            entry.components = None
+            entry.offloaded = False
+
+        gc.collect()
+        self._empty_accelerator_cache()
+
+    def resident_footprint(self) -> int:
+        """
+        Gets the total footprint of the models resident on the accelerator.
+
+        Returns:
+            int: The footprint in bytes.
+        """
+        with self._lock:
+            return sum(entry.footprint for entry in self._models.values() if entry.components is not None and not entry.offloaded)
+
+    def _entry(self, name: str) -> ResidentModel:
+        if name not in self._models:
+            self._models[name] = ResidentModel()
+        return self._models[name]
+
+    def _make_room(self, needed: int, exclude: str) -> None:
+        """Offloads or unloads other models until the needed bytes fit into the budget."""
+        if self.memory_budget is None:
+            return
+
+        while self.resident_footprint() + needed > self.memory_budget:
+            candidates = [(entry.consumers > 0, entry.last_used, name) for name, entry in self._models.items()
+                          if name != exclude and entry.components is not None and not entry.offloaded and entry.device != "cpu"]
+            if not candidates:
+                return
+
+            # Models nobody needs anymore go first, then the least recently used ones.
+            still_needed, _, victim = min(candidates)
+            entry = self._models[victim]
+            if still_needed and self.offload and self._move(entry.components, "cpu"):
+                print(f"Offloading model {victim} to host memory")
+                entry.offloaded = True
+                self._empty_accelerator_cache()
+            else:
+                self.unload(victim)
+
+    @staticmethod
+    def _move(components: Dict[str, Any], device: str) -> bool:
+        """Moves all movable components to a device. Returns False if a component cannot be moved, e.g. quantized weights."""
+        try:
+            for component in components.values():
+                if hasattr(component, "parameters") and hasattr(component, "to"):
+                    component.to(device)
+        except (ValueError, RuntimeError, TypeError, NotImplementedError):
+            return False
+        return True
+
+    @staticmethod
+    def _empty_accelerator_cache() -> None:
+        """Releases cached accelerator memory if torch has been loaded."""
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        elif torch is not None and torch.backends.mps.is_available():
+            torch.mps.empty_cache()
+
+
+_manager = ModelManager()
+
+
+def model_manager() -> ModelManager:
+    """
+    Gets the model manager of the process.
+
+    Returns:
+        ModelManager: The manager.
+    """
+    return _manager
+
+
+def set_model_manager(manager: ModelManager) -> None:
+    """
+    Replaces the model manager of the process, e.g. to configure a memory budget.
+
+    Args:
+        manager (ModelManager): The new manager.
+    """
+    global _manager
+    _manager = manager
@@ -1,7 +1,18 @@
+import contextlib
+import threading
 from abc import ABC, abstractmethod
+from typing import Any, ContextManager, Iterator
 
 import torch
-from transformers import BitsAndBytesConfig
+from transformers import TextIteratorStreamer
+
+from models.device import DeviceConfig, device_config
+from models.manager import model_manager
+from models.prefix_session import PrefixSession, PrefixTimings, shared_prefix_length
+from models.response_cache import ResponseCache, default_response_cache
+from models.server import model_client
+from models.streaming import GenerationBudget, StopCondition, stopping_criteria
+from pipeline.tracing import tracer
 
 
 class Model(ABC):
@@ -10,6 +21,14 @@ class Model(ABC):
 
     Attributes:
         name (str): The name of the model, defined at initialization.
+        reuse_prefix (bool): Whether multi_run prefills the prompt prefix shared by all prompts once and answers each prompt from a copy of its KV cache instead of batching.
+        last_prefix_timings (PrefixTimings | None): The prefill and decode timings of the last run that reused a shared prefix.
+        last_stop_reason (str | None): Why the last stream ended before the model finished: "time", "tokens" or "cancelled", or None if it finished.
+        response_cache (ResponseCache | None): The cache responses are looked up in before running the model, or None to always run it.
+        device_config (DeviceConfig): The device, dtype, quantization and thread counts the model is loaded and run with.
+        context_length (int | None): The maximum number of prompt and generated tokens together, or None if unknown.
+        model (Any): The loaded transformers model, loaded on demand by the model manager.
+        tokenizer (Any): The tokenizer of the loaded model, loaded on demand by the model manager.
     """
 
     def __init__(self, name: str) -> None:
@@ -21,7 +40,63 @@ class Model(ABC):
         """
         self.name: str = name
         self._max_new_tokens: int = 4096
-        self.quantization_config = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.float16)
+        self._batch_size: int = 4
+        self.reuse_prefix: bool = False
+        self.last_prefix_timings: PrefixTimings | None = None
+        self.last_stop_reason: str | None = None
+        self.response_cache: ResponseCache | None = default_response_cache()
+        self.device_config: DeviceConfig = device_config()
+        self.context_length: int | None = None
+
+    @property
+    def quantization_config(self) -> Any:
+        """
+        Gets the quantization config the weights are loaded with.
+
+        Returns:
+            BitsAndBytesConfig | None: The config, or None if the weights are not quantized while loading.
+        """
+        return self.device_config.quantization_config()
+
+    def load(self) -> dict[str, Any]:
+        """
+        Loads the components of the model, e.g. its weights and tokenizer. The model manager calls this when the model is
+        needed and not loaded, and shares the components between all instances of the model class.
+
+        Returns:
+            dict[str, Any]: The loaded components, including "model" and "tokenizer".
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not load any components")
+
+    @property
+    def components(self) -> dict[str, Any]:
+        """
+        Gets the loaded components of the model, loading them if necessary.
+
+        Returns:
+            dict[str, Any]: The loaded components.
+        """
+        return model_manager().acquire(type(self).__name__, self.load, self.device_config)
+
+    @property
+    def model(self) -> Any:
+        """
+        Gets the loaded transformers model.
+
+        Returns:
+            Any: The model.
+        """
+        return self.components["model"]
+
+    @property
+    def tokenizer(self) -> Any:
+        """
+        Gets the tokenizer of the loaded model.
+
+        Returns:
+            Any: The tokenizer.
+        """
+        return self.components["tokenizer"]
 
     @property
     def max_new_tokens(self) -> int:
@@ -43,10 +118,314 @@ class Model(ABC):
         """
         self._max_new_tokens = value
 
-    @abstractmethod
+    @property
+    def batch_size(self) -> int:
+        """
+        Gets the number of prompts generated together in one batch by multi_run.
+
+        Returns:
+            int: The micro-batch size.
+        """
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, value: int) -> None:
+        """
+        Sets the number of prompts generated together in one batch by multi_run. A value of 1 runs the prompts one after another.
+
+        Args:
+            value (int): The micro-batch size to set.
+        """
+        if value < 1:
+            raise ValueError(f"The batch size must be at least 1, got {value}")
+        self._batch_size = value
+
+    def sampling_kwargs(self) -> dict[str, Any]:
+        """
+        Gets the generation parameters that do not depend on the loaded model, such as the sampling settings. Unlike
+        generation_kwargs, they are available without loading the model, e.g. on a client of the model server.
+
+        Returns:
+            dict[str, Any]: The generation parameters.
+        """
+        return {"max_new_tokens": self.max_new_tokens}
+
+    def generation_kwargs(self) -> dict[str, Any]:
+        """
+        Gets the keyword arguments passed to the generate call of the model: sampling_kwargs and the parameters that
+        are read from the loaded model, such as stop and padding token ids.
+
+        Returns:
+            dict[str, Any]: The generation parameters.
+        """
+        return self.sampling_kwargs()
+
+    def batch_inputs(self, system_prompt: str, prompts: list[str]) -> dict[str, Any]:
+        """
+        Builds the padded inputs for generating answers to several prompts in one generate call.
+        Subclasses that support batched generation override this and pad on the left, so that all prompts end in the same column.
+
+        Args:
+            system_prompt (str): The system prompt for the model.
+            prompts (list[str]): The user prompts of the batch.
+
+        Returns:
+            dict[str, Any]: The keyword arguments for the generate call, including "input_ids".
+
+        Raises:
+            NotImplementedError: If the model does not support batched generation.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support batched generation")
+
+    def run_batch(self, system_prompt: str, prompts: list[str]) -> list[str]:
+        """
+        Runs the model on several prompts in a single generate call.
+
+        Args:
+            system_prompt (str): The system prompt for the model.
+            prompts (list[str]): The user prompts of the batch.
+
+        Returns:
+            list[str]: The result for each prompt, in prompt order.
+
+        Raises:
+            NotImplementedError: If the model does not support batched generation.
+        """
+        inputs = self.batch_inputs(system_prompt, prompts)
+
+        with torch.inference_mode():
+            output_ids = self.model.generate(**inputs, **self.generation_kwargs())
+
+        # generate appends new tokens after the padded input, so each prompt's input (including its padding) ends at the same column.
+        input_token_len = inputs["input_ids"].shape[1]
+        self.count_tokens(inputs["input_ids"], inputs.get("attention_mask"), output_ids[:, input_token_len:])
+        outputs = self.tokenizer.batch_decode(output_ids[:, input_token_len:], skip_special_tokens=True)
+        return [output.strip() for output in outputs]
+
+    def count_tokens(self, input_ids: torch.Tensor, attention_mask: torch.Tensor | None, new_ids: torch.Tensor) -> None:
+        """
+        Adds the prompt and generated token counts of a generate call to the model call being traced.
+
+        Args:
+            input_ids (torch.Tensor): The token ids of the prompts, possibly padded.
+            attention_mask (torch.Tensor | None): The mask of the non-padding prompt tokens, or None if the prompts are not padded.
+            new_ids (torch.Tensor): The generated token ids. Sequences that ended early are padded with the pad token.
+        """
+        prompt_tokens = int(attention_mask.sum()) if attention_mask is not None else input_ids.numel()
+        pad_token_id = self.generation_kwargs().get("pad_token_id", self.tokenizer.pad_token_id)
+        generated_tokens = int((new_ids != pad_token_id).sum()) if pad_token_id is not None else new_ids.numel()
+        tracer().count(prompt_tokens=prompt_tokens, generated_tokens=generated_tokens)
+
+    def run_with_shared_prefix(self, system_prompt: str, prompts: list[str]) -> list[str]:
+        """
+        Runs the model on several prompts, prefilling the tokens all prompts start with only once. Every prompt continues
+        greedily from a copy of the KV cache of that shared prefix.
+
+        Args:
+            system_prompt (str): The system prompt for the model.
+            prompts (list[str]): The user prompts.
+
+        Returns:
+            list[str]: The result for each prompt, in prompt order.
+
+        Raises:
+            NotImplementedError: If the model does not support batched inputs or does not decode greedily.
+        """
+        generation_kwargs = self.generation_kwargs()
+        if generation_kwargs.get("do_sample", False) or generation_kwargs.get("num_beams", 1) != 1:
+            raise NotImplementedError(f"{type(self).__name__} does not decode greedily")
+
+        inputs = [self.batch_inputs(system_prompt, [prompt]) for prompt in prompts]
+        prefix_len = shared_prefix_length([item["input_ids"][0].tolist() for item in inputs])
+
+        # Inputs besides the token ids, such as images, belong to the prefix.
+        prefill_kwargs = {name: value for name, value in inputs[0].items() if name not in ("input_ids", "attention_mask")}
+        eos_token_ids = generation_kwargs.get("eos_token_id", self.tokenizer.eos_token_id)
+        eos_token_ids = eos_token_ids if isinstance(eos_token_ids, list) else [eos_token_ids]
+
+        session = PrefixSession(self.model, inputs[0]["input_ids"][:, :prefix_len], eos_token_ids, prefill_kwargs)
+        results = []
+        for item in inputs:
+            output_ids = session.generate(item["input_ids"][:, prefix_len:], self.max_new_tokens)
+            results.append(self.tokenizer.decode(output_ids, skip_special_tokens=True).strip())
+
+        self.last_prefix_timings = session.timings
+        tracer().count(prompt_tokens=session.timings.prefix_tokens + session.timings.suffix_tokens,
+                       generated_tokens=session.timings.decode_tokens,
+                       prefill_seconds=session.timings.prefix_seconds + session.timings.suffix_seconds,
+                       decode_seconds=session.timings.decode_seconds)
+        print(f"{self.name}: {session.timings}")
+        return results
+
+    def multi_run(self, system_prompt: str, prompts: list[str]) -> list[str]:
+        """
+        Runs the model on several prompts. Cached responses are reused. For the remaining prompts, the shared prompt
+        prefix is prefilled once if reuse_prefix is set. Otherwise, they are generated in micro-batches of batch_size
+        prompts if the model supports batched generation and one prompt after another if it does not.
+
+        Args:
+            system_prompt (str): The system prompt for the model. If the model does not require or support a system prompt, this will be prepended to the prompt.
+            prompts (list[str]): The list of user prompts for the model. Always required.
+
+        Returns:
+            list[str]: The result for each prompt, in prompt order.
+        """
+        with tracer().span(type(self).__name__, "model", method="multi_run", prompts=len(prompts)) as span:
+            keys = self._cache_keys(system_prompt, prompts)
+            results = [self.response_cache.get(key) if key is not None else None for key in keys]
+
+            missing = [index for index, result in enumerate(results) if result is None]
+            if span is not None:
+                span.args["cached"] = len(prompts) - len(missing)
+            if missing:
+                generated = self._generate(system_prompt, [prompts[index] for index in missing])
+                for index, result in zip(missing, generated):
+                    results[index] = result
+                    if keys[index] is not None:
+                        self.response_cache.put(keys[index], result)
+            return results
+
     def run(self, system_prompt: str, prompt: str) -> str:
         """
-        Abstract method to run the model. This method should be implemented by subclasses.
+        Runs the model on a prompt, reusing the cached response if the same request has been run before.
+
+        Args:
+            system_prompt (str): The system prompt for the model. If the model does not require or support a system prompt, this will be prepended to the prompt.
+            prompt (str): The user prompt for the model. Always required.
+
+        Returns:
+            str: The result of running the model.
+        """
+        with tracer().span(type(self).__name__, "model", method="run", prompts=1) as span:
+            key = self._cache_keys(system_prompt, [prompt])[0]
+            if key is not None:
+                result = self.response_cache.get(key)
+                if result is not None:
+                    if span is not None:
+                        span.args["cached"] = 1
+                    return result
+
+            client = model_client()
+            result = client.generate(self, system_prompt, [prompt])[0] if client is not None else self.inference(system_prompt, prompt)
+            if key is not None:
+                self.response_cache.put(key, result)
+            return result
+
+    def stream(self, system_prompt: str, prompt: str, budget: GenerationBudget | None = None) -> Iterator[str]:
+        """
+        Runs the model on a prompt and yields the result in chunks as they are generated. A cached response is yielded
+        as a single chunk. Closing the iterator early stops the generation.
+
+        Args:
+            system_prompt (str): The system prompt for the model. If the model does not require or support a system prompt, this will be prepended to the prompt.
+            prompt (str): The user prompt for the model. Always required.
+            budget (GenerationBudget | None): The stop condition of the generation, or None to generate until the model finishes.
+                Results of a generation with a budget are not cached, as they may be cut off.
+
+        Yields:
+            str: The next chunk of the result. Joined, the chunks form the result without leading whitespace.
+        """
+        with tracer().span(type(self).__name__, "model", method="stream", prompts=1) as span:
+            self.last_stop_reason = None
+            key = self._cache_keys(system_prompt, [prompt])[0] if budget is None else None
+            if key is not None:
+                result = self.response_cache.get(key)
+                if result is not None:
+                    if span is not None:
+                        span.args["cached"] = 1
+                    yield result
+                    return
+
+            chunks = []
+            for chunk in self.stream_inference(system_prompt, prompt, budget):
+                if not chunks:
+                    chunk = chunk.lstrip()
+                if chunk:
+                    chunks.append(chunk)
+                    yield chunk
+
+            if key is not None:
+                self.response_cache.put(key, "".join(chunks).strip())
+
+    def stream_inference(self, system_prompt: str, prompt: str, budget: GenerationBudget | None = None) -> Iterator[str]:
+        """
+        Streams the result of the model without consulting the response cache. The generate call runs in a background
+        thread and passes the decoded text to a streamer, which this generator reads from. Models that do not support
+        batched inputs yield the whole result of inference as a single chunk and ignore the budget.
+
+        Args:
+            system_prompt (str): The system prompt for the model.
+            prompt (str): The user prompt for the model.
+            budget (GenerationBudget | None): The stop condition of the generation, or None to generate until the model finishes.
+
+        Yields:
+            str: The next chunk of the result.
+        """
+        client = model_client()
+        if client is not None:
+            # The model server returns whole results, so only the token budget applies.
+            max_new_tokens = self.max_new_tokens
+            if budget is not None and budget.max_tokens is not None:
+                self.max_new_tokens = min(max_new_tokens, budget.max_tokens)
+            try:
+                yield client.generate(self, system_prompt, [prompt])[0]
+            finally:
+                self.max_new_tokens = max_new_tokens
+            return
+
+        try:
+            inputs = self.batch_inputs(system_prompt, [prompt])
+        except NotImplementedError:
+            yield self.inference(system_prompt, prompt)
+            return
+
+        generation_kwargs = budget.limit(self.generation_kwargs()) if budget is not None else self.generation_kwargs()
+        condition = StopCondition(budget.max_seconds if budget is not None else None)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        outcome: dict[str, Any] = {}
+
+        def generate() -> None:
+            try:
+                with self.generation_context(), torch.inference_mode():
+                    outcome["output_ids"] = self.model.generate(**inputs, **generation_kwargs, streamer=streamer,
+                                                                stopping_criteria=stopping_criteria(condition))
+            except BaseException as error:
+                outcome["error"] = error
+                streamer.end()
+
+        thread = threading.Thread(target=generate, name=f"{type(self).__name__}-stream", daemon=True)
+        thread.start()
+        try:
+            yield from streamer
+        finally:
+            # Stops the generation if the consumer closed the stream early.
+            condition.cancel()
+            thread.join()
+
+        if "error" in outcome:
+            raise outcome["error"]
+
+        input_token_len = inputs["input_ids"].shape[1]
+        new_ids = outcome["output_ids"][:, input_token_len:]
+        self.count_tokens(inputs["input_ids"], inputs.get("attention_mask"), new_ids)
+        self.last_stop_reason = condition.reason
+        if condition.reason is None and budget is not None and budget.max_tokens is not None and new_ids.shape[1] >= generation_kwargs["max_new_tokens"]:
+            self.last_stop_reason = "tokens"
+
+    def generation_context(self) -> ContextManager:
+        """
+        Gets the context the generate call of a stream runs in on its background thread. Subclasses with thread-local
+        state for the generation, such as active cache entries, enter it here.
+
+        Returns:
+            ContextManager: The context.
+        """
+        return contextlib.nullcontext()
+
+    @abstractmethod
+    def inference(self, system_prompt: str, prompt: str) -> str:
+        """
+        Abstract method to run the model without consulting the response cache. This method should be implemented by subclasses.
 
         Args:
             system_prompt (str): The system prompt for the model. If the model does not require or support a system prompt, this will be prepended to the prompt.
@@ -57,6 +436,122 @@ class Model(ABC):
         """
         pass
 
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        """
+        Counts the tokens of texts with the tokenizer of the model, without special tokens.
+
+        Args:
+            texts (list[str]): The texts.
+
+        Returns:
+            list[int]: The number of tokens of each text.
+        """
+        client = model_client()
+        if client is not None:
+            return client.token_lengths(self, texts)
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def template_tokens(self) -> int:
+        """
+        Counts the tokens the prompt template of the model adds around the system prompt and prompt, e.g. role markers
+        and a default system message. Models without a template add none.
+
+        Returns:
+            int: The number of tokens.
+        """
+        return 0
+
+    def prompt_budget(self, new_tokens: int | None = None) -> int | None:
+        """
+        Gets the number of tokens of system prompt and prompt that fit into the context next to the generated tokens
+        and the prompt template.
+
+        Args:
+            new_tokens (int | None): The maximum number of tokens generated from the prompt, or None for max_new_tokens.
+
+        Returns:
+            int | None: The number of tokens, or None if the context length of the model is unknown.
+        """
+        if self.context_length is None:
+            return None
+        new_tokens = self.max_new_tokens if new_tokens is None else min(new_tokens, self.max_new_tokens)
+        return self.context_length - new_tokens - self.template_tokens()
+
+    def remote_settings(self) -> dict[str, Any]:
+        """
+        Gets the settings the model server applies to its instance of the model before running a request. Subclasses
+        with further inputs, such as images, extend this.
+
+        Returns:
+            dict[str, Any]: The JSON-serializable settings.
+        """
+        return {"max_new_tokens": self.max_new_tokens, "batch_size": self.batch_size, "reuse_prefix": self.reuse_prefix}
+
+    def apply_remote_settings(self, settings: dict[str, Any]) -> None:
+        """
+        Applies the settings of a client-side model, see remote_settings.
+
+        Args:
+            settings (dict[str, Any]): The settings.
+        """
+        self.max_new_tokens = settings["max_new_tokens"]
+        self.batch_size = settings["batch_size"]
+        self.reuse_prefix = settings["reuse_prefix"]
+
+    def cache_key_parts(self, system_prompt: str) -> dict[str, Any]:
+        """
+        Gets everything besides the user prompt that determines the response of the model. Subclasses with further
+        inputs, such as images, extend this. Token ids are left out, as they follow from the model name, so computing
+        the key does not load the model.
+
+        Args:
+            system_prompt (str): The system prompt for the model.
+
+        Returns:
+            dict[str, Any]: The JSON-serializable parts of the cache key.
+        """
+        quantization_config = self.quantization_config
+        return {
+            "model": self.name,
+            "quantization": quantization_config.to_dict() if quantization_config is not None else self.device_config.quantization,
+            "generation": self.sampling_kwargs(),
+            "system_prompt": system_prompt,
+        }
+
+    def _cache_keys(self, system_prompt: str, prompts: list[str]) -> list[str | None]:
+        """Computes the response cache key of every prompt, or None for every prompt if caching is disabled."""
+        if self.response_cache is None:
+            return [None] * len(prompts)
+
+        parts = self.cache_key_parts(system_prompt)
+        return [ResponseCache.key({**parts, "prompt": prompt}) for prompt in prompts]
+
+    def _generate(self, system_prompt: str, prompts: list[str]) -> list[str]:
+        """Runs the model on prompts that are not cached, using the fastest generation path the model supports or the model server."""
+        client = model_client()
+        if client is not None:
+            return client.generate(self, system_prompt, prompts)
+
+        if self.reuse_prefix and len(prompts) > 1:
+            try:
+                return self.run_with_shared_prefix(system_prompt, prompts)
+            except NotImplementedError:
+                pass
+
+        if self.batch_size == 1:
+            return [self.inference(system_prompt, prompt) for prompt in prompts]
+
+        results = []
+        for start in range(0, len(prompts), self.batch_size):
+            chunk = prompts[start:start + self.batch_size]
+            try:
+                results.extend(self.run_batch(system_prompt, chunk))
+            except NotImplementedError:
+                results.extend(self.inference(system_prompt, prompt) for prompt in chunk)
+        return results
+
     def multi_run_one_result(self, system_prompt: str, prompts: list[str]) -> str:
         """
         This runs the model with multiple prompts and returns the concatenated results.
@@ -68,4 +563,4 @@ class Model(ABC):
         Returns:
             str: The result of running the model.
         """
-        return "\n".join([self.run(system_prompt, prompt) for prompt in prompts])
+        return "\n".join(self.multi_run(system_prompt, prompts))
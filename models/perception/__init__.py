@@ -1,4 +1,21 @@
-from models.perception.perception_model import PerceptionModel
-from models.perception.three_sixty_vl import ThreeSixtyVLModel
+import importlib
 
-__all__ = ["PerceptionModel", "ThreeSixtyVLModel"]
+# Imported lazily, so that importing the package does not load torch and transformers.
+_ATTRIBUTES = {
+    "ImageHandle": "models.perception.image_pool",
+    "ImagePool": "models.perception.image_pool",
+    "PerceptionModel": "models.perception.perception_model",
+    "ThreeSixtyVLModel": "models.perception.three_sixty_vl",
+    "VisionFeatureCache": "models.perception.feature_cache",
+    "image_pool": "models.perception.image_pool",
+    "set_image_pool": "models.perception.image_pool",
+}
+
+
+def __getattr__(name: str):
+    if name in _ATTRIBUTES:
+        return getattr(importlib.import_module(_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["ImageHandle", "ImagePool", "PerceptionModel", "ThreeSixtyVLModel", "VisionFeatureCache", "image_pool", "set_image_pool"]
@@ -0,0 +1,202 @@
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List
+
+import torch
+from PIL import Image
+
+from models.lru import ByteLRUCache
+
+
+def tensor_bytes(value: Any) -> int:
+    """
+    Estimates the memory used by the tensors in a value.
+
+    Args:
+        value (Any): A tensor, or a mapping or sequence containing tensors.
+
+    Returns:
+        int: The total size of all contained tensors in bytes.
+    """
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, dict) or hasattr(value, "values"):
+        return sum(tensor_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(tensor_bytes(item) for item in value)
+    return 0
+
+
+class VisionFeatureCache:
+    """
+    Caches preprocessed pixel tensors and projected vision embeddings of images, so that asking several prompts about the
+    same image only preprocesses and encodes it once.
+
+    Entries are keyed by a hash of the image content and the configuration of the image processor and are evicted in
+    least-recently-used order once the cache exceeds its byte budget.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024) -> None:
+        """
+        Initializes the cache.
+
+        Args:
+            max_bytes (int): The maximum total size of all cached tensors.
+        """
+        self._cache = ByteLRUCache(max_bytes, tensor_bytes)
+        self._local = threading.local()
+        self._processor_hashes: dict[int, str] = {}
+
+    @property
+    def cache(self) -> ByteLRUCache:
+        """
+        Gets the underlying cache, e.g. to inspect its hit rate.
+
+        Returns:
+            ByteLRUCache: The cache holding the tensors.
+        """
+        return self._cache
+
+    def image_key(self, image: Image.Image, image_processor: Any) -> str:
+        """
+        Computes the cache key of an image for an image processor.
+
+        Args:
+            image (Image.Image): The image.
+            image_processor (Any): The image processor that prepares the image for the vision tower.
+
+        Returns:
+            str: A key that changes whenever the image content or the processor configuration changes.
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size}:".encode())
+        digest.update(image.tobytes())
+        digest.update(self._processor_hash(image_processor).encode())
+        return digest.hexdigest()
+
+    @property
+    def active_keys(self) -> List[str]:
+        """
+        Gets the keys of the images the current thread is working on.
+
+        Returns:
+            List[str]: One key per image in the batch, or an empty list if no images are active.
+        """
+        return getattr(self._local, "keys", [])
+
+    @contextmanager
+    def activate(self, keys: List[str]) -> Iterator[None]:
+        """
+        Marks the images the current thread is about to preprocess and encode, in batch order.
+        A batch may contain the same image several times.
+
+        Args:
+            keys (List[str]): The keys of the images, as returned by image_key.
+        """
+        previous = self.active_keys
+        self._local.keys = list(keys)
+        try:
+            yield
+        finally:
+            self._local.keys = previous
+
+    def wrap_image_processor(self, image_processor: Any) -> "CachingImageProcessor":
+        """
+        Wraps an image processor so that it reuses cached pixel tensors of active images.
+
+        Args:
+            image_processor (Any): The image processor to wrap.
+
+        Returns:
+            CachingImageProcessor: The wrapped image processor.
+        """
+        return CachingImageProcessor(image_processor, self)
+
+    def wrap_encoder(self, encode_images: Callable[[Any], torch.Tensor]) -> Callable[[Any], torch.Tensor]:
+        """
+        Wraps the function that encodes and projects images into vision embeddings so that it reuses cached embeddings
+        of active images.
+
+        Args:
+            encode_images (Callable[[Any], torch.Tensor]): The encoding function, taking a batch of pixel tensors.
+
+        Returns:
+            Callable[[Any], torch.Tensor]: The caching encoding function.
+        """
+
+        def cached_encode_images(images: Any) -> torch.Tensor:
+            keys = self.active_keys
+            if not keys or len(keys) != len(images):
+                return encode_images(images)
+
+            features = {key: self._cache.get(("features", key)) for key in keys}
+            missing = [key for key, value in features.items() if value is None]
+            if missing:
+                # Encode each missing image once, even if it occurs several times in the batch.
+                indices = [keys.index(key) for key in missing]
+                encoded = encode_images(images[indices] if isinstance(images, torch.Tensor) else [images[index] for index in indices])
+                for key, image_features in zip(missing, encoded):
+                    # Clone, so that the cache does not keep the whole batch alive.
+                    features[key] = image_features.detach().clone()
+                    self._cache.put(("features", key), features[key])
+
+            return torch.stack([features[key] for key in keys])
+
+        return cached_encode_images
+
+    def _processor_hash(self, image_processor: Any) -> str:
+        """Hashes the configuration of an image processor, which is cached per processor instance."""
+        processor_id = id(image_processor)
+        if processor_id not in self._processor_hashes:
+            processor = getattr(image_processor, "processor", image_processor)
+            config = processor.to_json_string() if hasattr(processor, "to_json_string") else repr(sorted(vars(processor).items()))
+            self._processor_hashes[processor_id] = hashlib.sha256(f"{type(processor).__name__}:{config}".encode()).hexdigest()
+        return self._processor_hashes[processor_id]
+
+
+class CachingImageProcessor:
+    """
+    Proxy around an image processor that returns cached preprocessing results for the active image.
+    All other attributes are delegated to the wrapped processor.
+    """
+
+    def __init__(self, processor: Any, feature_cache: VisionFeatureCache) -> None:
+        """
+        Initializes the proxy.
+
+        Args:
+            processor (Any): The wrapped image processor.
+            feature_cache (VisionFeatureCache): The cache holding the preprocessing results.
+        """
+        self.processor = processor
+        self.feature_cache = feature_cache
+
+    def preprocess(self, images: Any, *args: Any, **kwargs: Any) -> Any:
+        """
+        Preprocesses an image, reusing the cached result if the image is active and has been preprocessed before.
+
+        Args:
+            images (Any): A single image or a list containing a single image. Other inputs are not cached.
+
+        Returns:
+            Any: The output of the wrapped processor.
+        """
+        keys = set(self.feature_cache.active_keys)
+        single = isinstance(images, Image.Image) or (isinstance(images, (list, tuple)) and len(images) == 1)
+        if len(keys) != 1 or not single:
+            return self.processor.preprocess(images, *args, **kwargs)
+
+        # The processed image is derived deterministically from the active image, so its key can be reused.
+        key = ("pixels", next(iter(keys)), repr(args), repr(sorted(kwargs.items())))
+        result = self.feature_cache.cache.get(key)
+        if result is None:
+            result = self.processor.preprocess(images, *args, **kwargs)
+            self.feature_cache.cache.put(key, result)
+        return result
+
+    def __call__(self, images: Any, *args: Any, **kwargs: Any) -> Any:
+        return self.preprocess(images, *args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.processor, name)
@@ -0,0 +1,284 @@
+import os
+import threading
+import weakref
+from typing import Any, Callable, Hashable
+
+from PIL import Image
+
+from models.lru import ByteLRUCache
+
+
+def image_bytes(image: Image.Image) -> int:
+    """
+    Estimates the memory used by the pixels of a decoded image.
+
+    Args:
+        image (Image.Image): The image.
+
+    Returns:
+        int: The size in bytes.
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+class ImageIdentity:
+    """
+    Identifies an in-memory image by the object itself, so pooling it needs no hash of its pixels. The image is only
+    referenced weakly: once it is garbage collected, the identity equals no other, even of an image reusing its id.
+    """
+
+    __slots__ = ("_reference", "_hash")
+
+    def __init__(self, image: Image.Image) -> None:
+        self._reference = weakref.ref(image)
+        self._hash = id(image)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ImageIdentity):
+            return NotImplemented
+        image = self._reference()
+        return image is not None and image is other._reference()
+
+
+class ImageHandle:
+    """
+    A lease of a decoded image from an ImagePool. The image is shared with every other holder of a handle for the same
+    file and must not be modified. Closing the handle, explicitly or by leaving its with block, ends the lease.
+
+    Attributes:
+        key (Hashable): The key of the image in the pool.
+    """
+
+    def __init__(self, pool: "ImagePool", key: Hashable, image: Image.Image) -> None:
+        self.key: Hashable = key
+        self._pool = pool
+        self._image: Image.Image | None = image
+
+    @property
+    def image(self) -> Image.Image:
+        """
+        Gets the decoded RGB image.
+
+        Returns:
+            Image.Image: The image.
+
+        Raises:
+            ValueError: If the handle has been closed.
+        """
+        if self._image is None:
+            raise ValueError("The image handle has been closed")
+        return self._image
+
+    def array(self) -> Any:
+        """
+        Gets the decoded image as array.
+
+        Returns:
+            np.ndarray: A new height x width x 3 uint8 array of the image.
+        """
+        import numpy as np
+
+        return np.asarray(self.image)
+
+    @property
+    def closed(self) -> bool:
+        """
+        Checks whether the handle has been closed.
+
+        Returns:
+            bool: True once the lease has ended.
+        """
+        return self._image is None
+
+    def close(self) -> None:
+        """Ends the lease. Closing a handle again has no effect."""
+        if self._image is not None:
+            self._image = None
+            self._pool.release(self.key)
+
+    def __enter__(self) -> "ImageHandle":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # A handle dropped without closing it, e.g. together with its model, must not pin the image forever.
+        if getattr(self, "_image", None) is not None:
+            self.close()
+
+
+class ImagePool:
+    """
+    Process-wide pool of decoded RGB images of image files and in-memory images, so that the same file is decoded and
+    the same image is converted and reduced once no matter how many models and modules read it.
+
+    Images of files are keyed by the real path, modification time and size of their file, and by the size they were
+    reduced to, so a rewritten file is decoded again. The file is closed as soon as it is decoded. In-memory images,
+    such as artifacts, are keyed by their identity, as published artifacts are shared and never modified. Images nobody
+    holds a handle for are kept in a least-recently-used cache bounded by bytes; leased images stay in the pool until
+    their last handle is closed, even beyond the budget.
+
+    Attributes:
+        decodes (int): The number of images decoded from files or converted from in-memory images.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        """
+        Initializes the pool.
+
+        Args:
+            max_bytes (int): The maximum total size of the cached images that are not leased.
+        """
+        self.decodes: int = 0
+        self._cache = ByteLRUCache(max_bytes, image_bytes)
+        self._leased: dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> ByteLRUCache:
+        """
+        Gets the cache of the images that are not leased, e.g. to inspect its hit rate.
+
+        Returns:
+            ByteLRUCache: The cache.
+        """
+        return self._cache
+
+    @property
+    def open_handles(self) -> int:
+        """
+        Gets the number of handles that have not been closed.
+
+        Returns:
+            int: The number of open handles.
+        """
+        with self._lock:
+            return sum(count for _, count in self._leased.values())
+
+    def acquire(self, path: str, min_edge: int | None = None) -> ImageHandle:
+        """
+        Gets a handle of the decoded RGB image of a file, decoding it if the pool does not hold it.
+
+        Args:
+            path (str): The path of the image file.
+            min_edge (int | None): The length the shorter edge of larger images is reduced to while decoding, e.g. the
+                input size of a vision encoder, or None to keep the full resolution.
+
+        Returns:
+            ImageHandle: The handle, which the caller closes once it no longer needs the image.
+        """
+        real_path = os.path.realpath(path)
+        stat = os.stat(real_path)
+        return self._acquire((real_path, stat.st_mtime_ns, stat.st_size, min_edge), lambda: self._decode(real_path, min_edge))
+
+    def acquire_image(self, image: Image.Image, min_edge: int | None = None) -> ImageHandle:
+        """
+        Gets a handle of an in-memory image as RGB, converting and reducing it if the pool does not hold it yet. The
+        image must not be modified afterwards, as the pool would keep serving the old content.
+
+        Args:
+            image (Image.Image): The image, e.g. an artifact.
+            min_edge (int | None): The length the shorter edge of larger images is reduced to, or None to keep the full resolution.
+
+        Returns:
+            ImageHandle: The handle, which the caller closes once it no longer needs the image.
+        """
+        return self._acquire(("memory", ImageIdentity(image), min_edge), lambda: self._prepare(image, min_edge))
+
+    def _acquire(self, key: Hashable, produce: Callable[[], Image.Image]) -> ImageHandle:
+        """Leases the image of a key, producing it if the pool does not hold it."""
+        with self._lock:
+            image = self._lease(key)
+        if image is None:
+            # Produced outside the lock, so that other images can be served meanwhile.
+            image = produce()
+            with self._lock:
+                self.decodes += 1
+                # Another thread may have decoded the same file meanwhile.
+                leased = self._lease(key)
+                if leased is not None:
+                    image = leased
+                else:
+                    self._leased[key] = [image, 1]
+        return ImageHandle(self, key, image)
+
+    def release(self, key: Hashable) -> None:
+        """
+        Ends one lease of an image, called by ImageHandle.close. The last lease moves the image into the LRU cache.
+
+        Args:
+            key (Hashable): The key of the image.
+        """
+        with self._lock:
+            entry = self._leased.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._leased[key]
+                self._cache.put(key, entry[0])
+
+    def clear(self) -> None:
+        """Drops the cached images. Leased images stay valid for their handles."""
+        self._cache.clear()
+
+    def _lease(self, key: Hashable) -> Image.Image | None:
+        """Leases an image the pool holds, or returns None. The caller holds the lock."""
+        entry = self._leased.get(key)
+        if entry is None:
+            image = self._cache.get(key)
+            if image is None:
+                return None
+            self._cache.pop(key)
+            entry = self._leased[key] = [image, 0]
+        entry[1] += 1
+        return entry[0]
+
+    @classmethod
+    def _decode(cls, path: str, min_edge: int | None) -> Image.Image:
+        """Decodes an image file as RGB, reduced to the minimum edge length if given."""
+        with Image.open(path) as source:
+            if min_edge is not None:
+                # JPEG decoders can skip detail they would throw away anyway.
+                source.draft("RGB", (min_edge, min_edge))
+            return cls._prepare(source.convert("RGB"), min_edge)
+
+    @staticmethod
+    def _prepare(image: Image.Image, min_edge: int | None) -> Image.Image:
+        """Converts an image to RGB and reduces it to the minimum edge length if given."""
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if min_edge is not None and min(image.size) > min_edge:
+            scale = min_edge / min(image.size)
+            # Reducing by whole factors first is several times faster for large images and indistinguishable at a gap of 3.
+            image = image.resize((max(round(image.width * scale), 1), max(round(image.height * scale), 1)), Image.Resampling.BICUBIC,
+                                 reducing_gap=3.0)
+        return image
+
+
+_pool = ImagePool()
+
+
+def image_pool() -> ImagePool:
+    """
+    Gets the image pool of the process.
+
+    Returns:
+        ImagePool: The pool.
+    """
+    return _pool
+
+
+def set_image_pool(pool: ImagePool) -> None:
+    """
+    Replaces the image pool of the process, e.g. to change its byte budget.
+
+    Args:
+        pool (ImagePool): The new pool.
+    """
+    global _pool
+    _pool = pool
@@ -1,20 +1,27 @@
+import base64
+import hashlib
+import io
 import os
 from abc import ABC
-from typing import List
+from typing import Any, List
 
-import torch
 from PIL import Image
-from transformers import BitsAndBytesConfig
 
 from models.model import Model
+from models.perception.image_pool import ImageHandle, image_pool
 
 
 class PerceptionModel(Model, ABC):
     """
     A subclass of Model that includes perception capabilities with input images.
 
+    Input images, given as paths or in memory, are leased from the process-wide image pool as RGB, and released when
+    other images are set or release_images is called. With pre_resize, the pool keeps them reduced to the input size
+    of the vision encoder, so they are converted and reduced once for all models and analyses reading them.
+
     Attributes:
         name (str): The name of the model, defined at initialization.
+        pre_resize (bool): Whether images are reduced to the input size of the vision encoder when they are loaded.
     """
 
     def __init__(self, name: str) -> None:
@@ -26,6 +33,10 @@ class PerceptionModel(Model, ABC):
         """
         super().__init__(name)
         self._image_paths: List[str] = []
+        self._images: List[Image.Image] = []
+        self._handles: List[ImageHandle] = []
+        self._digests: List[str] | None = None
+        self.pre_resize: bool = False
 
     @property
     def image_paths(self) -> List[str]:
@@ -45,13 +56,121 @@ class PerceptionModel(Model, ABC):
         Args:
             value (List[str]): A list of image paths to set.
         """
+        self.release_images()
         self._image_paths = [os.path.abspath(path) for path in value]
+        self._images = []
+        self._digests = None
+
+    @property
+    def images(self) -> List[Image.Image]:
+        """
+        Gets the in-memory images for the model.
+
+        Returns:
+            List[Image.Image]: A list of images, empty if the model reads its images from image paths.
+        """
+        return self._images
+
+    @images.setter
+    def images(self, value: List[Image.Image]) -> None:
+        """
+        Sets in-memory images for the model, which are used instead of the image paths.
+
+        Args:
+            value (List[Image.Image]): A list of images to set.
+        """
+        self.release_images()
+        self._images = list(value)
+        self._image_paths = []
+        self._digests = None
+
+    def cache_key_parts(self, system_prompt: str) -> dict[str, Any]:
+        """
+        Extends the cache key with a content hash of every input image.
+
+        Args:
+            system_prompt (str): The system prompt for the model.
+
+        Returns:
+            dict[str, Any]: The JSON-serializable parts of the cache key.
+        """
+        return {**super().cache_key_parts(system_prompt), "images": self.image_digests(), "pre_resize": self.pre_resize}
+
+    def image_digests(self) -> List[str]:
+        """
+        Gets a content hash of every input image, computed once per set of images. Only the response cache needs them,
+        as the image pool identifies in-memory images by identity.
+
+        Returns:
+            List[str]: The SHA-256 digests of the files or of the mode, size and pixels of the in-memory images.
+        """
+        if self._digests is None:
+            digests = []
+            for path in self._image_paths:
+                with open(path, "rb") as file:
+                    digests.append(hashlib.file_digest(file, "sha256").hexdigest())
+            for image in self._images:
+                digests.append(hashlib.sha256(f"{image.mode}:{image.size}:".encode() + image.tobytes()).hexdigest())
+            self._digests = digests
+        return self._digests
+
+    def remote_settings(self) -> dict[str, Any]:
+        """
+        Extends the settings with the input images. Image paths are passed on, as the model server runs on the same
+        machine. In-memory images are encoded as PNG.
+
+        Returns:
+            dict[str, Any]: The JSON-serializable settings.
+        """
+        images = []
+        for image in self._images:
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            images.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+        return {**super().remote_settings(), "image_paths": self._image_paths, "images": images}
+
+    def apply_remote_settings(self, settings: dict[str, Any]) -> None:
+        """
+        Applies the settings of a client-side model, including its input images.
+
+        Args:
+            settings (dict[str, Any]): The settings.
+        """
+        super().apply_remote_settings(settings)
+        if settings["images"]:
+            self.images = [Image.open(io.BytesIO(base64.b64decode(data))) for data in settings["images"]]
+        else:
+            self.image_paths = settings["image_paths"]
+
+    def input_size(self) -> int | None:
+        """
+        Gets the length of the shorter image edge the vision encoder works with. Subclasses that know it override this.
+
+        Returns:
+            int | None: The edge length in pixels, or None if unknown.
+        """
+        return None
 
     def load_images(self) -> List[Image.Image]:
         """
-        Lazily loads the images from the paths.
+        Returns the input images as RGB, leasing them from the image pool on first use. Pooled images are shared and
+        must not be modified.
 
         Returns:
             List[Image.Image]: A list of loaded images.
         """
-        return [Image.open(path) for path in self._image_paths]
+        if not self._handles:
+            min_edge = self.input_size() if self.pre_resize else None
+            if self._images:
+                self._handles = [image_pool().acquire_image(image, min_edge) for image in self._images]
+            else:
+                self._handles = [image_pool().acquire(path, min_edge) for path in self._image_paths]
+        return [handle.image for handle in self._handles]
+
+    def release_images(self) -> None:
+        """
+        Releases the images leased from the image pool. They are leased again when they are loaded the next time.
+        """
+        handles, self._handles = self._handles, []
+        for handle in handles:
+            handle.close()
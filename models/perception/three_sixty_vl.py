@@ -1,54 +1,173 @@
+from typing import Any, ContextManager
+
 import torch
+from PIL import Image
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
+from models.perception.feature_cache import VisionFeatureCache
 from models.perception.perception_model import PerceptionModel
 
 
 class ThreeSixtyVLModel(PerceptionModel):
-    model = None
-    tokenizer = None
-
     def __init__(self) -> None:
         super().__init__("qihoo360/360VL-8B")
+        # The image processor reduces every image to its input size anyway, so the image pool does it once instead.
+        self.pre_resize = True
+        # The analyses ask many questions about the same image, whose tokens make up most of every prompt. As decoding
+        # is greedy, they are prefilled once and every question continues from a copy of their KV cache.
+        self.reuse_prefix = True
+
+        self._image_source: tuple | None = None
+        self._image: tuple[Image.Image, str] | None = None
+
+    def load(self) -> dict[str, Any]:
+        model = AutoModelForCausalLM.from_pretrained(self.name, **self.device_config.load_kwargs(), trust_remote_code=True).eval()
+        tokenizer = AutoTokenizer.from_pretrained(self.name, trust_remote_code=True)
+        tokenizer.pad_token = tokenizer.eos_token
+
+        # The vision tower is part of the shared model, so it only needs to be loaded once per model load.
+        vision_tower = model.get_vision_tower()
+        vision_tower.load_model()
+        vision_tower.to(device=self.device_config.device, dtype=self.device_config.dtype)
+        model = self.device_config.prepare(model)
+
+        # The cached features live as long as the model they were computed with.
+        feature_cache = VisionFeatureCache()
+        image_processor = feature_cache.wrap_image_processor(vision_tower.image_processor)
+
+        # Reuse the projected vision embeddings of images that have already been encoded.
+        if hasattr(model, "encode_images"):
+            model.encode_images = feature_cache.wrap_encoder(model.encode_images)
+
+        return {"model": model, "tokenizer": tokenizer, "image_processor": image_processor, "feature_cache": feature_cache}
+
+    @property
+    def image_processor(self) -> Any:
+        """
+        Gets the image processor of the vision tower, which reuses cached preprocessing results.
+
+        Returns:
+            Any: The image processor.
+        """
+        return self.components["image_processor"]
+
+    @property
+    def feature_cache(self) -> VisionFeatureCache:
+        """
+        Gets the cache of preprocessed images and vision embeddings of the loaded model.
+
+        Returns:
+            VisionFeatureCache: The feature cache.
+        """
+        return self.components["feature_cache"]
+
+    @property
+    def terminators(self) -> list[int]:
+        """
+        Gets the token ids that end a generation. Looked up on use, so creating the model, e.g. as client of the model
+        server, does not load it.
+
+        Returns:
+            list[int]: The token ids.
+        """
+        return [self.tokenizer.convert_tokens_to_ids("<|eot_id|>")]
+
+    def sampling_kwargs(self) -> dict[str, Any]:
+        return {
+            "do_sample": False,
+            "num_beams": 1,
+            "max_new_tokens": self.max_new_tokens,
+            "temperature": 0.7,
+            "use_cache": True,
+        }
+
+    def generation_kwargs(self) -> dict[str, Any]:
+        return {
+            **self.sampling_kwargs(),
+            "eos_token_id": self.terminators,
+            "pad_token_id": self.tokenizer.pad_token_id,
+        }
+
+    def batch_inputs(self, system_prompt: str, prompts: list[str]) -> dict[str, Any]:
+        image, _ = self._active_image()
+        inputs = [self.model.build_conversation_input_ids(self.tokenizer, query=f"{system_prompt} {prompt}", image=image, image_processor=self.image_processor)
+                  for prompt in prompts]
+
+        # Pad on the left, so that every prompt ends right before the generated tokens.
+        max_len = max(item["input_ids"].shape[1] for item in inputs)
+        input_ids = torch.full((len(inputs), max_len), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(inputs), max_len), dtype=torch.long)
+        for row, item in enumerate(inputs):
+            length = item["input_ids"].shape[1]
+            input_ids[row, max_len - length:] = item["input_ids"][0]
+            attention_mask[row, max_len - length:] = 1
+
+        # The multimodal input preparation re-pads the expanded image embeddings on this side.
+        self.model.config.tokenizer_padding_side = "left"
+
+        images = torch.cat([inputs[0]["image"]] * len(inputs))
+        return {
+            "input_ids": self.device_config.to_device(input_ids),
+            "attention_mask": self.device_config.to_device(attention_mask),
+            "images": self.device_config.to_device(images, floating=True),
+        }
+
+    def run_batch(self, system_prompt: str, prompts: list[str]) -> list[str]:
+        _, image_key = self._active_image()
+
+        # All prompts share the image, so it is preprocessed once and encoded once for the whole batch.
+        with self.feature_cache.activate([image_key] * len(prompts)):
+            return super().run_batch(system_prompt, prompts)
+
+    def run_with_shared_prefix(self, system_prompt: str, prompts: list[str]) -> list[str]:
+        _, image_key = self._active_image()
+
+        # The image is part of the shared prefix, so it is encoded once for all prompts.
+        with self.feature_cache.activate([image_key]):
+            return super().run_with_shared_prefix(system_prompt, prompts)
+
+    def generation_context(self) -> ContextManager:
+        _, image_key = self._active_image()
 
-        if ThreeSixtyVLModel.model is None or ThreeSixtyVLModel.tokenizer is None:
-            ThreeSixtyVLModel.model = AutoModelForCausalLM.from_pretrained(self.name,
-                                                                           quantization_config=self.quantization_config,
-                                                                           device_map='auto',
-                                                                           low_cpu_mem_usage=True,
-                                                                           trust_remote_code=True).eval()
-            ThreeSixtyVLModel.tokenizer = AutoTokenizer.from_pretrained(self.name, trust_remote_code=True)
-            ThreeSixtyVLModel.tokenizer.pad_token = self.tokenizer.eos_token
+        # A stream generates on a background thread, which needs the image marked as active as well.
+        return self.feature_cache.activate([image_key])
 
-        self.model = ThreeSixtyVLModel.model
-        self.tokenizer = ThreeSixtyVLModel.tokenizer
+    def input_size(self) -> int | None:
+        # CLIP-style processors resize the shorter edge to their crop size before cropping or padding.
+        size = getattr(self.image_processor, "crop_size", None) or getattr(self.image_processor, "size", None)
+        if isinstance(size, dict):
+            size = size.get("shortest_edge", size.get("height"))
+        return size if isinstance(size, int) else None
 
-        self.terminators = [self.tokenizer.convert_tokens_to_ids("<|eot_id|>", )]
+    def _active_image(self) -> tuple[Image.Image, str]:
+        """
+        Loads the first image as RGB together with its feature cache key, reusing both while the image inputs stay the same.
 
-        self.vision_tower = self.model.get_vision_tower()
-        self.vision_tower.load_model()
-        self.vision_tower.to(device="cuda", dtype=torch.float16)
-        self.image_processor = self.vision_tower.image_processor
+        Returns:
+            tuple[Image.Image, str]: The image and its key.
+        """
+        source = (tuple(self.image_paths), tuple(id(image) for image in self.images), self.pre_resize)
+        if self._image_source != source:
+            # The image pool converts the images to RGB and reduces them to the input size already.
+            image = self.load_images()[0]
+            self._image = (image, self.feature_cache.image_key(image, self.image_processor))
+            self._image_source = source
+        return self._image
 
-    def run(self, system_prompt: str, prompt: str) -> str:
-        image = self.load_images()[0].convert("RGB")
+    def inference(self, system_prompt: str, prompt: str) -> str:
+        image, image_key = self._active_image()
 
-        inputs = self.model.build_conversation_input_ids(self.tokenizer, query=f"{system_prompt} {prompt}", image=image, image_processor=self.image_processor)
+        # Within the active image, preprocessing and encoding results are served from the feature cache.
+        with self.feature_cache.activate([image_key]):
+            inputs = self.model.build_conversation_input_ids(self.tokenizer, query=f"{system_prompt} {prompt}", image=image, image_processor=self.image_processor)
 
-        input_ids = inputs["input_ids"].to(device='cuda', non_blocking=True)
-        images = inputs["image"].to(dtype=torch.float16, device='cuda', non_blocking=True)
+            input_ids = self.device_config.to_device(inputs["input_ids"])
+            images = self.device_config.to_device(inputs["image"], floating=True)
 
-        output_ids = self.model.generate(
-            input_ids,
-            images=images,
-            do_sample=False,
-            eos_token_id=self.terminators,
-            num_beams=1,
-            max_new_tokens=self.max_new_tokens,
-            temperature=0.7,
-            use_cache=True)
+            output_ids = self.model.generate(input_ids, images=images, **self.generation_kwargs())
 
         input_token_len = input_ids.shape[1]
+        self.count_tokens(input_ids, None, output_ids[:, input_token_len:])
         outputs = self.tokenizer.batch_decode(output_ids[:, input_token_len:], skip_special_tokens=True)[0]
         outputs = outputs.strip()
         return outputs
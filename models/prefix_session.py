@@ -0,0 +1,138 @@
+import copy
+import time
+from typing import Any, List
+
+import torch
+
+
+def shared_prefix_length(sequences: List[List[int]]) -> int:
+    """
+    Computes the length of the longest common token prefix of several sequences, leaving at least one token of each
+    sequence outside the prefix.
+
+    Args:
+        sequences (List[List[int]]): The token ids of the sequences.
+
+    Returns:
+        int: The number of leading tokens all sequences share.
+    """
+    if not sequences:
+        return 0
+
+    limit = min(len(sequence) for sequence in sequences) - 1
+    length = 0
+    while length < limit and all(sequence[length] == sequences[0][length] for sequence in sequences):
+        length += 1
+    return length
+
+
+class PrefixTimings:
+    """
+    Timing breakdown of a prefix session.
+
+    Attributes:
+        prefix_tokens (int): The number of tokens of the shared prefix.
+        prefix_seconds (float): The time spent prefilling the shared prefix.
+        suffix_tokens (int): The number of prompt tokens prefilled after the prefix, summed over all questions.
+        suffix_seconds (float): The time spent prefilling the question suffixes.
+        decode_tokens (int): The number of generated tokens, summed over all questions.
+        decode_seconds (float): The time spent generating tokens.
+        questions (int): The number of questions answered from the prefix.
+    """
+
+    def __init__(self) -> None:
+        self.prefix_tokens: int = 0
+        self.prefix_seconds: float = 0.0
+        self.suffix_tokens: int = 0
+        self.suffix_seconds: float = 0.0
+        self.decode_tokens: int = 0
+        self.decode_seconds: float = 0.0
+        self.questions: int = 0
+
+    @property
+    def saved_prefill_tokens(self) -> int:
+        """
+        Gets the number of prompt tokens that did not have to be prefilled again thanks to the shared prefix.
+
+        Returns:
+            int: The number of saved prefill tokens.
+        """
+        return max(self.questions - 1, 0) * self.prefix_tokens
+
+    def __str__(self) -> str:
+        decode_rate = self.decode_tokens / self.decode_seconds if self.decode_seconds > 0 else 0.0
+        return (f"prefix prefill: {self.prefix_tokens} tokens in {self.prefix_seconds:.3f}s, "
+                f"suffix prefill: {self.suffix_tokens} tokens in {self.suffix_seconds:.3f}s, "
+                f"decode: {self.decode_tokens} tokens in {self.decode_seconds:.3f}s ({decode_rate:.1f} tokens/s), "
+                f"saved prefill: {self.saved_prefill_tokens} tokens over {self.questions} questions")
+
+
+class PrefixSession:
+    """
+    Prefills a prompt prefix that several questions share once, snapshots its KV cache and answers each question by
+    continuing greedily from a copy of that cache.
+    """
+
+    def __init__(self, model: Any, prefix_ids: torch.Tensor, eos_token_ids: List[int], prefill_kwargs: dict[str, Any] = None) -> None:
+        """
+        Initializes the session and prefills the prefix.
+
+        Args:
+            model (Any): The transformers causal language model.
+            prefix_ids (torch.Tensor): The token ids of the shared prefix, with shape (1, length).
+            eos_token_ids (List[int]): The token ids that end a generation.
+            prefill_kwargs (dict[str, Any]): Additional model inputs that only belong to the prefix, e.g. images.
+        """
+        self.model = model
+        self.eos_token_ids = set(eos_token_ids)
+        self.timings = PrefixTimings()
+
+        start = self._now()
+        with torch.inference_mode():
+            output = model(input_ids=prefix_ids, use_cache=True, **(prefill_kwargs or {}))
+        self.timings.prefix_seconds += self._now() - start
+        self.timings.prefix_tokens = prefix_ids.shape[1]
+
+        self._past_key_values = output.past_key_values
+
+    def generate(self, suffix_ids: torch.Tensor, max_new_tokens: int) -> List[int]:
+        """
+        Greedily generates the answer to a question continuing the prefix.
+
+        Args:
+            suffix_ids (torch.Tensor): The token ids following the prefix, with shape (1, length) and length >= 1.
+            max_new_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            List[int]: The generated token ids, without the end-of-sequence token.
+        """
+        # Copy the snapshot, so the next question starts from the untouched prefix.
+        past_key_values = copy.deepcopy(self._past_key_values)
+        generated: List[int] = []
+
+        with torch.inference_mode():
+            start = self._now()
+            output = self.model(input_ids=suffix_ids, past_key_values=past_key_values, use_cache=True)
+            self.timings.suffix_seconds += self._now() - start
+            self.timings.suffix_tokens += suffix_ids.shape[1]
+
+            start = self._now()
+            while len(generated) < max_new_tokens:
+                next_token = int(output.logits[0, -1].argmax())
+                if next_token in self.eos_token_ids:
+                    break
+                generated.append(next_token)
+                next_ids = torch.tensor([[next_token]], device=suffix_ids.device)
+                output = self.model(input_ids=next_ids, past_key_values=output.past_key_values, use_cache=True)
+            self.timings.decode_seconds += self._now() - start
+
+        self.timings.decode_tokens += len(generated)
+        self.timings.questions += 1
+        return generated
+
+    @staticmethod
+    def _now() -> float:
+        """Returns the current time after waiting for pending accelerator work, so timings are attributed correctly."""
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return time.perf_counter()
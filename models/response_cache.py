@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any
+
+# Fraction of the maximum size eviction shrinks the cache to.
+EVICTION_TARGET = 0.9
+
+
+class ResponseCache:
+    """
+    Disk-backed, content-addressed cache of model responses.
+
+    Every response is stored in its own file named after the hash of everything that determines it. Files are written to
+    a temporary file and renamed into place, so concurrent processes sharing the directory never read a partial entry.
+    Reading an entry updates its modification time, which the size-bounded eviction uses as least-recently-used order.
+    The total size is tracked while writing and the directory is only scanned once it exceeds the maximum, so entries
+    other processes add are noticed at the next eviction. Eviction frees some headroom below the maximum, so a full
+    cache is not scanned again on every write.
+
+    Attributes:
+        directory (str): The directory the entries are stored in.
+        max_bytes (int): The maximum total size of all entries.
+        hits (int): The number of lookups in this process that found a response.
+        misses (int): The number of lookups in this process that did not find a response.
+    """
+
+    def __init__(self, directory: str = "./model_cache", max_bytes: int = 1024 * 1024 * 1024) -> None:
+        """
+        Initializes the cache.
+
+        Args:
+            directory (str): The directory the entries are stored in. It is created if necessary.
+            max_bytes (int): The maximum total size of all entries.
+        """
+        self.directory: str = os.path.realpath(directory)
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+        self._total: int | None = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(parts: dict[str, Any]) -> str:
+        """
+        Computes the cache key of a request.
+
+        Args:
+            parts (dict[str, Any]): Everything that determines the response, e.g. model name, generation parameters and prompts.
+
+        Returns:
+            str: The hex digest identifying the request.
+        """
+        serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """
+        Looks up a response.
+
+        Args:
+            key (str): The cache key of the request.
+
+        Returns:
+            str | None: The cached response, or None if the request has not been cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                response = json.load(file)["response"]
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Stores a response atomically and evicts the least recently used entries if the cache exceeds its size.
+
+        Args:
+            key (str): The cache key of the request.
+            response (str): The response of the model.
+        """
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+                json.dump({"response": response}, file, ensure_ascii=False)
+            size = os.path.getsize(temp_path)
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._entries())
+            else:
+                self._total += size - replaced
+            full = self._total > self.max_bytes
+        if full:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries if the cache exceeds its size, until it fits into EVICTION_TARGET of it.
+        Entries removed concurrently by another process are skipped.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET if total > self.max_bytes else self.max_bytes
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self._total = total
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        """Scans the directory for the modification time, size and path of every entry."""
+        entries = []
+        for root, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if file_name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _path(self, key: str) -> str:
+        """Returns the path of an entry, sharded by the first characters of its key."""
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+
+_default_cache: ResponseCache | None = None
+
+
+def default_response_cache() -> ResponseCache | None:
+    """
+    Gets the response cache new models use.
+
+    Returns:
+        ResponseCache | None: The cache, or None if responses are not cached.
+    """
+    return _default_cache
+
+
+def set_default_response_cache(cache: ResponseCache | None) -> None:
+    """
+    Sets the response cache new models use.
+
+    Args:
+        cache (ResponseCache | None): The cache, or None to disable caching.
+    """
+    global _default_cache
+    _default_cache = cache
@@ -0,0 +1,410 @@
+"""
+Resident model server that keeps the models loaded across pipeline runs and serves requests over a local socket.
+
+Pipeline processes connect with a ModelClient. Once a client is set with set_model_client, every model generates
+through the server instead of loading its weights in the process. The server queues the requests of all connected
+processes and merges compatible requests, i.e. for the same model, system prompt, settings and images, into a single
+multi_run call, so that they share micro-batches.
+
+Usage: python -m models.server [--socket PATH] [--batch-window S] [--stub]
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from models import create_model
+from models.device import DeviceConfig, set_device_config
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser("~"), ".ecoscapes", "model_server.sock")
+
+# Messages are JSON documents prefixed with their length as unsigned 32-bit big-endian integer.
+_LENGTH = struct.Struct(">I")
+
+
+class ModelServerError(RuntimeError):
+    """Raised on the client if the server failed to run a request."""
+
+
+def send_message(connection: socket.socket, message: Dict[str, Any]) -> None:
+    """
+    Sends a message over a connection.
+
+    Args:
+        connection (socket.socket): The connection.
+        message (Dict[str, Any]): The JSON-serializable message.
+    """
+    data = json.dumps(message).encode("utf-8")
+    connection.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def receive_message(connection: socket.socket) -> Dict[str, Any] | None:
+    """
+    Receives a message from a connection.
+
+    Args:
+        connection (socket.socket): The connection.
+
+    Returns:
+        Dict[str, Any] | None: The message, or None if the connection was closed.
+    """
+    header = _receive_exactly(connection, _LENGTH.size)
+    if header is None:
+        return None
+    data = _receive_exactly(connection, _LENGTH.unpack(header)[0])
+    if data is None:
+        raise ConnectionError("Connection closed in the middle of a message")
+    return json.loads(data)
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes | None:
+    """Receives a number of bytes, or returns None if the connection was closed before the first byte."""
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = connection.recv(size - len(buffer))
+        if not chunk:
+            if buffer:
+                raise ConnectionError("Connection closed in the middle of a message")
+            return None
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+class ModelClient:
+    """
+    Sends the generation requests of models to a model server.
+
+    Every request uses its own connection, so the client can be shared by all threads of a process.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float | None = None) -> None:
+        """
+        Initializes the client.
+
+        Args:
+            socket_path (str): The path of the socket the server listens on.
+            timeout (float | None): The maximum time in seconds to wait for a response, or None to wait as long as the generation takes.
+        """
+        self.socket_path: str = socket_path
+        self.timeout: float | None = timeout
+
+    def generate(self, model: Any, system_prompt: str, prompts: List[str]) -> List[str]:
+        """
+        Generates the results of prompts with the server's instance of a model.
+
+        Args:
+            model (Model): The client-side model, whose class and settings select the model on the server.
+            system_prompt (str): The system prompt for the model.
+            prompts (List[str]): The user prompts.
+
+        Returns:
+            List[str]: The result for each prompt, in prompt order.
+
+        Raises:
+            ModelServerError: If the server failed to run the request.
+            OSError: If the server cannot be reached.
+        """
+        response = self.request({
+            "model": type(model).__name__,
+            "settings": model.remote_settings(),
+            "system_prompt": system_prompt,
+            "prompts": prompts,
+        })
+        return response["results"]
+
+    def token_lengths(self, model: Any, texts: List[str]) -> List[int]:
+        """
+        Counts the tokens of texts with the tokenizer of the server's instance of a model.
+
+        Args:
+            model (Model): The client-side model.
+            texts (List[str]): The texts.
+
+        Returns:
+            List[int]: The number of tokens of each text.
+
+        Raises:
+            ModelServerError: If the server failed to count the tokens.
+            OSError: If the server cannot be reached.
+        """
+        return self.request({"model": type(model).__name__, "texts": texts})["lengths"]
+
+    def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Sends a request and waits for its response.
+
+        Args:
+            message (Dict[str, Any]): The request.
+
+        Returns:
+            Dict[str, Any]: The response.
+
+        Raises:
+            ModelServerError: If the server failed to run the request.
+            OSError: If the server cannot be reached.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            send_message(connection, message)
+            response = receive_message(connection)
+
+        if response is None:
+            raise ModelServerError("The model server closed the connection without a response")
+        if "error" in response:
+            raise ModelServerError(response["error"])
+        return response
+
+
+class PendingRequest:
+    """
+    A request waiting in the queue of the server.
+
+    Attributes:
+        message (Dict[str, Any]): The request.
+        results (List[str] | None): The results once the request has run.
+        error (str | None): The error message if the request failed.
+        done (threading.Event): Set once the request has run.
+    """
+
+    def __init__(self, message: Dict[str, Any]) -> None:
+        self.message: Dict[str, Any] = message
+        self.results: List[str] | None = None
+        self.error: str | None = None
+        self.done = threading.Event()
+
+    @property
+    def batch_key(self) -> str:
+        """
+        Gets the key of the requests that can run together in one multi_run call.
+
+        Returns:
+            str: The hash of everything but the user prompts.
+        """
+        parts = {name: value for name, value in self.message.items() if name != "prompts"}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ModelServer:
+    """
+    Serves the generation requests of model clients from resident models.
+
+    Every connection is handled by its own thread, which queues its requests. A single worker thread runs the queued
+    requests one batch after another, so the models never run concurrently on the accelerator. After the first request
+    of a batch arrives, the worker waits for the batch window to collect concurrent requests and merges all compatible
+    ones into one multi_run call. Token counting requests only need the tokenizer and are answered right away.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, factory: Callable[[str], Any] = create_model,
+                 batch_window: float = 0.01) -> None:
+        """
+        Initializes the server.
+
+        Args:
+            socket_path (str): The path of the socket to listen on. A stale socket file is replaced.
+            factory (Callable[[str], Model]): Creates the server's instance of a model by class name.
+            batch_window (float): The time in seconds the worker waits for further requests before running a batch.
+        """
+        self.socket_path: str = socket_path
+        self.factory: Callable[[str], Any] = factory
+        self.batch_window: float = batch_window
+        self.batches: int = 0
+        self.requests: int = 0
+        self._models: Dict[str, Any] = {}
+        self._models_lock = threading.Lock()
+        self._queue: "queue.Queue[PendingRequest | None]" = queue.Queue()
+        self._listener: socket.socket | None = None
+        self._stopped = threading.Event()
+
+    def serve_forever(self) -> None:
+        """Accepts connections until shutdown is called."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.socket_path)
+        self._listener.listen()
+        worker = threading.Thread(target=self._work, name="model-worker", daemon=True)
+        worker.start()
+
+        try:
+            while not self._stopped.is_set():
+                try:
+                    connection, _ = self._listener.accept()
+                except OSError:
+                    # The listener was closed by shutdown.
+                    break
+                threading.Thread(target=self._handle, args=(connection,), name="model-connection", daemon=True).start()
+        finally:
+            self._queue.put(None)
+            worker.join()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def shutdown(self) -> None:
+        """Stops accepting connections. Requests already queued are still run."""
+        self._stopped.set()
+        if self._listener is not None:
+            # Closing alone does not wake up a blocking accept on every platform.
+            try:
+                self._listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._listener.close()
+
+    def _handle(self, connection: socket.socket) -> None:
+        """Queues the requests of a connection and sends their responses."""
+        with connection:
+            while True:
+                try:
+                    message = receive_message(connection)
+                except (ConnectionError, ValueError):
+                    return
+                if message is None:
+                    return
+
+                if "texts" in message:
+                    try:
+                        response = {"lengths": self._model(message["model"]).token_lengths(message["texts"])}
+                    except Exception as error:
+                        response = {"error": f"{type(error).__name__}: {error}"}
+                else:
+                    request = PendingRequest(message)
+                    self._queue.put(request)
+                    request.done.wait()
+                    response = {"error": request.error} if request.error is not None else {"results": request.results}
+
+                try:
+                    send_message(connection, response)
+                except OSError:
+                    return
+
+    def _work(self) -> None:
+        """Runs the queued requests in batches until the queue is closed."""
+        # The models of the server run locally, even if the process has a client set.
+        _serving.active = True
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            time.sleep(self.batch_window)
+            pending = [first]
+            closed = False
+            while True:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    closed = True
+                    break
+                pending.append(request)
+
+            # Compatible requests form one batch, batches run in the order of their first request.
+            batches: Dict[str, List[PendingRequest]] = {}
+            for request in pending:
+                batches.setdefault(request.batch_key, []).append(request)
+            for batch in batches.values():
+                self._run(batch)
+
+            if closed:
+                return
+
+    def _run(self, batch: List[PendingRequest]) -> None:
+        """Runs compatible requests in one multi_run call of the model."""
+        message = batch[0].message
+        prompts = [prompt for request in batch for prompt in request.message["prompts"]]
+        try:
+            model = self._model(message["model"])
+            model.apply_remote_settings(message["settings"])
+            results = model.multi_run(message["system_prompt"], prompts)
+        except Exception as error:
+            for request in batch:
+                request.error = f"{type(error).__name__}: {error}"
+                request.done.set()
+            return
+
+        self.batches += 1
+        self.requests += len(batch)
+        start = 0
+        for request in batch:
+            request.results = results[start:start + len(request.message["prompts"])]
+            start += len(request.message["prompts"])
+            request.done.set()
+
+    def _model(self, name: str) -> Any:
+        """Gets the server's instance of a model, creating it on first use."""
+        with self._models_lock:
+            if name not in self._models:
+                self._models[name] = self.factory(name)
+            return self._models[name]
+
+
+_client: ModelClient | None = None
+_serving = threading.local()
+
+
+def model_client() -> ModelClient | None:
+    """
+    Gets the client models of the process generate through.
+
+    Returns:
+        ModelClient | None: The client, or None if models run in the process, which they always do on the worker thread of a server.
+    """
+    if getattr(_serving, "active", False):
+        return None
+    return _client
+
+
+def set_model_client(client: ModelClient | None) -> None:
+    """
+    Sets the client models of the process generate through.
+
+    Args:
+        client (ModelClient | None): The client, or None to run models in the process.
+    """
+    global _client
+    _client = client
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Serve the EcoScapes models to pipeline processes over a local socket.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Path of the socket to listen on.")
+    parser.add_argument("--batch-window", type=float, default=0.01, help="Seconds to wait for concurrent requests to batch together.")
+    parser.add_argument("--device", default="auto", help="Torch device the models run on, e.g. cuda or cpu. By default, an available accelerator is used.")
+    parser.add_argument("--dtype", help="Torch dtype of the model weights, e.g. bfloat16. By default, float16 on CUDA and float32 elsewhere.")
+    parser.add_argument("--quantization", choices=["auto", "4bit", "int8", "none"], default="auto", help="Quantization of the model weights: 4bit with bitsandbytes on CUDA, dynamic int8 on the CPU.")
+    parser.add_argument("--threads", type=int, help="Number of threads torch parallelizes a single operation with.")
+    parser.add_argument("--interop-threads", type=int, help="Number of threads torch runs independent operations on.")
+    parser.add_argument("--stub", action="store_true", help="Serve the deterministic stub models of the benchmarks, which run on a CPU.")
+    parser.add_argument("--stub-latency", type=float, default=0.02, help="Simulated seconds per generate call of the stub models.")
+    arguments = parser.parse_args()
+
+    set_device_config(DeviceConfig(arguments.device, arguments.dtype, None if arguments.quantization == "none" else arguments.quantization,
+                                   arguments.threads, arguments.interop_threads))
+    if arguments.stub:
+        from benchmarks.stubs import register_stub_models
+
+        register_stub_models(call_latency=arguments.stub_latency)
+
+    server = ModelServer(arguments.socket, batch_window=arguments.batch_window)
+    print(f"Serving models on {arguments.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {server.requests} requests in {server.batches} batches")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import functools
+import threading
+import time
+from typing import Any
+
+
+class GenerationBudget:
+    """
+    Stop condition of a streamed generation. Once the budget is used up, the generation ends cleanly and everything
+    produced so far is kept.
+
+    Attributes:
+        max_seconds (float | None): The maximum wall time of the generation in seconds, or None for no limit.
+        max_tokens (int | None): The maximum number of generated tokens, or None for the limit of the model.
+    """
+
+    def __init__(self, max_seconds: float | None = None, max_tokens: int | None = None) -> None:
+        """
+        Initializes the budget.
+
+        Args:
+            max_seconds (float | None): The maximum wall time of the generation in seconds, or None for no limit.
+            max_tokens (int | None): The maximum number of generated tokens, or None for the limit of the model.
+        """
+        self.max_seconds: float | None = max_seconds
+        self.max_tokens: int | None = max_tokens
+
+    def limit(self, generation_kwargs: dict[str, Any]) -> dict[str, Any]:
+        """
+        Applies the token budget to the keyword arguments of a generate call.
+
+        Args:
+            generation_kwargs (dict[str, Any]): The generation parameters of the model.
+
+        Returns:
+            dict[str, Any]: The generation parameters with max_new_tokens lowered to the budget.
+        """
+        if self.max_tokens is None:
+            return generation_kwargs
+        return {**generation_kwargs, "max_new_tokens": min(generation_kwargs.get("max_new_tokens", self.max_tokens), self.max_tokens)}
+
+
+class StopCondition:
+    """
+    Stops a generation once its time budget is used up or it is cancelled, e.g. because the consumer of the stream
+    stopped reading. The condition itself does not depend on torch, see stopping_criteria for passing it to generate.
+
+    Attributes:
+        reason (str | None): "time" or "cancelled" once the condition stopped the generation, otherwise None.
+    """
+
+    def __init__(self, max_seconds: float | None = None) -> None:
+        """
+        Initializes the condition. The time budget starts now.
+
+        Args:
+            max_seconds (float | None): The maximum wall time of the generation in seconds, or None for no limit.
+        """
+        self.deadline: float | None = time.monotonic() + max_seconds if max_seconds is not None else None
+        self.reason: str | None = None
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """Stops the generation at the next token."""
+        self._cancelled.set()
+
+    def check(self) -> bool:
+        """
+        Checks whether the generation has to stop, recording the reason.
+
+        Returns:
+            bool: True if the generation has to stop.
+        """
+        if self._cancelled.is_set():
+            self.reason = "cancelled"
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = "time"
+        return self.reason is not None
+
+
+def stopping_criteria(condition: StopCondition) -> Any:
+    """
+    Wraps a stop condition for the stopping_criteria argument of generate. Torch and transformers are only imported
+    here, so that modules using budgets do not load them.
+
+    Args:
+        condition (StopCondition): The stop condition.
+
+    Returns:
+        StoppingCriteriaList: The stopping criteria checking the condition after every token.
+    """
+    from transformers import StoppingCriteriaList
+
+    return StoppingCriteriaList([_criteria_class()(condition)])
+
+
+@functools.cache
+def _criteria_class() -> type:
+    """Creates the StoppingCriteria subclass checking a StopCondition once transformers is needed."""
+    import torch
+    from transformers import StoppingCriteria
+
+    class ConditionCriteria(StoppingCriteria):
+        def __init__(self, condition: StopCondition) -> None:
+            self.condition = condition
+
+        def __call__(self, input_ids: torch.LongTensor, scores: Any, **kwargs: Any) -> torch.BoolTensor:
+            return torch.full((input_ids.shape[0],), self.condition.check(), dtype=torch.bool, device=input_ids.device)
+
+    return ConditionCriteria
@@ -1,11 +1,83 @@
-from modules.climate_report import ClimateReport
-from modules.location_extraction import LocationExtraction
+import importlib
+from typing import Any, Callable, Dict, Iterable, List, Type
+
 from modules.module import Module
-from modules.moisture_analysis import MoistureAnalysis
-from modules.rgb_analysis import RGBAnalysis
-from modules.satellite_loader import SatelliteLoader
-from modules.water_analysis import WaterAnalysis
-from modules.water_preprocessing import WaterPreprocessing
-from modules.water_rgb_analysis import WaterRGBAnalysis
-
-__all__ = ["LocationExtraction", "Module", "MoistureAnalysis", "ClimateReport", "RGBAnalysis", "SatelliteLoader", "WaterAnalysis", "WaterPreprocessing", "WaterRGBAnalysis"]
+
+# Module classes by name, mapped to the submodule defining them. Submodules are only imported once a module is
+# requested, so their heavy dependencies are only loaded for modules that actually run.
+MODULES: Dict[str, str] = {
+    "ClimateReport": "modules.climate_report",
+    "LocationExtraction": "modules.location_extraction",
+    "MoistureAnalysis": "modules.moisture_analysis",
+    "RGBAnalysis": "modules.rgb_analysis",
+    "SatelliteLoader": "modules.satellite_loader",
+    "WaterAnalysis": "modules.water_analysis",
+    "WaterPreprocessing": "modules.water_preprocessing",
+    "WaterRGBAnalysis": "modules.water_rgb_analysis",
+}
+
+
+def module_names() -> List[str]:
+    """
+    Get the names of all available modules.
+
+    :return: Module names in alphabetical order.
+    """
+    return sorted(MODULES)
+
+
+def get_module_class(name: str) -> Type[Module]:
+    """
+    Import and return a module class by name.
+
+    :param name: Name of the module.
+    :return: The module class.
+    :raises KeyError: If no module with this name exists.
+    """
+    if name not in MODULES:
+        raise KeyError(f"Unknown module: {name}")
+    return getattr(importlib.import_module(MODULES[name]), name)
+
+
+def create_module(name: str, **options: Any) -> Module:
+    """
+    Create a module by name.
+
+    :param name: Name of the module.
+    :param options: Keyword arguments of the constructor of the module, e.g. max_seconds of ClimateReport.
+    :return: A new instance of the module.
+    """
+    return get_module_class(name)(**options)
+
+
+def create_with_dependencies(targets: Iterable[str], soft_dependencies: bool = False, create: Callable[[str], Module] = create_module) -> List[Module]:
+    """
+    Create the modules needed to produce the results of some target modules: the targets together with every module
+    they depend on, directly or transitively. No other module is created, so the submodules of the others are not even
+    imported.
+
+    :param targets: Names of the target modules.
+    :param soft_dependencies: Whether to follow soft dependencies, too. Otherwise, only hard dependencies are created.
+    :param create: Creates a module by name, e.g. to substitute modules.
+    :return: The created modules in the order they were discovered in, starting with the targets.
+    :raises KeyError: If a target or dependency does not exist.
+    """
+    modules: Dict[str, Module] = {}
+    pending = list(dict.fromkeys(targets))
+    while pending:
+        name = pending.pop(0)
+        if name in modules:
+            continue
+        module = modules[name] = create(name)
+        pending.extend(sorted(module.dependencies | (module.soft_dependencies if soft_dependencies else set())))
+    return list(modules.values())
+
+
+def __getattr__(name: str):
+    if name in MODULES:
+        return get_module_class(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["LocationExtraction", "Module", "MoistureAnalysis", "ClimateReport", "RGBAnalysis", "SatelliteLoader", "WaterAnalysis", "WaterPreprocessing", "WaterRGBAnalysis",
+           "create_module", "create_with_dependencies", "get_module_class", "module_names"]
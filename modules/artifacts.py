@@ -0,0 +1,383 @@
+import contextlib
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Set
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+class FileBackend:
+    """
+    Persists artifacts as files, using the file name of the artifact as its name.
+
+    Text artifacts are written as text files, images and rasters with an image extension as images and other rasters as
+    .npy files.
+    """
+
+    def __init__(self, directory: str, locations: Dict[str, str] = None):
+        """
+        Initialize the backend.
+
+        :param directory: Directory artifacts are stored in by default.
+        :param locations: Directories for individual artifacts that are not stored in the default directory.
+        """
+        self.directory = directory
+        self.locations = locations if locations is not None else {}
+
+    def path(self, name: str) -> str:
+        """
+        Get the file path of an artifact.
+
+        :param name: Name of the artifact.
+        :return: Path of the file the artifact is stored in.
+        """
+        return os.path.join(self.locations.get(name, self.directory), name)
+
+    def exists(self, name: str) -> bool:
+        """
+        Check whether an artifact has been persisted.
+
+        :param name: Name of the artifact.
+        :return: True if the file of the artifact exists.
+        """
+        return os.path.exists(self.path(name))
+
+    def save(self, name: str, value: Any) -> None:
+        """
+        Write an artifact to disk, replacing the file atomically.
+
+        :param name: Name of the artifact.
+        :param value: Text, NumPy array or PIL image.
+        """
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write next to the target and rename, so readers never see a half-written file.
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.splitext(name)[1])
+        os.close(file_descriptor)
+        try:
+            self._write(temp_path, name, value)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def append(self, name: str, text: str) -> None:
+        """
+        Append text to a text artifact on disk.
+
+        :param name: Name of the artifact.
+        :param text: Text to append.
+        """
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(text)
+
+    def load(self, name: str) -> Any:
+        """
+        Read an artifact from disk.
+
+        :param name: Name of the artifact.
+        :return: Text for text files, a PIL image for image files and a read-only memory-mapped NumPy array for .npy files.
+        """
+        path = self.path(name)
+        extension = os.path.splitext(name)[1].lower()
+
+        if extension in IMAGE_EXTENSIONS:
+            from PIL import Image
+
+            with Image.open(path) as image:
+                image.load()
+                # Palette images would otherwise turn into arrays of palette indices.
+                return image.convert("RGBA") if image.mode == "P" else image.copy()
+        if extension == ".npy":
+            import numpy as np
+
+            # Memory-mapped, so processes reading the same raster share its pages instead of holding copies.
+            return np.load(path, mmap_mode="r")
+
+        with open(path, "r", encoding="utf-8") as file:
+            return file.read()
+
+    @staticmethod
+    def _write(path: str, name: str, value: Any) -> None:
+        """Write a value to a file in the format matching its type and artifact name."""
+        if isinstance(value, str):
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(value)
+            return
+
+        extension = os.path.splitext(name)[1].lower()
+        if hasattr(value, "save"):
+            value.save(path, format=None if extension else "PNG")
+        elif extension in IMAGE_EXTENSIONS:
+            from PIL import Image
+
+            Image.fromarray(value).save(path)
+        else:
+            import numpy as np
+
+            with open(path, "wb") as file:
+                np.save(file, value)
+
+
+class ArtifactAccess:
+    """
+    The artifacts a thread read and wrote while recording, see ArtifactStore.recording.
+
+    Reads include checks whether an artifact exists, as their outcome can change what a module does. Writes map the
+    name of every published or appended artifact to whether it was persisted.
+    """
+
+    def __init__(self):
+        self.reads: Set[str] = set()
+        self.writes: Dict[str, bool] = {}
+
+
+class ArtifactStore:
+    """
+    In-memory store of the named artifacts the modules of one run publish and consume.
+
+    Artifacts are kept in memory for the lifetime of the run. If a backend is given, they are also persisted, either in
+    the background as soon as they are published or on demand when flush() is called. Artifacts that are not in memory
+    are loaded from the backend, e.g. results of an earlier run. Artifacts that can be derived from others, such as
+    visualizations of rasters, are rendered on first access by a registered renderer.
+
+    Published values are shared between modules and must not be modified afterwards.
+    """
+
+    def __init__(self, backend: FileBackend | None = None, background: bool = True):
+        """
+        Initialize the store.
+
+        :param backend: Backend the artifacts are persisted to, or None to keep them in memory only.
+        :param background: Whether to persist artifacts in the background as soon as they are published. Otherwise, they are persisted by flush().
+        """
+        self.backend = backend
+        self.background = background
+        self._artifacts: Dict[str, Any] = {}
+        self._renderers: Dict[str, Callable[["ArtifactStore"], Any]] = {}
+        self._dirty: Dict[str, bool] = {}
+        self._lock = threading.RLock()
+        self._writer: ThreadPoolExecutor | None = None
+        self._pending: List[Future] = []
+        self._recording = threading.local()
+        self._loading: Dict[str, threading.Lock] = {}
+
+    def publish(self, name: str, value: Any, persist: bool = True) -> None:
+        """
+        Publish an artifact, replacing an existing artifact with the same name.
+
+        :param name: Name of the artifact, including a file extension that determines its format on disk.
+        :param value: Text, NumPy array or PIL image.
+        :param persist: Whether the artifact should be written to the backend.
+        """
+        self._record_write(name, persist)
+        with self._lock:
+            self._artifacts[name] = value
+            if persist and self.backend is not None:
+                if self.background:
+                    self._submit(self.backend.save, name, value)
+                else:
+                    self._dirty[name] = True
+
+    def add_renderer(self, name: str, render: Callable[["ArtifactStore"], Any]) -> None:
+        """
+        Register how an artifact is derived from other artifacts if it has neither been published nor persisted.
+        Rendered artifacts are kept in memory only.
+
+        :param name: Name of the artifact.
+        :param render: Renders the artifact, given this store to consume its sources from.
+        """
+        with self._lock:
+            self._renderers[name] = render
+
+    def append_text(self, name: str, text: str, persist: bool = True) -> None:
+        """
+        Append text to a text artifact, creating it if it does not exist.
+
+        :param name: Name of the artifact.
+        :param text: Text to append.
+        :param persist: Whether the appended text should be written to the backend.
+        """
+        self._record_write(name, persist)
+        # Loaded before taking the store lock, as loading waits for the lock of the artifact while holding no other.
+        if self.contains(name):
+            self.get(name)
+        with self._lock:
+            current = self._artifacts.get(name)
+            self._artifacts[name] = (current or "") + text
+
+            if persist and self.backend is not None:
+                if self.background:
+                    self._submit(self.backend.append, name, text)
+                else:
+                    self._dirty[name] = True
+
+    def contains(self, name: str) -> bool:
+        """
+        Check whether an artifact is available in memory or in the backend.
+
+        :param name: Name of the artifact.
+        :return: True if the artifact can be consumed.
+        """
+        self._record_read(name)
+        with self._lock:
+            if name in self._artifacts or name in self._renderers:
+                return True
+        return self.backend is not None and self.backend.exists(name)
+
+    def get(self, name: str) -> Any:
+        """
+        Get an artifact in the type it was published or loaded as.
+
+        :param name: Name of the artifact.
+        :return: The artifact.
+        :raises KeyError: If the artifact has neither been published nor persisted and cannot be rendered.
+        """
+        self._record_read(name)
+        with self._lock:
+            if name in self._artifacts:
+                return self._artifacts[name]
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        # Loaded and rendered under a lock of the artifact only, so modules consuming other artifacts are not blocked
+        # while large rasters are decoded, and modules consuming the same artifact wait for a single load.
+        with loading:
+            with self._lock:
+                if name in self._artifacts:
+                    return self._artifacts[name]
+                render = self._renderers.get(name)
+
+            if self.backend is not None and self.backend.exists(name):
+                value = self.backend.load(name)
+            elif render is not None:
+                value = render(self)
+            else:
+                raise KeyError(f"Artifact not found: {name}")
+
+            # An artifact published meanwhile wins over the loaded one.
+            with self._lock:
+                return self._artifacts.setdefault(name, value)
+
+    def text(self, name: str) -> str:
+        """
+        Get a text artifact.
+
+        :param name: Name of the artifact.
+        :return: Text of the artifact.
+        :raises TypeError: If the artifact is not text.
+        """
+        value = self.get(name)
+        if not isinstance(value, str):
+            raise TypeError(f"Artifact {name} is not text")
+        return value
+
+    def array(self, name: str):
+        """
+        Get an image or raster artifact as a NumPy array.
+
+        :param name: Name of the artifact.
+        :return: Array of the artifact.
+        """
+        import numpy as np
+
+        value = self.get(name)
+        if isinstance(value, str):
+            raise TypeError(f"Artifact {name} is text, not a raster")
+        return value if isinstance(value, np.ndarray) else np.asarray(value)
+
+    def image(self, name: str):
+        """
+        Get an image or raster artifact as a PIL image.
+
+        :param name: Name of the artifact.
+        :return: Image of the artifact.
+        """
+        from PIL import Image
+
+        value = self.get(name)
+        if isinstance(value, str):
+            raise TypeError(f"Artifact {name} is text, not an image")
+        return value if isinstance(value, Image.Image) else Image.fromarray(value)
+
+    def flush(self) -> None:
+        """
+        Persist all artifacts that have not been written yet and wait for pending background writes.
+
+        :raises Exception: The first error that occurred while writing an artifact.
+        """
+        with self._lock:
+            for name in list(self._dirty):
+                self.backend.save(name, self._artifacts[name])
+                del self._dirty[name]
+            pending, self._pending = self._pending, []
+
+        for future in pending:
+            future.result()
+
+    def wait_for_writes(self) -> None:
+        """
+        Wait until the background writes queued so far are on disk. Unlike flush, errors are left to flush to raise.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+
+    def discard(self, name: str) -> None:
+        """
+        Remove an artifact from memory and delete its persisted file, e.g. because it is outdated.
+
+        :param name: Name of the artifact.
+        """
+        self.wait_for_writes()
+        with self._lock:
+            self._artifacts.pop(name, None)
+            self._dirty.pop(name, None)
+            if self.backend is not None and self.backend.exists(name):
+                os.remove(self.backend.path(name))
+
+    @contextlib.contextmanager
+    def recording(self) -> Iterator[ArtifactAccess]:
+        """
+        Record the artifacts the current thread reads and writes within the context.
+
+        :return: Context manager yielding the recorded access, which is complete once the context is left.
+        """
+        access = ArtifactAccess()
+        previous = getattr(self._recording, "access", None)
+        self._recording.access = access
+        try:
+            yield access
+        finally:
+            self._recording.access = previous
+
+    def _record_read(self, name: str) -> None:
+        access = getattr(self._recording, "access", None)
+        if access is not None:
+            access.reads.add(name)
+
+    def _record_write(self, name: str, persist: bool) -> None:
+        access = getattr(self._recording, "access", None)
+        if access is not None:
+            access.writes[name] = access.writes.get(name, False) or persist
+
+    def close(self) -> None:
+        """Flush the store and stop its background writer."""
+        try:
+            self.flush()
+        finally:
+            if self._writer is not None:
+                self._writer.shutdown(wait=True)
+                self._writer = None
+
+    def _submit(self, function, *args) -> None:
+        """Queue a write on the background writer. A single writer keeps writes to the same artifact in order."""
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-writer")
+        self._pending = [future for future in self._pending if not future.done() or future.exception() is not None]
+        self._pending.append(self._writer.submit(function, *args))
@@ -1,19 +1,36 @@
+import time
 from typing import override
 
-import models.llama_three
+from models import create_model
+from models.context_builder import ContextBuilder
+from models.streaming import GenerationBudget
 from modules.module import Module, ModuleResult
+from pipeline.tracing import tracer
 
 
 class ClimateReport(Module):
-    def __init__(self):
-        super().__init__("ClimateReport", dependencies={"RGBAnalysis", "MoistureAnalysis"}, soft_dependencies={"WaterRGBAnalysis"})
+    def __init__(self, max_seconds: float = None, max_tokens: int = None, prompt_budget: int = None, chunk_tokens: int = 4096):
+        """
+        Initialize the module.
+
+        :param max_seconds: Maximum time the report may be generated for, or None for no limit.
+        :param max_tokens: Maximum number of tokens of the report, or None for the limit of the model.
+        :param prompt_budget: Maximum number of tokens of the prompt. Longer analyses are summarized first. By default,
+            everything the context of the model leaves next to the prompt template and the tokens of the report.
+        :param chunk_tokens: Maximum number of tokens of the analysis parts that are summarized in one prompt.
+        """
+        super().__init__("ClimateReport", dependencies={"RGBAnalysis", "MoistureAnalysis"}, soft_dependencies={"WaterRGBAnalysis"}, resources={"gpu"}, models={"InternLM"})
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.prompt_budget = prompt_budget
+        self.chunk_tokens = chunk_tokens
 
     @override
     def main(self) -> ModuleResult:
         # Benchmark: https://github.com/BradyFU/Awesome-Multimodal-Large-Language-Models/tree/Evaluation
         # model = LlavaNextForConditionalGeneration.from_pretrained("llava-hf/llava-v1.6-mistral-7b-hf",quantization_config=quantization_config, device_map="auto")
 
-        model = models.intern_lm.InternLM()
+        model = create_model("InternLM")
         model.max_new_tokens = 16384
 
         location = self.load_location()
@@ -23,14 +40,34 @@ class ClimateReport(Module):
             " Only focus on the current situation and do not make any predictions.")
 
         rgb_analysis = self.load_from_file("rgb_analysis.txt")
+        # The description of the buildings near water extends the RGB analysis if WaterRGBAnalysis succeeded.
+        if self.artifacts.contains("water_rgb_analysis.txt"):
+            rgb_analysis += self.load_from_file("water_rgb_analysis.txt")
         moisture_analysis = self.load_from_file("moisture_analysis.txt")
 
         system_prompt = ("You are a climate scientist with a focus on climate adaptation."
                          " You will be given tasks that will result in a report to analyse the current state of climate adaptation in a city or town."
                          " Answer accurately, informatively and in a neutral way that aligns with the scientific consensus.")
 
-        prompt = original_prompt + " The RGB satellite image description: " + rgb_analysis + " The moisture map description: " + moisture_analysis
-        output = model.run(system_prompt, prompt)
+        # Analyses that do not fit into the prompt budget are summarized before the report is written.
+        prompt_budget = self.prompt_budget if self.prompt_budget is not None else model.prompt_budget(self.max_tokens)
+        if prompt_budget is None:
+            raise ValueError(f"The context length of {model.name} is unknown, so the prompt budget of the climate report has to be given")
+        builder = ContextBuilder(model, prompt_budget, self.chunk_tokens)
+        prompt = builder.build(system_prompt, original_prompt, {"RGB satellite image description": rgb_analysis,
+                                                                "moisture map description": moisture_analysis})
+        budget = GenerationBudget(self.max_seconds, self.max_tokens) if self.max_seconds is not None or self.max_tokens is not None else None
+
+        start = time.perf_counter()
+        with tracer().span("report", "stage") as span:
+            # The report is written while it is generated, so a long generation can be watched and is not lost on a crash.
+            report = self.stream_to_file("climate_report.txt", model.stream(system_prompt, prompt, budget))
+            prompt_tokens, report_tokens = model.token_lengths([f"{system_prompt} {prompt}", report])
+            if span is not None:
+                span.args.update(input_tokens=prompt_tokens, output_tokens=report_tokens, calls=1)
+        builder.record_stage("report", prompt_tokens, report_tokens, time.perf_counter() - start, 1)
 
-        self.save_to_file("climate_report.txt", output)
+        print(f"Climate report stages of {location}:\n{builder.summary()}")
+        if model.last_stop_reason is not None:
+            print(f"The climate report of {location} was cut off by the {model.last_stop_reason} budget, keeping the partial report")
         return ModuleResult.OK
@@ -0,0 +1,86 @@
+import os
+import threading
+
+from modules.artifacts import ArtifactStore, FileBackend
+
+# Artifacts of the downloaded satellite data, stored in the satellite data directory of the location: the true color
+# image and the raw float32 index rasters, as well as the 8-bit index images of manually downloaded data.
+SATELLITE_ARTIFACTS = ["rgb.png", "moisture_index.npy", "water_index.npy", "moisture.png", "water.png"]
+
+
+def render_moisture(artifacts: ArtifactStore):
+    """
+    Render the moisture index raster with the moisture color ramp for the image analysis.
+
+    :param artifacts: Artifact store containing the moisture index raster.
+    :return: RGBA image.
+    """
+    from processing.visualization import MOISTURE_RAMP, color_ramp
+
+    return color_ramp(artifacts.array("moisture_index.npy"), MOISTURE_RAMP)
+
+
+class RunContext:
+    """
+    Isolated state of one pipeline run for a single location.
+
+    Every run gets its own directories below the root, so several locations can be processed in one process and several
+    processes can share a working directory as long as they work on different locations.
+    """
+
+    def __init__(self, location: str, root: str = "."):
+        """
+        Initialize the run context.
+
+        :param location: Name of the location the run processes.
+        :param root: Directory below which all data of the run is stored.
+        """
+        self.location = location.strip()
+        self.root = os.path.realpath(root)
+        self._artifacts: ArtifactStore | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def communication_dir(self) -> str:
+        """Directory for the text results modules exchange with each other."""
+        return os.path.join(self.root, "module_communication", self.location)
+
+    @property
+    def fingerprint_path(self) -> str:
+        """File the fingerprints of the finished modules are stored in for incremental re-execution."""
+        return os.path.join(self.communication_dir, ".fingerprints.json")
+
+    @property
+    def satellite_root(self) -> str:
+        """Directory containing the downloaded satellite data of all locations."""
+        return os.path.join(self.root, "satellite_data")
+
+    @property
+    def satellite_dir(self) -> str:
+        """Directory containing the downloaded satellite images of the location."""
+        return os.path.join(self.satellite_root, self.location)
+
+    @property
+    def processing_dir(self) -> str:
+        """Directory containing the processed satellite images of the location."""
+        return os.path.join(self.root, "satellite_image_processing", self.location)
+
+    @property
+    def artifacts(self) -> ArtifactStore:
+        """
+        Artifact store of the run. Artifacts are persisted in the module communication directory, except for the
+        downloaded satellite data, which is read from the satellite data directory, and the processed satellite
+        images, which are stored in the processing directory.
+        """
+        with self._lock:
+            if self._artifacts is None:
+                locations = {name: self.satellite_dir for name in SATELLITE_ARTIFACTS}
+                locations["water_preprocessed.png"] = self.processing_dir
+                backend = FileBackend(self.communication_dir, locations=locations)
+                self._artifacts = ArtifactStore(backend)
+                # The moisture image is only rendered once an analysis needs it.
+                self._artifacts.add_renderer("moisture.png", render_moisture)
+            return self._artifacts
+
+    def __repr__(self) -> str:
+        return f"RunContext(location={self.location!r}, root={self.root!r})"
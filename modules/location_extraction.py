@@ -10,15 +10,19 @@ class LocationExtraction(Module):
 
     @override
     def main(self) -> ModuleResult:
-        location = "Erlangen"
+        location = self.load_location()
 
-        dir_path = os.path.realpath("./module_communication/")
+        if not location:
+            print("No location given for this run.")
+            return ModuleResult.ERROR
 
-        # Ensure the directory exists
-        os.makedirs(dir_path, exist_ok=True)
+        # The location name is used as a directory name for the run.
+        if os.sep in location or location in (os.curdir, os.pardir):
+            print(f"Invalid location name: {location}")
+            return ModuleResult.ERROR
 
-        # Write the text to the file
-        with open(os.path.join(dir_path, "location_name.txt"), "w") as file:
-            file.write(location)
+        # Ensure the directories of the run exist
+        os.makedirs(self.context.communication_dir, exist_ok=True)
+        os.makedirs(self.context.satellite_root, exist_ok=True)
 
         return ModuleResult.OK
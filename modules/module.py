@@ -1,7 +1,11 @@
-import os.path
+import hashlib
+import inspect
 from abc import ABC, abstractmethod
 from enum import Enum, auto
-from typing import Set
+from typing import Any, Dict, Iterable, Set
+
+from modules.artifacts import ArtifactStore
+from modules.context import RunContext
 
 
 class ModuleResult(Enum):
@@ -11,17 +15,22 @@ class ModuleResult(Enum):
 
 
 class Module(ABC):
-    def __init__(self, name: str, dependencies: Set[str] = None, soft_dependencies: Set[str] = None):
+    def __init__(self, name: str, dependencies: Set[str] = None, soft_dependencies: Set[str] = None, resources: Set[str] = None, models: Set[str] = None):
         """
         Initialize the module with a name, its dependencies, and optional soft dependencies.
 
         :param name: Name of the module.
         :param dependencies: Set of dependencies for the module.
         :param soft_dependencies: Set of optional soft dependencies for the module.
+        :param resources: Set of shared resources the module occupies while running, e.g. "gpu". The pipeline limits how many modules use a resource at once.
+        :param models: Set of names of the model classes the module runs. The model manager keeps them loaded until no scheduled module needs them anymore.
         """
         self.name = name
         self.dependencies = dependencies if dependencies is not None else set()
         self.soft_dependencies = soft_dependencies if soft_dependencies is not None else set()
+        self.resources = resources if resources is not None else set()
+        self.models = models if models is not None else set()
+        self._context: RunContext | None = None
 
     @abstractmethod
     def main(self) -> ModuleResult:
@@ -32,48 +41,107 @@ class Module(ABC):
         """
         pass
 
-    def load_location(self, file_path="./module_communication/location_name.txt") -> str:
+    def fingerprint_parameters(self) -> Dict[str, Any]:
         """
-        Load location name from a file.
+        Describe everything besides the consumed artifacts that determines the results of the module, for incremental
+        re-execution. A module is run again once its parameters change.
+
+        By default, these are the source code of the module class, which contains its prompts, and its public
+        attributes, such as the names of its models and its settings. Subclasses add inputs that are neither, e.g. the
+        current date if the results depend on it.
 
-        :param file_path: Path to the file containing the location name.
-        :return: Location name read from the file.
+        :return: JSON-serializable parameters. Sets are serialized as sorted lists and other objects by their attributes.
         """
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read().strip()
+        with open(inspect.getsourcefile(type(self)), "rb") as file:
+            code = hashlib.sha256(file.read()).hexdigest()
+        attributes = {name: value for name, value in vars(self).items() if not name.startswith("_")}
+        return {"class": f"{type(self).__module__}.{type(self).__qualname__}", "code": code, "attributes": attributes}
 
-    def load_from_file(self, file_name: str) -> str:
+    @property
+    def context(self) -> RunContext:
         """
-        Load the content of a file from the module communication directory.
+        The run context the module works in.
 
-        :param file_name: Name of the file to be read.
-        :return: Content of the file.
+        :raises RuntimeError: If the module has not been bound to a run context.
         """
-        # Define the directory path
-        location = self.load_location()
-        dir_path = os.path.realpath(f"./module_communication/{location}/")
+        if self._context is None:
+            raise RuntimeError(f"Module {self.name} is not bound to a run context.")
+        return self._context
 
-        # Ensure the directory exists
-        os.makedirs(dir_path, exist_ok=True)
+    @context.setter
+    def context(self, value: RunContext) -> None:
+        self._context = value
 
-        with open(os.path.join(dir_path, file_name), "r") as file:
-            return file.read()
+    def load_location(self) -> str:
+        """
+        Load the location name of the current run.
 
-    def save_to_file(self, file_name: str, text: str, append: bool = False):
+        :return: Location name of the run context.
+        """
+        return self.context.location
+
+    @property
+    def artifacts(self) -> ArtifactStore:
+        """The artifact store of the run the module works in."""
+        return self.context.artifacts
+
+    def publish(self, name: str, value: Any, persist: bool = True) -> None:
+        """
+        Publish an artifact for other modules.
+
+        :param name: Name of the artifact, including a file extension that determines its format on disk.
+        :param value: Text, NumPy array or PIL image. It must not be modified after publishing.
+        :param persist: Whether the artifact should also be written to disk.
         """
-        Save text to a file in the module communication directory.
+        self.artifacts.publish(name, value, persist=persist)
 
-        :param file_name: Name of the file to be written to.
-        :param text: Text content to be written to the file.
-        :param append: Whether to append to the file (default is False).
+    def consume(self, name: str) -> Any:
         """
-        # Define the directory path
-        location = self.load_location()
-        dir_path = os.path.realpath(f"./module_communication/{location}/")
+        Get an artifact published by another module of the run, or persisted by an earlier run.
 
-        # Ensure the directory exists
-        os.makedirs(dir_path, exist_ok=True)
+        :param name: Name of the artifact.
+        :return: The artifact.
+        """
+        return self.artifacts.get(name)
 
-        # Write the text to the file
-        with open(os.path.join(dir_path, file_name), "a" if append else "w") as file:
-            file.write(text)
+    def load_from_file(self, file_name: str) -> str:
+        """
+        Load a text artifact of the run.
+
+        :param file_name: Name of the artifact, which is also its file name in the module communication directory.
+        :return: Content of the artifact.
+        """
+        return self.artifacts.text(file_name)
+
+    def save_to_file(self, file_name: str, text: str, append: bool = False):
+        """
+        Publish a text artifact, which is persisted in the module communication directory.
+
+        :param file_name: Name of the artifact, which is also its file name in the module communication directory.
+        :param text: Text content of the artifact.
+        :param append: Whether to append to the artifact (default is False).
+        """
+        if append:
+            self.artifacts.append_text(file_name, text)
+        else:
+            self.artifacts.publish(file_name, text)
+
+    def stream_to_file(self, file_name: str, chunks: Iterable[str], append: bool = False) -> str:
+        """
+        Publish a text artifact chunk by chunk, e.g. from a model stream. Every chunk is appended to the file in the
+        module communication directory as soon as it arrives, so the text produced so far survives a crash and can be
+        watched while it grows.
+
+        :param file_name: Name of the artifact, which is also its file name in the module communication directory.
+        :param chunks: Chunks of the text.
+        :param append: Whether to append to the artifact instead of replacing it.
+        :return: The streamed text.
+        """
+        if not append:
+            self.artifacts.publish(file_name, "")
+
+        streamed = []
+        for chunk in chunks:
+            self.artifacts.append_text(file_name, chunk)
+            streamed.append(chunk)
+        return "".join(streamed)
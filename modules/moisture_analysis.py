@@ -1,19 +1,19 @@
 from typing import override
 
-import models.perception
+from models import create_model
 from modules.module import Module, ModuleResult
 
 
 class MoistureAnalysis(Module):
     def __init__(self):
-        super().__init__("MoistureAnalysis", {"SatelliteLoader"})
+        super().__init__("MoistureAnalysis", {"SatelliteLoader"}, resources={"gpu"}, models={"ThreeSixtyVLModel"})
 
     @override
     def main(self) -> ModuleResult:
         # Benchmark: https://github.com/BradyFU/Awesome-Multimodal-Large-Language-Models/tree/Evaluation
         # model = LlavaNextForConditionalGeneration.from_pretrained("llava-hf/llava-v1.6-mistral-7b-hf",quantization_config=quantization_config, device_map="auto")
 
-        model = models.perception.three_sixty_vl.ThreeSixtyVLModel()
+        model = create_model("ThreeSixtyVLModel")
         model.max_new_tokens = 8192
 
         system_prompt: str = ""
@@ -28,8 +28,7 @@ class MoistureAnalysis(Module):
             "Assess the implications of heat distribution on urban infrastructure.",
         ]
 
-        location = self.load_location()
-        model.image_paths = [f"./satellite_data/{location}/moisture.png"]
+        model.images = [self.artifacts.image("moisture.png")]
         output = model.multi_run_one_result(system_prompt, prompts)
 
         self.save_to_file("moisture_analysis.txt", output)
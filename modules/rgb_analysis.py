@@ -1,19 +1,19 @@
 from typing import override
 
-import models.perception
+from models import create_model
 from modules.module import Module, ModuleResult
 
 
 class RGBAnalysis(Module):
     def __init__(self):
-        super().__init__("RGBAnalysis", {"SatelliteLoader"})
+        super().__init__("RGBAnalysis", {"SatelliteLoader"}, resources={"gpu"}, models={"ThreeSixtyVLModel"})
 
     @override
     def main(self) -> ModuleResult:
         # Benchmark: https://github.com/BradyFU/Awesome-Multimodal-Large-Language-Models/tree/Evaluation
         # model = LlavaNextForConditionalGeneration.from_pretrained("llava-hf/llava-v1.6-mistral-7b-hf",quantization_config=quantization_config, device_map="auto")
 
-        model = models.perception.three_sixty_vl.ThreeSixtyVLModel()
+        model = create_model("ThreeSixtyVLModel")
         model.max_new_tokens = 8192
         system_prompt: str = ""  # ("You are an expert satellite image analyst. "
         # "Assume North is up, South is down, West is left, and East is right.")
@@ -35,9 +35,7 @@ class RGBAnalysis(Module):
             "Can you see any significant geographical features, such as hills or valleys, in or around the city? Describe their locations.",
         ]
 
-        location = self.load_location()
-
-        model.image_paths = [f"./satellite_data/{location}/rgb.png"]
+        model.images = [self.artifacts.image("rgb.png")]
         output = model.multi_run_one_result(system_prompt, prompts)
 
         self.save_to_file("rgb_analysis.txt", output)
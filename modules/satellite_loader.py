@@ -1,26 +1,54 @@
 import json
 import os
-import tarfile
+import shutil
 from datetime import timedelta, date
 from typing import override
 
-from geopy.distance import geodesic
-from geopy.geocoders import Nominatim
+import cv2
+import numpy as np
 from oauthlib.oauth2 import BackendApplicationClient
 from requests_oauthlib import OAuth2Session
-from sentinelhub import (
-    BBox,
-    CRS,
-    SHConfig,
-    DataCollection,
-    MimeType,
-    SentinelHubRequest,
-)
+from sentinelhub import SHConfig
 
 from modules.module import Module, ModuleResult
+from satellite.cache import SatelliteCache
+from satellite.geocoding import default_geocoder
+from satellite.mosaic import MosaicDownloader
+from satellite.process_api import MAX_REQUEST_SIZE, ProcessApiClient
+from satellite.raster_store import RasterStore
 
 country: str = "Germany"
 
+# Outputs of the evalscript. The true color image is saved as PNG, the index rasters keep their float32 values.
+SATELLITE_OUTPUTS = ["rgb", "moisture_index", "water_index"]
+INDEX_OUTPUTS = {"moisture_index": "Normalized difference moisture index (B8A, B11)",
+                 "water_index": "Normalized difference water index (B03, B08)"}
+OUTPUT_FORMATS = {name: "image/tiff" for name in INDEX_OUTPUTS}
+
+EVALSCRIPT = """
+//VERSION=3
+function setup() {
+  return {
+    input: ["B02", "B03", "B04", "B08", "B8A", "B11", "dataMask"],
+    output: [
+      { id: "rgb", bands: 3 },
+      { id: "moisture_index", bands: 1, sampleType: "FLOAT32" },
+      { id: "water_index", bands: 1, sampleType: "FLOAT32" }
+    ]
+  };
+}
+
+function evaluatePixel(sample) {
+  let moisture = index(sample.B8A, sample.B11);
+  let water = index(sample.B03, sample.B08);
+  return {
+    rgb: [2.5 * sample.B04, 2.5 * sample.B03, 2.5 * sample.B02],
+    moisture_index: [sample.dataMask ? moisture : NaN],
+    water_index: [sample.dataMask ? water : NaN]
+  };
+}
+"""
+
 
 def load_credentials(file_path):
     """Load credentials from a JSON file.
@@ -92,23 +120,20 @@ def time_range_formatted_for_request(days):
 
 
 def get_location_bounds(location_name):
-    """Get the bounding box for a given location using geopy.
+    """Get the bounding box for a given location, geocoded through the persistent geocode cache.
     :param location_name: Name of the location to geocode.
-    :return: Bounding box coordinates (north, south, east, west).
+    :return: Bounding box coordinates (west, south, east, north).
     :raises ValueError: If the location or bounding box cannot be found.
     """
-    geolocator = Nominatim(user_agent="EcoScapes")
-    location = geolocator.geocode(f"{location_name}, {country}")
+    location = default_geocoder().geocode(location_name, country)
 
     if location is None:
         raise ValueError(f"Location not found: {location_name}")
 
-    bbox = location.raw.get('boundingbox', None)
-    if bbox is None:
+    if location.bounds is None:
         raise ValueError(f"Bounding box not found for {location_name}")
 
-    location_bounds = (bbox[2], bbox[0], bbox[3], bbox[1])
-    return location_bounds
+    return location.bounds
 
 
 def get_location_bounds_with_radius(location_name, radius_km=5):
@@ -116,154 +141,130 @@ def get_location_bounds_with_radius(location_name, radius_km=5):
     Get the bounding box for a given location using a radius around the city center.
     :param location_name: Name of the location to geocode.
     :param radius_km: Radius in kilometers around the city center to create the bounding box.
-    :return: Bounding box coordinates (north, south, east, west).
+    :return: Bounding box coordinates (west, south, east, north).
     :raises ValueError: If the location cannot be found.
     """
-    geolocator = Nominatim(user_agent="EcoScapes")
-    location = geolocator.geocode(f"{location_name}, {country}")
-
-    if location is None:
-        raise ValueError(f"Location not found: {location_name}")
-
-    # City center coordinates
-    center_lat = location.latitude
-    center_lon = location.longitude
-
-    # Calculate the coordinates of the bounding box
-    west = geodesic(kilometers=radius_km).destination((center_lat, center_lon), 270).longitude
-    south = geodesic(kilometers=radius_km).destination((center_lat, center_lon), 180).latitude
-    east = geodesic(kilometers=radius_km).destination((center_lat, center_lon), 90).longitude
-    north = geodesic(kilometers=radius_km).destination((center_lat, center_lon), 0).latitude
-
-    location_bounds = (west, south, east, north)
-    return location_bounds
-
-
-def prepare_satellite_image_request(location_bounds, config, resolution=1024):
-    """Prepare a Sentinel Hub request for satellite images of a location.
-    :param location_bounds: Bounding box coordinates of the location.
-    :param config: Sentinel Hub configuration object.
-    :param resolution: The downloaded satellite images have the size of resolution x resolution pixels.
-    :return: Prepared Sentinel Hub request object.
-    """
-    evalscript = """
-        //VERSION=3
-        const moistureRamps = [
-            [-0.8, 0x800000],
-            [-0.24, 0xff0000],
-            [-0.032, 0xffff00],
-            [0.032, 0x00ffff],
-            [0.24, 0x0000ff],
-            [0.8, 0x000080]
-        ];
-    
-        const viz = new ColorRampVisualizer(moistureRamps);
-    
-        function setup() {
-          return {
-            input: ["B02", "B03", "B04", "B08", "B8A", "B11", "dataMask"],
-            output: [
-              { id: "rgb", bands: 3 },
-              { id: "moisture", bands: 4 },
-              { id: "water", bands: 1 }
-            ]
-          };
-        }
-    
-        function evaluatePixel(sample) {
-          let moisture = index(sample.B8A, sample.B11);
-          let water = index(sample.B03, sample.B08);
-          return {
-            rgb: [2.5 * sample.B04, 2.5 * sample.B03, 2.5 * sample.B02],
-            moisture: [...viz.process(moisture), sample.dataMask],
-            water: [water]
-          };
-        }
-        """
+    west, south, east, north = default_geocoder().radius_bounds([location_name], country, radius_km)[0]
+    return float(west), float(south), float(east), float(north)
 
-    start_date, end_date = time_range_formatted_for_request(days=360)
-    bbox = BBox(bbox=location_bounds, crs=CRS.WGS84)
-
-    request = SentinelHubRequest(
-        evalscript=evalscript,
-        input_data=[
-            SentinelHubRequest.input_data(
-                data_collection=DataCollection.SENTINEL2_L2A,
-                time_interval=(start_date, end_date),
-                maxcc=1.0
-            )
-        ],
-        responses=[
-            SentinelHubRequest.output_response('rgb', MimeType.PNG),
-            SentinelHubRequest.output_response('moisture', MimeType.PNG),
-            SentinelHubRequest.output_response('water', MimeType.PNG)
-        ],
-        bbox=bbox,
-        size=(resolution, resolution),
-        config=config,
-        data_folder="./satellite_data",
-    )
-
-    return request
 
-
-def untar_files_in_path(path):
-    """Extracts all .tar files in the given directory and removes the original .tar files after extraction.
-    :param path: str, the path to the directory containing the .tar files.
+def to_rgb(image):
+    """Convert an image decoded by OpenCV to the RGB channel order of the artifact store.
+    :param image: Grayscale, BGR or BGRA image.
+    :return: Grayscale, RGB or RGBA image.
     """
-    # Check if the provided path exists and is a directory
-    if not os.path.isdir(path):
-        raise ValueError(f"The provided path '{path}' is not a valid directory.")
-
-    tar_paths = [os.path.join(path, file_name) for file_name in os.listdir(path) if file_name.endswith(".tar")]
-
-    for tar_path in tar_paths:
-        with tarfile.open(tar_path, "r") as tar:
-            tar.extractall(path=path)
-        os.remove(tar_path)
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA if image.shape[2] == 4 else cv2.COLOR_BGR2RGB)
 
 
 class SatelliteLoader(Module):
-    def __init__(self):
-        super().__init__("SatelliteLoader", {"LocationExtraction"})
+    def __init__(self, resolution: int = 1024, max_request_size: int = MAX_REQUEST_SIZE, download_workers: int = 4,
+                 collection: str = "sentinel-2-l2a", cache: SatelliteCache = None, persist: bool = True):
+        """
+        Initialize the module.
+
+        :param resolution: The downloaded satellite images have the size of resolution x resolution pixels.
+        :param max_request_size: Maximum width and height of a single request; larger images are downloaded as a grid of tiles.
+        :param download_workers: Maximum number of tiles downloaded at the same time.
+        :param collection: Identifier of the Sentinel Hub data collection.
+        :param cache: Cache of downloaded data, or None for a cache in the satellite data folder.
+        :param persist: Whether downloaded data is written to the cache. Otherwise, it is only handed to the other
+            modules of the run in memory.
+        """
+        super().__init__("SatelliteLoader", {"LocationExtraction"}, resources={"network"})
+        self.resolution = resolution
+        self.max_request_size = max_request_size
+        self.download_workers = download_workers
+        self.collection = collection
+        self.cache = cache
+        self.persist = persist
+
+    @override
+    def fingerprint_parameters(self) -> dict:
+        # The requested time interval ends today, so the data is up to date for one day only. The linked cache entry
+        # may also have been evicted by the run of another location, which leaves a dangling link to download again.
+        return {**super().fingerprint_parameters(), "time_interval": time_range_formatted_for_request(days=360),
+                "satellite_data": os.path.isdir(self.context.satellite_dir)}
 
     @override
     def main(self) -> ModuleResult:
         """Main function to download satellite images for a specified location."""
-        satellite_image_folder_path = os.path.realpath("./satellite_data")
-
         location_name = self.load_location()
-        resolution = 1024
-
-        os.makedirs(satellite_image_folder_path, exist_ok=True)
-
-        location_folder = os.path.join(satellite_image_folder_path, location_name)
-
-        if os.path.exists(location_folder):
-            print(f"Data for {location_name} already exists in {location_folder}. Skipping download.")
-            return ModuleResult.OK
-
-        config = setup_credentials(force_load=False)
-        create_oauth_session(config)
+        os.makedirs(self.context.satellite_root, exist_ok=True)
 
         location_bounds = get_location_bounds_with_radius(location_name, radius_km=3)
         print(location_bounds)
 
-        dir_before = set(os.listdir(satellite_image_folder_path))
-
-        request = prepare_satellite_image_request(location_bounds, config, resolution=resolution)
-        request.get_data(save_data=True)
-        print(f'Downloaded images for {location_name}.')
+        # Everything that determines the downloaded data is part of the cache key, so changing a parameter downloads again.
+        parts = {
+            "bounds": [round(value, 7) for value in location_bounds],
+            "time_interval": time_range_formatted_for_request(days=360),
+            "width": self.resolution,
+            "height": self.resolution,
+            "collection": self.collection,
+            "evalscript": EVALSCRIPT,
+            "outputs": SATELLITE_OUTPUTS,
+            "formats": OUTPUT_FORMATS,
+        }
+        cache = self.cache if self.cache is not None else SatelliteCache(os.path.join(self.context.satellite_root, ".cache"))
+        key = SatelliteCache.key(parts)
+
+        artifacts = {}
+        if self.persist and cache.get(key) is not None:
+            print(f"Using cached satellite data for {location_name}.")
+        elif self.persist:
+            cache.fetch(key, parts, lambda folder: artifacts.update(self.download(parts, folder)))
+            print(f'Downloaded images for {location_name}.')
+        else:
+            artifacts = self.download(parts, None)
+            print(f'Downloaded images for {location_name}.')
+
+        if self.persist:
+            cache.link(key, self.context.satellite_dir)
+        elif os.path.islink(self.context.satellite_dir):
+            # Data of an earlier run must not be mistaken for the images downloaded now.
+            os.remove(self.context.satellite_dir)
+        elif os.path.isdir(self.context.satellite_dir):
+            shutil.rmtree(self.context.satellite_dir)
+
+        # Consumers get freshly downloaded data from memory instead of reading the written files again.
+        for name, value in artifacts.items():
+            self.publish(name, value, persist=False)
 
-        dir_after = set(os.listdir(satellite_image_folder_path))
-        new_dirs = dir_after - dir_before
+        return ModuleResult.OK
 
-        for dir_name in new_dirs:
-            old_dir_path = os.path.join(satellite_image_folder_path, dir_name)
-            new_dir_path = os.path.join(satellite_image_folder_path, location_name)
-            os.rename(old_dir_path, new_dir_path)
+    def download(self, parts: dict, folder: str | None) -> dict:
+        """
+        Download the satellite data of a request.
 
-            untar_files_in_path(new_dir_path)
-            print(f'Renamed {old_dir_path} to {new_dir_path}')
+        If a folder is given, the index rasters are stitched directly into memory-mapped .npy files with a metadata
+        sidecar, and the true color image is saved as PNG. Otherwise, everything is kept in memory.
 
-        return ModuleResult.OK
+        :param parts: Parameters of the request, as used for the cache key.
+        :param folder: Empty folder the data is saved to, or None to only keep it in memory.
+        :return: The downloaded data to hand over in memory by artifact name: the true color image in RGB order and, if
+            nothing is saved, the float32 index rasters.
+        """
+        config = setup_credentials(force_load=False)
+        client = ProcessApiClient(create_oauth_session(config), base_url=config.sh_base_url)
+
+        downloader = MosaicDownloader(client, max_request_size=self.max_request_size, max_workers=self.download_workers)
+        mosaics = downloader.download(tuple(parts["bounds"]), parts["width"], parts["height"], parts["evalscript"],
+                                      parts["time_interval"], parts["outputs"], folder, collection=parts["collection"],
+                                      formats=parts["formats"])
+
+        artifacts = {"rgb.png": to_rgb(np.asarray(mosaics["rgb"]))}
+        if folder is None:
+            artifacts.update({f"{name}.npy": mosaics[name] for name in INDEX_OUTPUTS})
+            return artifacts
+
+        # The index rasters are memory-mapped from the cache entry by the consumers, as the folder is renamed into place.
+        cv2.imwrite(os.path.join(folder, "rgb.png"), mosaics["rgb"])
+        os.remove(os.path.join(folder, "rgb.npy"))
+
+        rasters = RasterStore(folder)
+        for name, description in INDEX_OUTPUTS.items():
+            rasters.write_metadata(name, mosaics[name], description=description, bounds=parts["bounds"], crs="EPSG:4326",
+                                   time_interval=parts["time_interval"], collection=parts["collection"], nodata="NaN")
+        return artifacts
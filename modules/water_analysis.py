@@ -1,18 +1,18 @@
 from typing import override
 
-import models.perception
+from models import create_model
 from modules.module import Module, ModuleResult
 
 
 class WaterAnalysis(Module):
     def __init__(self):
-        super().__init__("WaterAnalysis", {"WaterPreprocessing", "SatelliteLoader"})
+        super().__init__("WaterAnalysis", {"WaterPreprocessing", "SatelliteLoader"}, resources={"gpu"}, models={"ThreeSixtyVLModel"})
 
     @override
     def main(self) -> ModuleResult:
         # Benchmark: https://github.com/BradyFU/Awesome-Multimodal-Large-Language-Models/tree/Evaluation
         # model = LlavaNextForConditionalGeneration.from_pretrained("llava-hf/llava-v1.6-mistral-7b-hf",quantization_config=quantization_config, device_map="auto")
-        model = models.perception.three_sixty_vl.ThreeSixtyVLModel()
+        model = create_model("ThreeSixtyVLModel")
         model.max_new_tokens = 8192
         system_prompt: str = "The map shows water as white and land as black. A river is a very long, connected, white area. A lake is a large, circular, white area."
         prompts: list[str] = [
@@ -21,10 +21,8 @@ class WaterAnalysis(Module):
             "Is the map depicting a part of the coast? If it does not, please say so.",
         ]
 
-        location = self.load_location()
-
-        model.image_paths = [f"./satellite_image_processing/{location}/water_preprocessed.png"]
-        output = [prompt + " - " + model.run(system_prompt, prompt) for prompt in prompts]
+        model.images = [self.artifacts.image("water_preprocessed.png")]
+        output = [prompt + " - " + answer for prompt, answer in zip(prompts, model.multi_run(system_prompt, prompts))]
         output = "\n".join(output)
 
         self.save_to_file("water_analysis.txt", output)
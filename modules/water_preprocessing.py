@@ -1,77 +1,72 @@
 import os
 from typing import override
 
-import cv2
 import numpy as np
 
 from modules.module import Module, ModuleResult
+from processing.tiling import TiledWaterMask, block_max
+from processing.water_mask import WaterMaskEngine
 
 
 class WaterPreprocessing(Module):
-    def __init__(self):
+    def __init__(self, engine: WaterMaskEngine = None, tile_size: int = 2048, preview_size: int = 4096):
+        """
+        Initialize the module.
+
+        :param engine: Engine computing the water mask, or None for the default thresholds.
+        :param tile_size: Maximum width and height of the tiles large rasters are processed in.
+        :param preview_size: Maximum width and height of the mask handed to the analysis of large rasters.
+        """
         super().__init__("WaterPreprocessing", {"SatelliteLoader"})
+        self.engine = engine if engine is not None else WaterMaskEngine()
+        self.tile_size = tile_size
+        self.preview_size = preview_size
 
     @override
     def main(self) -> ModuleResult:
-        location = self.load_location()
-        image_path = f"./satellite_data/{location}/water.png"
+        # Manually downloaded data may only contain the 8-bit water image instead of the raw index raster.
+        if not self.artifacts.contains("water_index.npy"):
+            return self.publish_mask(self.engine.process(self.artifacts.array("water.png"), rgb=True))
 
-        # Read the image including the alpha channel for transparent (manually downloaded) images.
-        img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+        # Freshly downloaded rasters are handed over in memory, others are memory-mapped from the satellite data directory.
+        index = self.artifacts.array("water_index.npy")
 
-        # Remove transparency if necessary.
-        if len(img.shape) > 2 and img.shape[2] == 4:
-            # Split the channels
-            _, _, _, a = cv2.split(img)
+        # Large rasters are processed tile by tile without loading them into memory.
+        if isinstance(index, np.memmap) and max(index.shape) > self.tile_size:
+            return self.process_raster(index.filename)
 
-            # Create a mask where alpha is zero (fully transparent)
-            transparent_mask = (a == 0)
+        return self.publish_mask(self.engine.process(np.asarray(index)))
 
-            # Convert to grayscale
-            no_transparency_img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+    def publish_mask(self, area_filtered: np.ndarray) -> ModuleResult:
+        """
+        Hand the water mask to the analysis, unless it contains no water.
 
-            # Set fully transparent pixels to black
-            no_transparency_img[transparent_mask] = 0
-        else:
-            no_transparency_img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-
-        _, binarized = cv2.threshold(no_transparency_img, 60, 255, cv2.THRESH_BINARY)
-
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-
-        edited_image = cv2.morphologyEx(binarized, cv2.MORPH_CLOSE, kernel)
-        edited_image = cv2.morphologyEx(edited_image, cv2.MORPH_OPEN, kernel)
-        edited_image = cv2.morphologyEx(edited_image, cv2.MORPH_DILATE, kernel)
+        :param area_filtered: The water mask.
+        :return: The result of the module.
+        """
+        if not np.any(area_filtered == 255):
+            return ModuleResult.STOP_PIPELINE
 
-        # Connected components analysis
-        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(edited_image, connectivity=8)
+        # The mask is handed to WaterAnalysis in memory and persisted to the processing directory in the background.
+        self.publish("water_preprocessed.png", area_filtered)
 
-        # Create an output image to store the filtered components
-        area_filtered = np.zeros_like(edited_image)
+        return ModuleResult.OK
 
-        for i in range(1, num_labels):  # Start from 1 to skip the background
-            area = stats[i, cv2.CC_STAT_AREA]
-            width = stats[i, cv2.CC_STAT_WIDTH]
-            height = stats[i, cv2.CC_STAT_HEIGHT]
-            aspect_ratio = float(width) / height if height > 0 else 0
+    def process_raster(self, raster_path: str) -> ModuleResult:
+        """
+        Compute the water mask of a memory-mapped raster tile by tile.
 
-            # Define your thresholds
-            min_area = 100  # Adjust based on your specific needs
-            min_aspect_ratio = 2  # Adjust to distinguish elongated shapes
+        The full-resolution mask is written to the processing directory, a downscaled preview is handed to the analysis.
 
-            # Apply filters
-            if area >= min_area or aspect_ratio >= min_aspect_ratio:
-                area_filtered[labels == i] = 255  # Keep the component
+        :param raster_path: Path of the water index raster.
+        :return: The result of the module.
+        """
+        os.makedirs(self.context.processing_dir, exist_ok=True)
+        output_path = os.path.join(self.context.processing_dir, "water_preprocessed.npy")
+        mask, water_bodies = TiledWaterMask(self.engine, tile_size=self.tile_size).process(raster_path, output_path)
 
-        if not np.any(area_filtered == 255):
+        if water_bodies == 0:
             return ModuleResult.STOP_PIPELINE
 
-        color_output = cv2.cvtColor(area_filtered, cv2.COLOR_GRAY2BGR)
-
-        dir_path = f"./satellite_image_processing/{location}"
-        os.makedirs(dir_path, exist_ok=True)
-
-        save_path = f"{dir_path}/water_preprocessed.png"
-        cv2.imwrite(save_path, color_output)
-
+        self.publish("water_preprocessed.png", block_max(mask, self.preview_size))
         return ModuleResult.OK
@@ -1,19 +1,19 @@
 from typing import override
 
-import models.perception
+from models import create_model
 from modules.module import Module, ModuleResult
 
 
 class WaterRGBAnalysis(Module):
     def __init__(self):
-        super().__init__("WaterRGBAnalysis", {"WaterAnalysis", "RGBAnalysis", "SatelliteLoader"})
+        super().__init__("WaterRGBAnalysis", {"WaterAnalysis", "RGBAnalysis", "SatelliteLoader"}, resources={"gpu"}, models={"ThreeSixtyVLModel"})
 
     @override
     def main(self) -> ModuleResult:
         # Benchmark: https://github.com/BradyFU/Awesome-Multimodal-Large-Language-Models/tree/Evaluation
         # model = LlavaNextForConditionalGeneration.from_pretrained("llava-hf/llava-v1.6-mistral-7b-hf",quantization_config=quantization_config, device_map="auto")
 
-        model = models.perception.three_sixty_vl.ThreeSixtyVLModel()
+        model = create_model("ThreeSixtyVLModel")
         model.max_new_tokens = 8192
 
         water_analysis = self.load_from_file("water_analysis.txt")
@@ -23,10 +23,9 @@ class WaterRGBAnalysis(Module):
             f"Given this description of the water bodies in the image: {water_analysis}, please describe how far any buildings are from the water and if there is a nature buffer zone between them.",
         ]
 
-        location = self.load_location()
-
-        model.image_paths = [f"./satellite_data/{location}/rgb.png"]
+        model.images = [self.artifacts.image("rgb.png")]
         output = '\n' + water_analysis + '\n' + model.multi_run_one_result(system_prompt, prompts)
 
-        self.save_to_file("rgb_analysis.txt", output, append=True)
+        # Published on its own instead of appended to the RGB analysis, so that both can be kept when only one of them is outdated.
+        self.save_to_file("water_rgb_analysis.txt", output)
         return ModuleResult.OK
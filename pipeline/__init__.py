@@ -0,0 +1,5 @@
+from pipeline.batch import load_locations, run_batch
+from pipeline.scheduler import Pipeline
+from pipeline.tracing import Trace, Tracer, set_tracer, tracer
+
+__all__ = ["Pipeline", "Trace", "Tracer", "load_locations", "run_batch", "set_tracer", "tracer"]
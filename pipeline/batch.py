@@ -0,0 +1,61 @@
+import os
+from typing import Callable, Dict, List, Set
+
+from modules.context import RunContext
+from modules.module import Module, ModuleResult
+from pipeline.scheduler import Pipeline
+
+
+def load_locations(file_path: str) -> List[str]:
+    """
+    Load location names from a text file with one location per line.
+
+    Empty lines and lines starting with '#' are ignored.
+
+    :param file_path: Path to the file containing the location names.
+    :return: List of location names in file order.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip() and not line.lstrip().startswith("#")]
+
+
+def run_batch(locations: List[str], module_factory: Callable[[], List[Module]], root: str = ".", max_workers: int = 4,
+              resource_limits: Dict[str, int] = None, trace_dir: str = None, incremental: bool = False,
+              invalidate: Set[str] = None) -> Dict[str, Dict[str, ModuleResult]]:
+    """
+    Run the pipeline once per location, each in its own run context.
+
+    The locations are processed one after another in the same process. All runs are planned up front, so the model
+    manager keeps a loaded model in memory as long as a following location still needs it.
+
+    :param locations: Names of the locations to process. Duplicates are processed once.
+    :param module_factory: Creates a fresh set of modules for each run.
+    :param root: Directory below which the data of all runs is stored.
+    :param max_workers: Maximum number of modules running at the same time within a run.
+    :param resource_limits: Maximum number of concurrently running modules per resource.
+    :param trace_dir: Directory the Chrome trace of every run is written to, or None to only print the summary tables.
+    :param incremental: Whether to skip modules whose results of an earlier run are up to date.
+    :param invalidate: Names of modules that run anyway, together with everything downstream of them.
+    :return: The module results of every processed location.
+    """
+    results: Dict[str, Dict[str, ModuleResult]] = {}
+    root = os.path.realpath(root)
+    unique_locations = list(dict.fromkeys(location.strip() for location in locations))
+
+    # Plan all runs up front, so the model manager knows which models later locations still need.
+    pipelines = [Pipeline(module_factory(), RunContext(location, root), max_workers=max_workers, resource_limits=resource_limits,
+                          incremental=incremental, invalidate=invalidate)
+                 for location in unique_locations]
+
+    for index, (location, pipeline) in enumerate(zip(unique_locations, pipelines)):
+        print(f"Processing location {location} ({index + 1}/{len(unique_locations)})")
+        results[location] = pipeline.run()
+
+        if pipeline.trace.spans:
+            print(pipeline.trace.summary())
+        if trace_dir is not None:
+            trace_path = os.path.join(trace_dir, f"{pipeline.context.location}.trace.json")
+            pipeline.trace.write(trace_path)
+            print(f"Wrote trace of {location} to {trace_path}")
+
+    return results
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List
+
+from modules.artifacts import ArtifactAccess, ArtifactStore
+from modules.module import Module
+
+# Version of the stored records. Records of another version are ignored, so every module runs once more.
+RECORD_VERSION = 1
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _serialize(value: Any) -> Any:
+    """Make the values json cannot serialize serializable: sets as sorted lists, arrays by their content and objects by their public attributes."""
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if hasattr(value, "__array_interface__"):
+        return {"array": value_digest(value)}
+    if hasattr(value, "__dict__"):
+        return {"type": f"{type(value).__module__}.{type(value).__qualname__}",
+                "attributes": {name: item for name, item in vars(value).items() if not name.startswith("_")}}
+    return type(value).__qualname__
+
+
+def parameters_digest(module: Module) -> str:
+    """
+    Hash the parameters of a module.
+
+    :param module: The module.
+    :return: Hex digest of Module.fingerprint_parameters.
+    """
+    parameters = json.dumps(module.fingerprint_parameters(), sort_keys=True, default=_serialize)
+    return hashlib.sha256(parameters.encode("utf-8")).hexdigest()
+
+
+def value_digest(value: Any) -> str:
+    """
+    Hash an artifact held in memory.
+
+    :param value: Text, NumPy array or PIL image.
+    :return: Hex digest of the text or of the dtype, shape and pixels.
+    """
+    hasher = hashlib.sha256()
+    if isinstance(value, str):
+        hasher.update(b"text\0")
+        hasher.update(value.encode("utf-8"))
+        return hasher.hexdigest()
+
+    import numpy as np
+
+    array = np.ascontiguousarray(np.asarray(value))
+    hasher.update(f"array\0{array.dtype.str}\0{array.shape}\0".encode("utf-8"))
+    hasher.update(array.data)
+    return hasher.hexdigest()
+
+
+class FingerprintStore:
+    """
+    Fingerprints of the module runs of one location, persisted as JSON file, for make-style incremental re-execution.
+
+    A fingerprint records the digests of the artifacts a module consumed, the digest of its parameters and the
+    artifacts it published. A module is up to date as long as its parameters and consumed artifacts are unchanged and
+    its results are still available. Which artifacts a module consumes is recorded while it runs, so it does not have to
+    declare them.
+
+    Persisted artifacts are hashed by file content. The digests are kept together with the size and modification time
+    of the file, so unchanged files are not read again.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the store and load the fingerprints of earlier runs.
+
+        :param path: Path of the JSON file the fingerprints are stored in.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._files: Dict[str, List] = {}
+
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == RECORD_VERSION:
+            self._records = data["modules"]
+            self._files = data["files"]
+
+    def digest(self, artifacts: ArtifactStore, name: str) -> str | None:
+        """
+        Hash the current content of an artifact.
+
+        :param artifacts: The artifact store of the run.
+        :param name: Name of the artifact.
+        :return: Digest of the persisted file, or of the value if the artifact is only held in memory or rendered, or None if the artifact does not exist.
+        """
+        artifacts.wait_for_writes()
+        if artifacts.backend is not None and artifacts.backend.exists(name):
+            return "file:" + self._file_digest(artifacts.backend.path(name))
+        if not artifacts.contains(name):
+            return None
+        return "value:" + value_digest(artifacts.get(name))
+
+    def stale_reason(self, module: Module, artifacts: ArtifactStore) -> str | None:
+        """
+        Check whether a module has to run again.
+
+        :param module: The module.
+        :param artifacts: The artifact store of the run.
+        :return: Why the module has to run again, or None if it is up to date.
+        """
+        with self._lock:
+            record = self._records.get(module.name)
+        if record is None:
+            return "as it has not finished before"
+
+        missing = sorted(name for name in record["outputs"] if not artifacts.contains(name))
+        if missing:
+            return f"as its results are missing: {', '.join(missing)}"
+        if parameters_digest(module) != record["parameters"]:
+            return "as its code or parameters changed"
+        changed = sorted(name for name, digest in record["inputs"].items() if self.digest(artifacts, name) != digest)
+        if changed:
+            return f"as its inputs changed: {', '.join(changed)}"
+        return None
+
+    def record(self, module: Module, artifacts: ArtifactStore, access: ArtifactAccess) -> None:
+        """
+        Store the fingerprint of a module that finished successfully.
+
+        :param module: The module.
+        :param artifacts: The artifact store of the run.
+        :param access: The artifacts the module read and wrote while running.
+        """
+        inputs = {name: self.digest(artifacts, name) for name in sorted(access.reads - access.writes.keys())}
+        record = {"parameters": parameters_digest(module), "inputs": inputs, "outputs": dict(access.writes)}
+        with self._lock:
+            self._records[module.name] = record
+            self._save()
+
+    def drop(self, name: str) -> Dict[str, bool]:
+        """
+        Remove the fingerprint of a module, so it runs again next time.
+
+        :param name: Name of the module.
+        :return: The artifacts the module published when it last finished, mapped to whether they were persisted.
+        """
+        with self._lock:
+            record = self._records.pop(name, None)
+            if record is None:
+                return {}
+            self._save()
+            return record["outputs"]
+
+    def _file_digest(self, path: str) -> str:
+        """Hash a file, reusing the digest of an earlier call if its size and modification time are unchanged."""
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._files.get(path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        hasher = hashlib.sha256()
+        with open(path, "rb") as file:
+            while chunk := file.read(_CHUNK_SIZE):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        with self._lock:
+            self._files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def _save(self) -> None:
+        """Write the fingerprints atomically. The caller holds the lock."""
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+                json.dump({"version": RECORD_VERSION, "modules": self._records, "files": self._files}, file)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
@@ -0,0 +1,252 @@
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Set
+
+from models.manager import model_manager
+from modules.context import RunContext
+from modules.artifacts import ArtifactAccess
+from modules.module import Module, ModuleResult
+from pipeline.incremental import FingerprintStore
+from pipeline.tracing import Trace, tracer
+
+
+class Pipeline:
+    """
+    Schedules modules as a dependency graph and runs every ready module on a worker pool.
+
+    The plan is built once from Module.dependencies and Module.soft_dependencies. A module becomes ready once all of its
+    hard and soft dependencies have finished. If a hard dependency failed or requested a stop of its pipeline, the module
+    is skipped and counts as stopped itself, so the stop propagates to everything downstream. Soft dependencies that are
+    not part of the pipeline are ignored, so a pipeline may consist of only the modules some targets need, see
+    modules.create_with_dependencies.
+
+    The fingerprint of every successful module is stored in the communication directory of the location, see
+    FingerprintStore. In incremental mode, a module whose fingerprint is unchanged is not run again and counts as
+    finished successfully. Results of an earlier run that a module ran without finishing successfully did not write
+    again are removed, so that soft dependents do not consume outdated results. A skipped module keeps its results, as
+    it did not run, but loses its fingerprint, so that it runs again once its dependencies succeed.
+    """
+
+    def __init__(self, modules: List[Module], context: RunContext, max_workers: int = 4, resource_limits: Dict[str, int] = None,
+                 incremental: bool = False, invalidate: Set[str] = None):
+        """
+        Initialize the pipeline and build its execution plan.
+
+        :param modules: Modules that make up the pipeline. They are bound to the run context of the pipeline.
+        :param context: Run context of the location the pipeline processes.
+        :param max_workers: Maximum number of modules running at the same time.
+        :param resource_limits: Maximum number of concurrently running modules per resource, e.g. {"gpu": 1}.
+        :param incremental: Whether to skip modules whose fingerprint is unchanged since they last finished.
+        :param invalidate: Names of modules that run in incremental mode anyway, together with everything downstream of them.
+        :raises ValueError: If a module name is duplicated, a hard dependency or invalidated module is unknown or the dependencies contain a cycle.
+        """
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+
+        self.modules: Dict[str, Module] = {}
+        for module in modules:
+            if module.name in self.modules:
+                raise ValueError(f"Duplicate module name: {module.name}")
+            self.modules[module.name] = module
+
+        self.context = context
+        for module in self.modules.values():
+            module.context = context
+
+        self.max_workers = max_workers
+        self.resource_limits = resource_limits if resource_limits is not None else {}
+        self.order = self.plan()
+        self.trace: Trace | None = None
+
+        self.incremental = incremental
+        unknown = (invalidate or set()) - self.modules.keys()
+        if unknown:
+            raise ValueError(f"Cannot invalidate unknown modules: {', '.join(sorted(unknown))}")
+        self.invalidated = self.downstream(invalidate or set())
+        self.fingerprints: FingerprintStore | None = None
+
+        # Tell the model manager which models the planned modules will need.
+        for module in self.modules.values():
+            for model_name in module.models:
+                model_manager().expect(model_name)
+
+    def plan(self) -> List[str]:
+        """
+        Compute a topological order of the modules.
+
+        :return: Module names in an order in which every module comes after all of its dependencies.
+        :raises ValueError: If a hard dependency is unknown or the dependencies contain a cycle.
+        """
+        for module in self.modules.values():
+            unknown = module.dependencies - self.modules.keys()
+            if unknown:
+                raise ValueError(f"Module {module.name} depends on unknown modules: {', '.join(sorted(unknown))}")
+
+        for module in self.modules.values():
+            for resource in module.resources:
+                if self.resource_limits.get(resource, 1) < 1:
+                    raise ValueError(f"Module {module.name} requires resource {resource}, which has a limit below 1")
+
+        # Kahn's algorithm, keeping the declaration order among modules that are ready at the same time.
+        indegree = {name: len(self._upstream(name)) for name in self.modules}
+        dependents = self._dependents()
+        ready = [name for name in self.modules if indegree[name] == 0]
+        order = []
+
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for dependent in dependents[name]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(order) != len(self.modules):
+            cyclic = sorted(name for name in self.modules if name not in order)
+            raise ValueError(f"Dependency cycle between modules: {', '.join(cyclic)}")
+
+        return order
+
+    def _upstream(self, name: str) -> Set[str]:
+        """Return the hard dependencies and the soft dependencies in the pipeline of a module."""
+        module = self.modules[name]
+        return module.dependencies | (module.soft_dependencies & self.modules.keys())
+
+    def _dependents(self) -> Dict[str, List[str]]:
+        """Return, for each module, the modules that depend on it, in declaration order."""
+        dependents = {name: [] for name in self.modules}
+        for name in self.modules:
+            for dep in self._upstream(name):
+                dependents[dep].append(name)
+        return dependents
+
+    def downstream(self, names: Set[str]) -> Set[str]:
+        """
+        Collect modules together with every module that depends on them, directly or transitively.
+
+        :param names: Names of the modules.
+        :return: Names of the modules and their dependents.
+        """
+        dependents = self._dependents()
+        collected = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in collected:
+                collected.add(name)
+                pending.extend(dependents[name])
+        return collected
+
+    def run(self) -> Dict[str, ModuleResult]:
+        """
+        Run the pipeline until every module has either finished or been skipped. The spans recorded during the run are
+        kept in the trace attribute afterwards.
+
+        :return: The result of every module. Skipped modules are reported as ModuleResult.STOP_PIPELINE.
+        """
+        results: Dict[str, ModuleResult] = {}
+        dependents = self._dependents()
+        remaining = {name: len(self._upstream(name)) for name in self.modules}
+        priority = {name: index for index, name in enumerate(self.order)}
+
+        ready: List[str] = [name for name in self.order if remaining[name] == 0]
+        running: Dict[Future, str] = {}
+        resources_in_use: Dict[str, int] = {}
+        self.fingerprints = FingerprintStore(self.context.fingerprint_path)
+
+        def finish(name: str, result: ModuleResult) -> None:
+            """Record the result of a module, release the models it needed and its dependents."""
+            results[name] = result
+            for model_name in self.modules[name].models:
+                model_manager().release(model_name)
+            for dependent in dependents[name]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+            ready.sort(key=priority.__getitem__)
+
+        def resources_available(module: Module) -> bool:
+            return all(resources_in_use.get(resource, 0) < self.resource_limits.get(resource, self.max_workers) for resource in module.resources)
+
+        with tracer().span(self.context.location, "run"), \
+                ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="module") as executor:
+            while ready or running:
+                for name in list(ready):
+                    module = self.modules[name]
+
+                    if any(results[dep] != ModuleResult.OK for dep in module.dependencies):
+                        print(f"Skipping {name} as one or more hard dependencies failed or requested a stop of their dependency pipeline.")
+                        ready.remove(name)
+                        self.fingerprints.drop(name)
+                        finish(name, ModuleResult.STOP_PIPELINE)
+                        continue
+
+                    if len(running) >= self.max_workers or not resources_available(module):
+                        continue
+
+                    ready.remove(name)
+                    for resource in module.resources:
+                        resources_in_use[resource] = resources_in_use.get(resource, 0) + 1
+                    running[executor.submit(self._execute_module, module)] = name
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    for resource in self.modules[name].resources:
+                        resources_in_use[resource] -= 1
+                    finish(name, future.result())
+
+        self.context.artifacts.close()
+        self.trace = tracer().collect()
+        return results
+
+    def _execute_module(self, module: Module) -> ModuleResult:
+        """
+        Execute the module unless it is up to date, record its fingerprint and report its result. Uncaught exceptions are
+        treated as ModuleResult.ERROR.
+        """
+        with tracer().span(module.name, "module") as span:
+            if self.incremental and module.name not in self.invalidated:
+                reason = self.fingerprints.stale_reason(module, self.context.artifacts)
+                if reason is None:
+                    print(f"Module {module.name} is up to date")
+                    if span is not None:
+                        span.args["result"] = "UP_TO_DATE"
+                    return ModuleResult.OK
+                print(f"Running module {module.name} {reason}")
+            else:
+                print(f"Running module {module.name}")
+
+            with self.context.artifacts.recording() as access:
+                try:
+                    result = module.main()
+                except Exception:
+                    traceback.print_exc()
+                    result = ModuleResult.ERROR
+            if span is not None:
+                span.args["result"] = result.name
+
+        if result == ModuleResult.OK:
+            self.fingerprints.record(module, self.context.artifacts, access)
+        else:
+            self._discard_outdated(module.name, access)
+
+        match result:
+            case ModuleResult.OK:
+                print(f"Module {module.name} finished successfully")
+            case ModuleResult.ERROR:
+                print(f"Module {module.name} failed with an error")
+            case ModuleResult.STOP_PIPELINE:
+                print(f"Module {module.name} requested to stop its pipeline")
+        return result
+
+    def _discard_outdated(self, name: str, access: ArtifactAccess) -> None:
+        """Drop the fingerprint of a module that ran without finishing and remove the persisted results it did not write again."""
+        outdated = sorted(output for output, persisted in self.fingerprints.drop(name).items() if persisted and output not in access.writes)
+        for output in outdated:
+            self.context.artifacts.discard(output)
+        if outdated:
+            print(f"Removed outdated results of {name}: {', '.join(outdated)}")
@@ -0,0 +1,293 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Set
+
+# Counters of model calls that are summed up per model in the summary.
+TOKEN_COUNTERS = ("prompt_tokens", "generated_tokens")
+
+
+class Span:
+    """
+    A timed section of a run, e.g. a module or a model call.
+
+    Besides wall time and the CPU time of its thread, a span records the resident set size of the process when it ends
+    and its change since the span started, and the accelerator memory allocated by torch when it ends and at its peak
+    while the span was open, in bytes, or None where they are unavailable. Further values, e.g. token counts, are kept in
+    args.
+    """
+
+    __slots__ = ("name", "category", "thread_id", "start", "wall_seconds", "cpu_seconds", "rss", "rss_delta",
+                 "accelerator_memory", "accelerator_peak", "args")
+
+    def __init__(self, name: str, category: str, start: float, args: Dict[str, Any]) -> None:
+        self.name: str = name
+        self.category: str = category
+        self.thread_id: int = threading.get_ident()
+        self.start: float = start
+        self.wall_seconds: float = 0.0
+        self.cpu_seconds: float = 0.0
+        self.rss: int | None = None
+        self.rss_delta: int | None = None
+        self.accelerator_memory: int | None = None
+        self.accelerator_peak: int | None = None
+        self.args: Dict[str, Any] = args
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        """Generated tokens per second of wall time, or None if no tokens were counted."""
+        if "generated_tokens" not in self.args or self.wall_seconds <= 0:
+            return None
+        return self.args["generated_tokens"] / self.wall_seconds
+
+
+class Trace:
+    """
+    The finished spans of a run, exportable as Chrome trace and as summary table.
+    """
+
+    def __init__(self, spans: List[Span]) -> None:
+        """
+        Initialize the trace.
+
+        :param spans: The finished spans in order of their end.
+        """
+        self.spans: List[Span] = spans
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """
+        Convert the trace to the Chrome trace event format, which chrome://tracing and Perfetto display as a timeline.
+
+        :return: The JSON-serializable trace.
+        """
+        pid = os.getpid()
+        # Threads are numbered in the order of their first span.
+        thread_numbers: Dict[int, int] = {}
+        for span in sorted(self.spans, key=lambda span: span.start):
+            thread_numbers.setdefault(span.thread_id, len(thread_numbers))
+
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": number, "args": {"name": f"thread {number}"}}
+                  for number in thread_numbers.values()]
+        for span in self.spans:
+            args = dict(span.args)
+            args["cpu_seconds"] = round(span.cpu_seconds, 6)
+            for name in ("rss", "rss_delta", "accelerator_memory", "accelerator_peak"):
+                if getattr(span, name) is not None:
+                    args[name] = getattr(span, name)
+            if span.tokens_per_second is not None:
+                args["tokens_per_second"] = round(span.tokens_per_second, 2)
+
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round(span.start * 1e6, 3),
+                "dur": round(span.wall_seconds * 1e6, 3),
+                "pid": pid,
+                "tid": thread_numbers[span.thread_id],
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: str) -> None:
+        """
+        Write the trace as Chrome trace JSON file.
+
+        :param path: Path of the file. Its directory is created if necessary.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.chrome_trace(), file, default=str)
+
+    def summary(self) -> str:
+        """
+        Format a table of the modules, of the stages within modules and of the model calls summed up per model.
+
+        :return: The table.
+        """
+        lines = [f"{'module':<24} {'wall s':>8} {'cpu s':>8} {'RSS MiB':>8} {'RSS +MiB':>9} {'accel MiB':>10} {'accel peak MiB':>14}"]
+        for span in self.spans:
+            if span.category == "module":
+                lines.append(f"{span.name:<24} {span.wall_seconds:>8.2f} {span.cpu_seconds:>8.2f} {_mebibytes(span.rss):>8} "
+                             f"{_mebibytes(span.rss_delta):>9} {_mebibytes(span.accelerator_memory):>10} "
+                             f"{_mebibytes(span.accelerator_peak):>14}")
+
+        models: Dict[str, Dict[str, float]] = {}
+        for span in self.spans:
+            if span.category not in ("model", "model_load"):
+                continue
+            totals = models.setdefault(span.name, {"calls": 0, "load_seconds": 0.0, "seconds": 0.0, "prompt_tokens": 0, "generated_tokens": 0})
+            if span.category == "model_load":
+                totals["load_seconds"] += span.wall_seconds
+                continue
+            totals["calls"] += 1
+            totals["seconds"] += span.wall_seconds
+            for counter in TOKEN_COUNTERS:
+                totals[counter] += span.args.get(counter, 0)
+
+        stages = [span for span in self.spans if span.category == "stage"]
+        if stages:
+            lines.append("")
+            lines.append(f"{'stage':<24} {'wall s':>8} {'calls':>6} {'in tok':>8} {'out tok':>8}")
+            for span in stages:
+                lines.append(f"{span.name:<24} {span.wall_seconds:>8.2f} {span.args.get('calls', 0):>6} "
+                             f"{span.args.get('input_tokens', 0):>8} {span.args.get('output_tokens', 0):>8}")
+
+        if models:
+            lines.append("")
+            lines.append(f"{'model':<32} {'calls':>6} {'load s':>8} {'run s':>8} {'prompt tok':>10} {'gen tok':>8} {'tok/s':>8}")
+            for name, totals in models.items():
+                rate = totals["generated_tokens"] / totals["seconds"] if totals["seconds"] > 0 else 0.0
+                lines.append(f"{name:<32} {totals['calls']:>6} {totals['load_seconds']:>8.2f} {totals['seconds']:>8.2f} "
+                             f"{totals['prompt_tokens']:>10} {totals['generated_tokens']:>8} {rate:>8.1f}")
+        return "\n".join(lines)
+
+
+class Tracer:
+    """
+    Records spans of the pipeline and of the models cheaply enough to stay enabled in production.
+
+    Opening and closing a span only reads clocks and counters the operating system and torch keep anyway. Memory is
+    measured for the whole process, as modules run concurrently in one process, so the memory of a span includes that of
+    the spans running at the same time. To get the accelerator peak of every span, the peak torch tracks is reset
+    whenever a span opens or closes, after folding it into the peaks of the open spans.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        """
+        Initialize the tracer.
+
+        :param enabled: Whether spans are recorded. A disabled tracer does nothing.
+        """
+        self.enabled: bool = enabled
+        self._origin: float = time.perf_counter()
+        self._spans: List[Span] = []
+        self._open: Set[Span] = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[Span | None]:
+        """
+        Record the enclosed section as span.
+
+        :param name: Name of the span, e.g. the module or model name.
+        :param category: Kind of the span, e.g. "module", "stage", "model" or "model_load".
+        :param args: JSON-serializable values recorded with the span.
+        :return: Context manager yielding the open span, or None if the tracer is disabled.
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        stack = self._stack()
+        span = Span(name, category, time.perf_counter() - self._origin, args)
+        rss_start = _current_rss()
+        with self._lock:
+            self._fold_accelerator_peak()
+            self._open.add(span)
+        cpu_start = time.thread_time()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span.wall_seconds = time.perf_counter() - self._origin - span.start
+            span.cpu_seconds = time.thread_time() - cpu_start
+            span.rss = _current_rss()
+            if span.rss is not None and rss_start is not None:
+                span.rss_delta = span.rss - rss_start
+            with self._lock:
+                self._fold_accelerator_peak()
+                self._open.discard(span)
+                self._spans.append(span)
+
+    def count(self, **counters: int | float) -> None:
+        """
+        Add counters, e.g. token counts, to the innermost open span of the calling thread.
+
+        :param counters: The values to add.
+        """
+        stack = self._stack() if self.enabled else None
+        if not stack:
+            return
+        args = stack[-1].args
+        for name, value in counters.items():
+            args[name] = args.get(name, 0) + value
+
+    def collect(self) -> Trace:
+        """
+        Take the spans finished since the last collection.
+
+        :return: The finished spans.
+        """
+        with self._lock:
+            spans, self._spans = self._spans, []
+        return Trace(spans)
+
+    def _fold_accelerator_peak(self) -> None:
+        """
+        Raise the accelerator peak of the open spans to the peak torch tracked since the last fold and restart tracking
+        from the current allocation. Must be called with the lock held.
+        """
+        torch = _initialized_cuda()
+        if torch is None:
+            return
+        memory, peak = torch.cuda.memory_allocated(), torch.cuda.max_memory_allocated()
+        for span in self._open:
+            span.accelerator_memory = memory
+            span.accelerator_peak = peak if span.accelerator_peak is None else max(span.accelerator_peak, peak)
+        torch.cuda.reset_peak_memory_stats()
+
+    def _stack(self) -> List[Span]:
+        """Get the open spans of the calling thread."""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+
+def _current_rss() -> int | None:
+    """Get the current resident set size of the process in bytes, or None if the platform does not expose it cheaply."""
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _initialized_cuda():
+    """Get torch if a model initialized CUDA, without importing torch or initializing CUDA otherwise."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_initialized():
+        return None
+    return torch
+
+
+def _mebibytes(value: int | None) -> str:
+    """Format a byte count in MiB for the summary table."""
+    return "-" if value is None else f"{value / 1024 ** 2:.0f}"
+
+
+_tracer = Tracer()
+
+
+def tracer() -> Tracer:
+    """
+    Get the tracer of the process.
+
+    :return: The tracer.
+    """
+    return _tracer
+
+
+def set_tracer(new_tracer: Tracer) -> None:
+    """
+    Replace the tracer of the process, e.g. to disable tracing.
+
+    :param new_tracer: The new tracer.
+    """
+    global _tracer
+    _tracer = new_tracer
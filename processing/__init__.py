@@ -0,0 +1,4 @@
+from processing.tiling import TiledWaterMask
+from processing.water_mask import WaterMaskEngine
+
+__all__ = ["TiledWaterMask", "WaterMaskEngine"]
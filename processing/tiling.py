@@ -0,0 +1,294 @@
+import math
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from processing.water_mask import WaterMaskEngine
+
+# A window of a raster as (top, bottom, left, right), with exclusive bottom and right.
+Window = Tuple[int, int, int, int]
+
+
+def tile_windows(height: int, width: int, tile_size: int) -> List[Window]:
+    """
+    Split a raster into a grid of tiles in row-major order.
+
+    :param height: Height of the raster in pixels.
+    :param width: Width of the raster in pixels.
+    :param tile_size: Maximum width and height of a tile.
+    :return: Windows of all tiles.
+    :raises ValueError: If the tile size is less than 1.
+    """
+    if tile_size < 1:
+        raise ValueError(f"The tile size must be at least 1, got {tile_size}")
+    return [(top, min(top + tile_size, height), left, min(left + tile_size, width))
+            for top in range(0, height, tile_size)
+            for left in range(0, width, tile_size)]
+
+
+def expand_window(window: Window, halo: int, height: int, width: int) -> Window:
+    """
+    Grow a window by a halo on every side, clipped to the raster.
+
+    :param window: Window of the tile.
+    :param halo: Number of pixels to add on every side.
+    :param height: Height of the raster in pixels.
+    :param width: Width of the raster in pixels.
+    :return: The expanded window.
+    """
+    top, bottom, left, right = window
+    return max(top - halo, 0), min(bottom + halo, height), max(left - halo, 0), min(right + halo, width)
+
+
+def open_raster(path: str, mode: str = "r") -> np.ndarray:
+    """
+    Memory-map a raster stored as .npy file.
+
+    :param path: Path of the raster.
+    :param mode: Memory-map mode, e.g. "r" or "r+".
+    :return: The memory-mapped raster.
+    """
+    return np.load(path, mmap_mode=mode)
+
+
+def block_max(raster: np.ndarray, max_size: int, band_height: int = 2048) -> np.ndarray:
+    """
+    Downscale a raster by an integer factor so that it fits into a maximum size, keeping the maximum of every block.
+    The raster is read in bands of rows, so only one band is in memory at a time.
+
+    :param raster: 2D raster, e.g. a memory-mapped mask.
+    :param max_size: Maximum width and height of the result.
+    :param band_height: Approximate number of raster rows read at a time.
+    :return: The downscaled raster. Rasters that already fit are returned unchanged.
+    """
+    height, width = raster.shape[:2]
+    step = math.ceil(max(height, width) / max_size)
+    if step <= 1:
+        return np.asarray(raster)
+
+    rows = step * max(band_height // step, 1)
+    blocks_x = math.ceil(width / step)
+    bands = []
+    for top in range(0, height, rows):
+        band = np.asarray(raster[top:top + rows])
+        padded = np.zeros((math.ceil(band.shape[0] / step) * step, blocks_x * step), dtype=band.dtype)
+        padded[:band.shape[0], :width] = band
+        bands.append(padded.reshape(padded.shape[0] // step, step, blocks_x, step).max(axis=(1, 3)))
+    return np.concatenate(bands)
+
+
+def _label_tile(source_path: str, labels_path: str, window: Window, halo: int, engine: WaterMaskEngine) -> np.ndarray:
+    """
+    Clean up one tile of the water index raster and label the connected components of its core.
+
+    The halo around the tile is processed as well and cropped afterward, so the morphology of the core matches that of the
+    whole raster. The labels are written to the label raster, the component statistics are returned in global coordinates.
+    """
+    source = open_raster(source_path)
+    height, width = source.shape[:2]
+    top, bottom, left, right = window
+    outer_top, outer_bottom, outer_left, outer_right = expand_window(window, halo, height, width)
+
+    gray = engine.to_grayscale(np.ascontiguousarray(source[outer_top:outer_bottom, outer_left:outer_right]))
+    cleaned = engine.clean(engine.binarize(gray))
+    core = np.ascontiguousarray(cleaned[top - outer_top:bottom - outer_top, left - outer_left:right - outer_left])
+
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(core, connectivity=8, ltype=cv2.CV_32S)
+    open_raster(labels_path, "r+")[top:bottom, left:right] = labels
+
+    stats[:, cv2.CC_STAT_LEFT] += left
+    stats[:, cv2.CC_STAT_TOP] += top
+    return stats
+
+
+def _apply_lookup_table(labels_path: str, lookup_table_path: str, output_path: str, window: Window, offset: int) -> None:
+    """Write the output value of every pixel of one tile, looked up by its global component label."""
+    top, bottom, left, right = window
+    labels = open_raster(labels_path)[top:bottom, left:right].astype(np.int64)
+    labels[labels > 0] += offset
+    open_raster(output_path, "r+")[top:bottom, left:right] = open_raster(lookup_table_path)[labels]
+
+
+class UnionFind:
+    """Disjoint sets over the integers 0 to size - 1, each represented by its smallest member."""
+
+    def __init__(self, size: int):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def find(self, item: int) -> int:
+        """Get the representative of the set containing an item."""
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first: int, second: int) -> None:
+        """Merge the sets containing two items."""
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+    def roots(self) -> np.ndarray:
+        """Get the representative of every item."""
+        parent = self.parent
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                return parent
+            parent = grandparent
+
+
+class TiledWaterMask:
+    """
+    Computes the water mask of a raster too large to be held in memory.
+
+    The raster is memory-mapped and processed tile by tile on a process pool, so the peak memory of every worker depends
+    on the tile size only. Tiles are cleaned up with a halo wide enough for the morphological operations, and components
+    crossing tile borders are merged before they are filtered, so the result equals that of the WaterMaskEngine on the
+    whole raster.
+    """
+
+    def __init__(self, engine: WaterMaskEngine = None, tile_size: int = 2048, max_workers: int = None):
+        """
+        Initialize the tiled mask computation.
+
+        :param engine: Engine defining the thresholds and morphology, or None for the default engine.
+        :param tile_size: Maximum width and height of a tile.
+        :param max_workers: Number of worker processes, or None for one per core.
+        """
+        self.engine = engine if engine is not None else WaterMaskEngine()
+        self.tile_size = tile_size
+        self.max_workers = max_workers
+
+    @property
+    def halo(self) -> int:
+        """
+        Number of pixels around a tile that influence the morphology of the tile.
+
+        Closing and opening each apply two operations and the final dilation one, and every operation reaches half a
+        kernel in each direction.
+        """
+        kernel_height, kernel_width = self.engine.kernel.shape
+        return 5 * max(kernel_height // 2, kernel_width // 2)
+
+    def process(self, source_path: str, output_path: str) -> Tuple[np.ndarray, int]:
+        """
+        Compute the water mask of a raster.
+
+        :param source_path: Path of the water index raster, a grayscale, BGR or BGRA .npy file.
+        :param output_path: Path of the .npy file the mask is written to.
+        :return: The memory-mapped mask with 255 for water and 0 for land, and the number of water bodies in it.
+        """
+        height, width = open_raster(source_path).shape[:2]
+        windows = tile_windows(height, width, self.tile_size)
+        np.lib.format.open_memmap(output_path, mode="w+", dtype=np.uint8, shape=(height, width)).flush()
+
+        # Spawned workers do not inherit the threads of the pipeline.
+        context = multiprocessing.get_context("spawn")
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.realpath(output_path))) as work_dir, \
+                ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context) as executor:
+            labels_path = os.path.join(work_dir, "labels.npy")
+            np.lib.format.open_memmap(labels_path, mode="w+", dtype=np.int32, shape=(height, width)).flush()
+
+            tile_stats = list(executor.map(_label_tile, [source_path] * len(windows), [labels_path] * len(windows), windows,
+                                           [self.halo] * len(windows), [self.engine] * len(windows)))
+
+            # Label i > 0 of tile t becomes global label offsets[t] + i, label 0 stays the background.
+            counts = [len(stats) - 1 for stats in tile_stats]
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+            merged = self._merge(labels_path, windows, offsets, tile_stats, height, width)
+
+            lookup_table_path = os.path.join(work_dir, "lookup_table.npy")
+            lookup_table = self.engine.component_lookup_table(merged["stats"])[merged["roots"]]
+            np.save(lookup_table_path, lookup_table)
+
+            list(executor.map(_apply_lookup_table, [labels_path] * len(windows), [lookup_table_path] * len(windows),
+                              [output_path] * len(windows), windows, offsets.tolist()))
+
+        kept = int(np.count_nonzero(self.engine.component_lookup_table(merged["stats"])))
+        return open_raster(output_path), kept
+
+    def _merge(self, labels_path: str, windows: List[Window], offsets: np.ndarray, tile_stats: List[np.ndarray], height: int,
+               width: int) -> Dict[str, np.ndarray]:
+        """
+        Merge the components that touch across tile borders.
+
+        :return: "roots" maps every global label to the index of its merged component, "stats" holds the statistics of
+            the merged components in the format of cv2.connectedComponentsWithStats, with the background at index 0.
+        """
+        total = int(sum(len(stats) - 1 for stats in tile_stats)) + 1
+        union_find = UnionFind(total)
+        labels = open_raster(labels_path)
+        tops = sorted({window[0] for window in windows})
+        lefts = sorted({window[2] for window in windows})
+
+        def global_labels(local: np.ndarray, tile_rows: np.ndarray, tile_columns: np.ndarray) -> np.ndarray:
+            tile_index = tile_rows * len(lefts) + tile_columns
+            return np.where(local > 0, local.astype(np.int64) + offsets[tile_index], 0)
+
+        column_tiles = np.searchsorted(lefts, np.arange(width), side="right") - 1
+        row_tiles = np.searchsorted(tops, np.arange(height), side="right") - 1
+
+        # Two pixels on either side of a seam belong to the same component if they are 8-connected.
+        for seam in tops[1:]:
+            above = global_labels(labels[seam - 1], np.full(width, row_tiles[seam - 1]), column_tiles)
+            below = global_labels(labels[seam], np.full(width, row_tiles[seam]), column_tiles)
+            self._union_neighbors(union_find, above, below)
+        for seam in lefts[1:]:
+            left = global_labels(labels[:, seam - 1], row_tiles, np.full(height, column_tiles[seam - 1]))
+            right = global_labels(labels[:, seam], row_tiles, np.full(height, column_tiles[seam]))
+            self._union_neighbors(union_find, left, right)
+
+        roots = union_find.roots()
+        unique_roots, roots = np.unique(roots, return_inverse=True)
+
+        global_stats = np.concatenate([np.zeros((1, 5), dtype=np.int64)] + [stats[1:].astype(np.int64) for stats in tile_stats])
+        left = global_stats[:, cv2.CC_STAT_LEFT]
+        top = global_stats[:, cv2.CC_STAT_TOP]
+        right = left + global_stats[:, cv2.CC_STAT_WIDTH]
+        bottom = top + global_stats[:, cv2.CC_STAT_HEIGHT]
+
+        merged_left = np.full(len(unique_roots), np.iinfo(np.int64).max)
+        merged_top = np.full(len(unique_roots), np.iinfo(np.int64).max)
+        merged_right = np.zeros(len(unique_roots), dtype=np.int64)
+        merged_bottom = np.zeros(len(unique_roots), dtype=np.int64)
+        merged_area = np.zeros(len(unique_roots), dtype=np.int64)
+        np.minimum.at(merged_left, roots, left)
+        np.minimum.at(merged_top, roots, top)
+        np.maximum.at(merged_right, roots, right)
+        np.maximum.at(merged_bottom, roots, bottom)
+        np.add.at(merged_area, roots, global_stats[:, cv2.CC_STAT_AREA])
+
+        stats = np.zeros((len(unique_roots), 5), dtype=np.int64)
+        stats[:, cv2.CC_STAT_LEFT] = merged_left
+        stats[:, cv2.CC_STAT_TOP] = merged_top
+        stats[:, cv2.CC_STAT_WIDTH] = merged_right - merged_left
+        stats[:, cv2.CC_STAT_HEIGHT] = merged_bottom - merged_top
+        stats[:, cv2.CC_STAT_AREA] = merged_area
+        return {"roots": roots, "stats": stats}
+
+    @staticmethod
+    def _union_neighbors(union_find: UnionFind, first: np.ndarray, second: np.ndarray) -> None:
+        """Unite the labels of two adjacent lines of pixels wherever both are foreground and 8-connected."""
+        pairs = []
+        for shift in (-1, 0, 1):
+            shifted = np.zeros_like(second)
+            if shift < 0:
+                shifted[1:] = second[:-1]
+            elif shift > 0:
+                shifted[:-1] = second[1:]
+            else:
+                shifted = second
+            connected = (first > 0) & (shifted > 0)
+            pairs.append(np.stack([first[connected], shifted[connected]], axis=1))
+
+        for a, b in np.unique(np.concatenate(pairs), axis=0):
+            union_find.union(int(a), int(b))
+
@@ -0,0 +1,36 @@
+from typing import List, Tuple
+
+import numpy as np
+
+# Color ramp of the moisture index, as used by the Sentinel Hub moisture index visualization.
+MOISTURE_RAMP: List[Tuple[float, int]] = [
+    (-0.8, 0x800000),
+    (-0.24, 0xff0000),
+    (-0.032, 0xffff00),
+    (0.032, 0x00ffff),
+    (0.24, 0x0000ff),
+    (0.8, 0x000080),
+]
+
+
+def color_ramp(values: np.ndarray, ramp: List[Tuple[float, int]]) -> np.ndarray:
+    """
+    Render index values with a color ramp, like the ColorRampVisualizer of Sentinel Hub evalscripts.
+
+    Colors are interpolated linearly between the ramp points and clamped outside of them. Pixels without data (NaN) are
+    fully transparent.
+
+    :param values: 2D array of index values.
+    :param ramp: Ramp points as (value, 0xRRGGBB color), sorted by value.
+    :return: RGBA image with 8 bits per channel.
+    """
+    positions = np.array([position for position, _ in ramp], dtype=np.float64)
+    colors = np.array([[(color >> 16) & 0xff, (color >> 8) & 0xff, color & 0xff] for _, color in ramp], dtype=np.float64)
+
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, positions[0])
+    image = np.empty(values.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        image[..., channel] = np.rint(np.interp(filled, positions, colors[:, channel])).astype(np.uint8)
+    image[..., 3] = np.where(valid, 255, 0)
+    return image
@@ -0,0 +1,130 @@
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+
+class WaterMaskEngine:
+    """
+    Extracts a binary mask of water bodies from a water index image.
+
+    The image is binarized, cleaned up with morphological closing, opening and dilation, and only connected components
+    that are large or elongated enough are kept.
+    """
+
+    def __init__(self, threshold: int = 60, min_area: int = 100, min_aspect_ratio: float = 2.0, kernel_shape: int = cv2.MORPH_ELLIPSE,
+                 kernel_size: Tuple[int, int] = (3, 3), index_threshold: float = 0.235):
+        """
+        Initialize the engine.
+
+        :param threshold: Gray value above which a pixel of an 8-bit water image counts as water.
+        :param min_area: Minimum number of pixels of a component that is kept.
+        :param min_aspect_ratio: Minimum width to height ratio of a component that is kept regardless of its area, to keep rivers.
+        :param kernel_shape: OpenCV structuring element shape of the morphological operations, e.g. cv2.MORPH_ELLIPSE.
+        :param kernel_size: Size of the structuring element.
+        :param index_threshold: Water index value above which a pixel of a float index raster counts as water. The
+            default corresponds to the gray value 60 of the 8-bit image, which maps the index range 0 to 1 to 0 to 255.
+        """
+        self.threshold = threshold
+        self.index_threshold = index_threshold
+        self.min_area = min_area
+        self.min_aspect_ratio = min_aspect_ratio
+        self.kernel = cv2.getStructuringElement(kernel_shape, kernel_size)
+
+    def process_file(self, image_path: str) -> np.ndarray:
+        """
+        Compute the water mask of an image file.
+
+        :param image_path: Path to the water index image.
+        :return: Mask with 255 for water and 0 for land.
+        :raises ValueError: If the image cannot be read.
+        """
+        # Read the image including the alpha channel for transparent (manually downloaded) images.
+        image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"Could not read image: {image_path}")
+        return self.process(image)
+
+    def process(self, image: np.ndarray, rgb: bool = False) -> np.ndarray:
+        """
+        Compute the water mask of an image.
+
+        :param image: Grayscale, BGR or BGRA image, or a float water index raster.
+        :param rgb: Whether color images are in RGB order, as loaded by PIL, instead of the BGR order of OpenCV.
+        :return: Mask with 255 for water and 0 for land.
+        """
+        return self.filter_components(self.clean(self.binarize(self.to_grayscale(image, rgb))))
+
+    @staticmethod
+    def to_grayscale(image: np.ndarray, rgb: bool = False) -> np.ndarray:
+        """
+        Convert an image to 8-bit grayscale, setting fully transparent pixels to black.
+
+        :param image: Grayscale, BGR or BGRA image with 8 or 16 bits per channel, or a float index raster.
+        :param rgb: Whether color images are in RGB order instead of BGR order.
+        :return: 8-bit grayscale image, or the float index raster unchanged.
+        """
+        if image.dtype == np.uint16:
+            image = (image >> 8).astype(np.uint8)
+
+        if image.ndim == 2:
+            return image
+        if image.shape[2] == 4:
+            gray = cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY if rgb else cv2.COLOR_BGRA2GRAY)
+            gray[image[:, :, 3] == 0] = 0
+            return gray
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY if rgb else cv2.COLOR_BGR2GRAY)
+
+    def binarize(self, gray: np.ndarray) -> np.ndarray:
+        """
+        Binarize a grayscale image at the threshold, or a float index raster at the index threshold.
+        Pixels without data (NaN) are never water.
+
+        :param gray: 8-bit grayscale image or float index raster.
+        :return: Binary image with values 0 and 255.
+        """
+        if np.issubdtype(gray.dtype, np.floating):
+            return np.where(gray > self.index_threshold, 255, 0).astype(np.uint8)
+
+        _, binarized = cv2.threshold(gray, self.threshold, 255, cv2.THRESH_BINARY)
+        return binarized
+
+    def clean(self, binarized: np.ndarray) -> np.ndarray:
+        """
+        Close small gaps, remove specks and slightly grow the water areas.
+
+        :param binarized: Binary image.
+        :return: Cleaned binary image.
+        """
+        cleaned = cv2.morphologyEx(binarized, cv2.MORPH_CLOSE, self.kernel)
+        cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, self.kernel)
+        return cv2.morphologyEx(cleaned, cv2.MORPH_DILATE, self.kernel)
+
+    def filter_components(self, binary: np.ndarray) -> np.ndarray:
+        """
+        Keep only the connected components that are large or elongated enough.
+
+        The decision is made once per component from its statistics and applied to all pixels in one pass through a
+        lookup table indexed by label.
+
+        :param binary: Binary image.
+        :return: Mask with 255 for kept components and 0 elsewhere.
+        """
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        return self.component_lookup_table(stats)[labels]
+
+    def component_lookup_table(self, stats: np.ndarray) -> np.ndarray:
+        """
+        Compute the output value of every component label.
+
+        :param stats: Component statistics as returned by cv2.connectedComponentsWithStats.
+        :return: Array with 255 for kept labels and 0 for removed labels and the background label 0.
+        """
+        areas = stats[:, cv2.CC_STAT_AREA]
+        widths = stats[:, cv2.CC_STAT_WIDTH].astype(np.float64)
+        heights = stats[:, cv2.CC_STAT_HEIGHT]
+        aspect_ratios = np.divide(widths, heights, out=np.zeros_like(widths), where=heights > 0)
+
+        keep = (areas >= self.min_area) | (aspect_ratios >= self.min_aspect_ratio)
+        keep[0] = False
+        return np.where(keep, 255, 0).astype(np.uint8)
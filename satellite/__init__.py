@@ -0,0 +1,25 @@
+import importlib
+
+# Imported lazily, so that configuring the geocoder does not load OpenCV and requests.
+_ATTRIBUTES = {
+    "GeocodeCache": "satellite.geocoding",
+    "Geocoder": "satellite.geocoding",
+    "MosaicDownloader": "satellite.mosaic",
+    "ProcessApiClient": "satellite.process_api",
+    "RasterStore": "satellite.raster_store",
+    "SatelliteCache": "satellite.cache",
+    "default_geocoder": "satellite.geocoding",
+    "process_payload": "satellite.process_api",
+    "radius_bounds": "satellite.geocoding",
+    "set_default_geocoder": "satellite.geocoding",
+    "split_grid": "satellite.mosaic",
+}
+
+
+def __getattr__(name: str):
+    if name in _ATTRIBUTES:
+        return getattr(importlib.import_module(_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = list(_ATTRIBUTES)
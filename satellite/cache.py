@@ -0,0 +1,218 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl, concurrent fetches are only deduplicated within the process.
+    fcntl = None
+
+ENTRY_FILE = "entry.json"
+
+
+class SatelliteCache:
+    """
+    Content-addressed cache of downloaded satellite data.
+
+    Every entry is a directory named after the hash of all request parameters that determine the data. Entries are
+    written to a temporary directory that is renamed into place once complete, so a half-written entry is never visible.
+    Entries expire after a time to live, and the least recently used entries are removed once the cache exceeds its size.
+    Concurrent fetches of the same key, in this process or in other processes sharing the directory, download only once.
+    """
+
+    def __init__(self, directory: str, ttl: float | None = 7 * 24 * 3600, max_bytes: int | None = 20 * 1024 ** 3):
+        """
+        Initialize the cache.
+
+        :param directory: Directory the entries are stored in. It is created if necessary.
+        :param ttl: Time in seconds after which an entry expires, or None to keep entries until they are evicted by size.
+        :param max_bytes: Maximum total size of all entries, or None for no limit.
+        """
+        self.directory = os.path.realpath(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(os.path.join(self.directory, "locks"), exist_ok=True)
+
+    @staticmethod
+    def key(parts: Dict[str, Any]) -> str:
+        """
+        Compute the key of a request.
+
+        :param parts: All request parameters that determine the data, e.g. bounding box, time interval and evalscript.
+        :return: The hex digest identifying the request.
+        """
+        serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        """
+        Get the directory of an entry.
+
+        :param key: Key of the entry.
+        :return: The directory, which exists only if the entry is complete.
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> str | None:
+        """
+        Look up an entry and mark it as recently used.
+
+        :param key: Key of the entry.
+        :return: The directory of the entry, or None if it does not exist or has expired.
+        """
+        path = self.path(key)
+        entry_file = os.path.join(path, ENTRY_FILE)
+        try:
+            with open(entry_file, "r", encoding="utf-8") as file:
+                created = json.load(file)["created"]
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError, KeyError):
+            return None
+
+        if self.ttl is not None and time.time() - created > self.ttl:
+            return None
+
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(entry_file)
+        return path
+
+    def fetch(self, key: str, parts: Dict[str, Any], producer: Callable[[str], None]) -> str:
+        """
+        Get an entry, producing it if it does not exist or has expired.
+
+        :param key: Key of the entry.
+        :param parts: The request parameters the key was computed from, stored with the entry for inspection.
+        :param producer: Writes the data of the entry into the given empty directory.
+        :return: The directory of the entry.
+        """
+        with self._lock(key):
+            path = self.get(key)
+            if path is not None:
+                return path
+
+            shard = os.path.dirname(self.path(key))
+            os.makedirs(shard, exist_ok=True)
+            staging = tempfile.mkdtemp(dir=shard, prefix=".tmp-")
+            try:
+                producer(staging)
+                with open(os.path.join(staging, ENTRY_FILE), "w", encoding="utf-8") as file:
+                    json.dump({"created": time.time(), "parts": parts}, file, ensure_ascii=False, default=str)
+
+                # An expired entry is replaced. Its files stay readable for processes that still have them open.
+                self._remove(self.path(key))
+                os.rename(staging, self.path(key))
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+
+        self.evict(keep=key)
+        return self.path(key)
+
+    def link(self, key: str, link_path: str) -> None:
+        """
+        Point a directory at an entry by atomically replacing it with a symbolic link. The entry is marked as recently
+        used, as the data behind the link is about to be consumed.
+
+        :param key: Key of the entry.
+        :param link_path: Path of the link, e.g. the satellite data directory of a location. A real directory at this
+            path, left by an older version, is removed.
+        """
+        if os.path.isdir(link_path) and not os.path.islink(link_path):
+            shutil.rmtree(link_path)
+
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(os.path.join(self.path(key), ENTRY_FILE))
+
+        temp_path = f"{link_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.symlink(self.path(key), temp_path, target_is_directory=True)
+        try:
+            os.replace(temp_path, link_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def evict(self, keep: str = None) -> None:
+        """
+        Remove expired entries and then the least recently used entries until the cache fits into its size.
+        Entries removed concurrently by another process are skipped.
+
+        :param keep: Key of an entry that is never removed, e.g. the one just fetched.
+        """
+        entries = []
+        now = time.time()
+        for shard in os.listdir(self.directory):
+            shard_path = os.path.join(self.directory, shard)
+            if shard == "locks" or not os.path.isdir(shard_path):
+                continue
+            for key in os.listdir(shard_path):
+                if key.startswith(".tmp-"):
+                    continue
+                path = os.path.join(shard_path, key)
+                try:
+                    last_used = os.stat(os.path.join(path, ENTRY_FILE)).st_mtime
+                    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+                except FileNotFoundError:
+                    continue
+
+                if key == keep:
+                    # Counts toward the size, but is never removed.
+                    entries.append((float("inf"), size, path))
+                elif self.ttl is not None and self._created(path, last_used) < now - self.ttl:
+                    self._remove(path)
+                else:
+                    entries.append((last_used, size, path))
+
+        if self.max_bytes is None:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for last_used, size, path in sorted(entries):
+            if total <= self.max_bytes or last_used == float("inf"):
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _created(path: str, default: float) -> float:
+        """Get the creation time stored with an entry."""
+        try:
+            with open(os.path.join(path, ENTRY_FILE), "r", encoding="utf-8") as file:
+                return json.load(file)["created"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return default
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        """Remove an entry by renaming it out of the way first, so it disappears atomically."""
+        trash = os.path.join(os.path.dirname(path), f".tmp-removed-{os.path.basename(path)}-{os.getpid()}-{threading.get_ident()}")
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def _lock(self, key: str) -> Iterator[None]:
+        """Hold the lock of a key against other threads and, where supported, other processes."""
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if fcntl is None:
+                yield
+                return
+
+            with open(os.path.join(self.directory, "locks", f"{key}.lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,325 @@
+import csv
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+
+# Semi-major axis in meters and squared eccentricity of the WGS84 ellipsoid.
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+
+class GeocodedLocation(NamedTuple):
+    """Center and bounding box of a geocoded place. The bounding box is (west, south, east, north) or None if unknown."""
+    latitude: float
+    longitude: float
+    bounds: Tuple[float, float, float, float] | None
+
+
+def radius_bounds(latitudes: np.ndarray, longitudes: np.ndarray, radius_km: float | np.ndarray) -> np.ndarray:
+    """
+    Compute the bounding boxes of circles around many centers at once.
+
+    The offsets use the meridional and prime vertical radii of curvature of the WGS84 ellipsoid, which agrees with a
+    geodesic destination in the four cardinal directions to well below a meter for radii of a few kilometers.
+
+    :param latitudes: Latitudes of the centers in degrees.
+    :param longitudes: Longitudes of the centers in degrees.
+    :param radius_km: Radius in kilometers, either one for all centers or one per center.
+    :return: Array of shape (n, 4) with the bounding box (west, south, east, north) of every center.
+    """
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    distance = np.asarray(radius_km, dtype=np.float64) * 1000.0
+
+    def meridional_radius(latitude: np.ndarray) -> np.ndarray:
+        return WGS84_A * (1 - WGS84_E2) / (1 - WGS84_E2 * np.sin(latitude) ** 2) ** 1.5
+
+    # The radius of curvature changes along the meridian, so it is evaluated at the midpoint of the offset.
+    north = latitudes + distance / meridional_radius(latitudes + distance / meridional_radius(latitudes) / 2)
+    south = latitudes - distance / meridional_radius(latitudes - distance / meridional_radius(latitudes) / 2)
+
+    prime_vertical_radius = WGS84_A / np.sqrt(1 - WGS84_E2 * np.sin(latitudes) ** 2)
+    longitude_offset = np.degrees(distance / (prime_vertical_radius * np.cos(latitudes)))
+
+    return np.stack([longitudes - longitude_offset, np.degrees(south), longitudes + longitude_offset, np.degrees(north)], axis=-1)
+
+
+class GeocodeCache:
+    """
+    Persistent cache of geocoded places keyed by place name and country, stored in an SQLite database.
+
+    Names and countries are compared case-insensitively. Places that could not be found are cached as well, so they are
+    not looked up again. The database can be shared by several processes.
+    """
+
+    def __init__(self, path: str = "./geocode_cache.sqlite3"):
+        """
+        Initialize the cache.
+
+        :param path: Path of the database file. It is created if necessary.
+        """
+        self.path = os.path.realpath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30.0)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS places (
+                    name TEXT NOT NULL,
+                    country TEXT NOT NULL,
+                    latitude REAL,
+                    longitude REAL,
+                    west REAL,
+                    south REAL,
+                    east REAL,
+                    north REAL,
+                    PRIMARY KEY (name, country)
+                )""")
+
+    @staticmethod
+    def key(name: str, country: str) -> Tuple[str, str]:
+        """
+        Normalize a place name and country for lookups.
+
+        :param name: Name of the place.
+        :param country: Country of the place.
+        :return: The normalized key.
+        """
+        return name.strip().casefold(), country.strip().casefold()
+
+    def contains(self, name: str, country: str) -> bool:
+        """
+        Check whether a place has been looked up before, whether it was found or not.
+
+        :param name: Name of the place.
+        :param country: Country of the place.
+        :return: True if the place is cached.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM places WHERE name = ? AND country = ?", self.key(name, country)).fetchone()
+        return row is not None
+
+    def get(self, name: str, country: str) -> GeocodedLocation | None:
+        """
+        Look up a place.
+
+        :param name: Name of the place.
+        :param country: Country of the place.
+        :return: The cached location, or None if the place is not cached or could not be found.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT latitude, longitude, west, south, east, north FROM places WHERE name = ? AND country = ?",
+                                           self.key(name, country)).fetchone()
+        if row is None or row[0] is None:
+            return None
+
+        latitude, longitude, *bounds = row
+        return GeocodedLocation(latitude, longitude, tuple(bounds) if None not in bounds else None)
+
+    def put(self, name: str, country: str, location: GeocodedLocation | None) -> None:
+        """
+        Store a place.
+
+        :param name: Name of the place.
+        :param country: Country of the place.
+        :param location: The geocoded location, or None if the place could not be found.
+        """
+        self.put_many([(name, country, location)])
+
+    def put_many(self, places: Iterable[Tuple[str, str, GeocodedLocation | None]]) -> None:
+        """
+        Store many places in one transaction.
+
+        :param places: The name, country and location of every place.
+        """
+        rows = []
+        for name, country, location in places:
+            if location is None:
+                rows.append((*self.key(name, country), None, None, None, None, None, None))
+            else:
+                bounds = location.bounds if location.bounds is not None else (None, None, None, None)
+                rows.append((*self.key(name, country), location.latitude, location.longitude, *bounds))
+
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def import_gazetteer(self, path: str, country: str = None) -> int:
+        """
+        Import an offline gazetteer, so places can be geocoded without network access.
+
+        The gazetteer is a CSV file with a header containing the columns name, latitude and longitude, and optionally
+        country and the bounding box columns west, south, east and north. It may also be a tab-separated GeoNames dump,
+        whose rows are imported with the given country.
+
+        :param path: Path of the gazetteer file.
+        :param country: Country of all places, required for GeoNames dumps and for CSV files without a country column.
+        :return: The number of imported places.
+        :raises ValueError: If the file lacks required columns or no country is known for a place.
+        """
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            first_line = file.readline()
+            file.seek(0)
+            if "\t" in first_line and not first_line.lower().startswith("name"):
+                places = self._read_geonames(file, country)
+            else:
+                places = self._read_csv(file, country)
+            self.put_many(places)
+        return len(places)
+
+    @staticmethod
+    def _read_csv(file, country: str | None) -> List[Tuple[str, str, GeocodedLocation]]:
+        """Read the places of a CSV gazetteer with a header."""
+        reader = csv.DictReader(file)
+        missing = {"name", "latitude", "longitude"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"The gazetteer is missing the columns {', '.join(sorted(missing))}")
+
+        places = []
+        for row in reader:
+            place_country = row.get("country") or country
+            if not place_country:
+                raise ValueError(f"No country given for {row['name']}")
+
+            bounds = None
+            if all(row.get(column) for column in ("west", "south", "east", "north")):
+                bounds = tuple(float(row[column]) for column in ("west", "south", "east", "north"))
+            places.append((row["name"], place_country, GeocodedLocation(float(row["latitude"]), float(row["longitude"]), bounds)))
+        return places
+
+    @staticmethod
+    def _read_geonames(file, country: str | None) -> List[Tuple[str, str, GeocodedLocation]]:
+        """Read the places of a GeoNames dump, registering every place under its name and its ASCII name."""
+        if not country:
+            raise ValueError("A country is required to import a GeoNames dump")
+
+        places = []
+        for line in file:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) < 6:
+                continue
+            location = GeocodedLocation(float(columns[4]), float(columns[5]), None)
+            for name in dict.fromkeys(name for name in (columns[1], columns[2]) if name):
+                places.append((name, country, location))
+        return places
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+
+class Geocoder:
+    """
+    Geocodes places through the persistent cache first and Nominatim second.
+
+    Nominatim allows about one request per second, so requests from all threads are spaced by a minimum delay. In
+    offline mode, only cached and imported places are found.
+    """
+
+    def __init__(self, cache: GeocodeCache, user_agent: str = "EcoScapes", min_delay: float = 1.0, offline: bool = False):
+        """
+        Initialize the geocoder.
+
+        :param cache: Cache places are looked up in and stored to.
+        :param user_agent: User agent sent to Nominatim.
+        :param min_delay: Minimum time between two Nominatim requests in seconds.
+        :param offline: Whether to never send requests to Nominatim.
+        """
+        self.cache = cache
+        self.user_agent = user_agent
+        self.min_delay = min_delay
+        self.offline = offline
+        self._nominatim = None
+        self._lock = threading.Lock()
+        self._last_request = 0.0
+
+    def geocode(self, name: str, country: str) -> GeocodedLocation | None:
+        """
+        Geocode a place.
+
+        :param name: Name of the place.
+        :param country: Country of the place.
+        :return: The location, or None if the place cannot be found.
+        """
+        if self.cache.contains(name, country):
+            return self.cache.get(name, country)
+        if self.offline:
+            return None
+
+        location = self._query(f"{name}, {country}")
+        self.cache.put(name, country, location)
+        return location
+
+    def radius_bounds(self, names: List[str], country: str, radius_km: float) -> np.ndarray:
+        """
+        Compute the bounding boxes of circles around the centers of many places.
+
+        :param names: Names of the places.
+        :param country: Country of the places.
+        :param radius_km: Radius in kilometers around the centers.
+        :return: Array of shape (n, 4) with the bounding box (west, south, east, north) of every place.
+        :raises ValueError: If a place cannot be found.
+        """
+        locations = [self.geocode(name, country) for name in names]
+        missing = [name for name, location in zip(names, locations) if location is None]
+        if missing:
+            raise ValueError(f"Location not found: {', '.join(missing)}")
+
+        return radius_bounds(np.array([location.latitude for location in locations]), np.array([location.longitude for location in locations]), radius_km)
+
+    def _query(self, query: str) -> GeocodedLocation | None:
+        """Send a rate-limited request to Nominatim."""
+        with self._lock:
+            if self._nominatim is None:
+                from geopy.geocoders import Nominatim
+                self._nominatim = Nominatim(user_agent=self.user_agent)
+
+            wait = self._last_request + self.min_delay - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                location = self._nominatim.geocode(query)
+            finally:
+                self._last_request = time.monotonic()
+
+        if location is None:
+            return None
+
+        bounds = None
+        bbox = location.raw.get("boundingbox")
+        if bbox is not None:
+            south, north, west, east = (float(value) for value in bbox)
+            bounds = (west, south, east, north)
+        return GeocodedLocation(location.latitude, location.longitude, bounds)
+
+
+_default_geocoder: Geocoder | None = None
+_default_lock = threading.Lock()
+
+
+def default_geocoder() -> Geocoder:
+    """
+    Get the geocoder of the process, creating one with a cache in the working directory on first use.
+
+    :return: The geocoder.
+    """
+    global _default_geocoder
+    with _default_lock:
+        if _default_geocoder is None:
+            _default_geocoder = Geocoder(GeocodeCache())
+        return _default_geocoder
+
+
+def set_default_geocoder(geocoder: Geocoder) -> None:
+    """
+    Replace the geocoder of the process, e.g. to use another cache or to work offline.
+
+    :param geocoder: The new geocoder.
+    """
+    global _default_geocoder
+    with _default_lock:
+        _default_geocoder = geocoder
@@ -0,0 +1,121 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from processing.tiling import Window
+from satellite.process_api import MAX_REQUEST_SIZE, ProcessApiClient, process_payload
+
+# A bounding box as (west, south, east, north) in WGS84 coordinates.
+Bounds = Tuple[float, float, float, float]
+
+
+def split_grid(bounds: Bounds, width: int, height: int, max_request_size: int = MAX_REQUEST_SIZE) -> List[Tuple[Window, Bounds]]:
+    """
+    Split a bounding box into a grid of sub-requests that each fit into the pixel limit of the service.
+
+    The tiles have nearly equal sizes and their bounding boxes are aligned to the pixel grid of the whole image, so the
+    stitched tiles equal a single request for the whole bounding box.
+
+    :param bounds: Bounding box of the whole image.
+    :param width: Width of the whole image in pixels.
+    :param height: Height of the whole image in pixels.
+    :param max_request_size: Maximum width and height of a single request in pixels.
+    :return: The pixel window in the whole image and the bounding box of every tile, in row-major order.
+    """
+    west, south, east, north = bounds
+    columns = math.ceil(width / max_request_size)
+    rows = math.ceil(height / max_request_size)
+    x_edges = [round(column * width / columns) for column in range(columns + 1)]
+    y_edges = [round(row * height / rows) for row in range(rows + 1)]
+
+    grid = []
+    for top, bottom in zip(y_edges, y_edges[1:]):
+        for left, right in zip(x_edges, x_edges[1:]):
+            tile_bounds = (west + (east - west) * left / width, north - (north - south) * bottom / height,
+                           west + (east - west) * right / width, north - (north - south) * top / height)
+            grid.append(((top, bottom, left, right), tile_bounds))
+    return grid
+
+
+class MosaicDownloader:
+    """
+    Downloads images larger than the pixel limit of the Process API as a grid of concurrent sub-requests and stitches
+    the tiles of every output into a mosaic. Mosaics are memory-mapped if a directory is given, so the whole image never
+    has to be held in memory, and kept in memory otherwise.
+    """
+
+    def __init__(self, client: ProcessApiClient, max_request_size: int = MAX_REQUEST_SIZE, max_workers: int = 4):
+        """
+        Initialize the downloader.
+
+        :param client: Client sending the sub-requests.
+        :param max_request_size: Maximum width and height of a single request in pixels.
+        :param max_workers: Maximum number of sub-requests in flight at the same time.
+        """
+        self.client = client
+        self.max_request_size = max_request_size
+        self.max_workers = max_workers
+
+    def download(self, bounds: Bounds, width: int, height: int, evalscript: str, time_interval: Tuple[str, str],
+                 responses: Sequence[str], directory: str | None, collection: str = "sentinel-2-l2a",
+                 formats: Dict[str, str] = None) -> Dict[str, np.ndarray]:
+        """
+        Download the outputs of an evalscript for a bounding box.
+
+        :param bounds: Bounding box of the whole image.
+        :param width: Width of the whole image in pixels.
+        :param height: Height of the whole image in pixels.
+        :param evalscript: Evalscript computing the outputs.
+        :param time_interval: First and last day of the time range as YYYY-MM-DD strings.
+        :param responses: Identifiers of the outputs.
+        :param directory: Directory the mosaics are memory-mapped in, one .npy file per output, or None to keep them in memory.
+        :param collection: Identifier of the data collection.
+        :param formats: MIME type of the outputs by identifier. Other outputs are PNG.
+        :return: The mosaic of every output by identifier, in OpenCV channel order.
+        :raises ValueError: If a tile is missing an output or does not have the requested size.
+        """
+        grid = split_grid(bounds, width, height, self.max_request_size)
+        mosaics: Dict[str, np.ndarray] = {}
+        print(f"Downloading {width}x{height} pixels in {len(grid)} tiles")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.client.fetch, process_payload(tile_bounds, right - left, bottom - top, evalscript,
+                                                                          time_interval, responses, collection, formats=formats)): (top, bottom, left, right)
+                       for (top, bottom, left, right), tile_bounds in grid}
+
+            for future in as_completed(futures):
+                top, bottom, left, right = futures[future]
+                try:
+                    images = future.result()
+                except BaseException:
+                    # Do not send the remaining sub-requests once the mosaic cannot be completed anymore.
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+
+                for identifier in responses:
+                    if identifier not in images:
+                        raise ValueError(f"Tile at ({top}, {left}) is missing the output {identifier}")
+
+                    image = images[identifier]
+                    if image.shape[:2] != (bottom - top, right - left):
+                        raise ValueError(f"Tile at ({top}, {left}) of {identifier} has size {image.shape[:2]}, expected {(bottom - top, right - left)}")
+
+                    if len(grid) == 1 and directory is None:
+                        # A single tile is the mosaic, so the decoded image is used without copying.
+                        mosaics[identifier] = image
+                        continue
+
+                    if identifier not in mosaics:
+                        shape = (height, width) + image.shape[2:]
+                        mosaics[identifier] = np.empty(shape, dtype=image.dtype) if directory is None else \
+                            np.lib.format.open_memmap(os.path.join(directory, f"{identifier}.npy"), mode="w+", dtype=image.dtype, shape=shape)
+                    mosaics[identifier][top:bottom, left:right] = image
+
+        for mosaic in mosaics.values():
+            if isinstance(mosaic, np.memmap):
+                mosaic.flush()
+        return mosaics
@@ -0,0 +1,173 @@
+import random
+import tarfile
+import time
+from typing import Any, BinaryIO, Callable, Dict, Sequence, Tuple, TypeVar
+
+import cv2
+import numpy as np
+import requests
+import urllib3
+
+PROCESS_API_PATH = "/api/v1/process"
+
+# Largest width and height of a single Process API request in pixels.
+MAX_REQUEST_SIZE = 2500
+
+# Status codes of errors that go away when the request is repeated later.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Errors of an attempt that are worth retrying, including transfers interrupted while the body is streamed.
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError)
+
+T = TypeVar("T")
+
+
+def process_payload(bounds: Tuple[float, float, float, float], width: int, height: int, evalscript: str,
+                    time_interval: Tuple[str, str], responses: Sequence[str], collection: str = "sentinel-2-l2a",
+                    max_cloud_coverage: float = 100.0, formats: Dict[str, str] = None) -> Dict[str, Any]:
+    """
+    Build the body of a Sentinel Hub Process API request.
+
+    :param bounds: Bounding box as (west, south, east, north) in WGS84 coordinates.
+    :param width: Width of the requested images in pixels.
+    :param height: Height of the requested images in pixels.
+    :param evalscript: Evalscript computing the outputs.
+    :param time_interval: First and last day of the time range as YYYY-MM-DD strings.
+    :param responses: Identifiers of the outputs of the evalscript.
+    :param collection: Identifier of the data collection.
+    :param max_cloud_coverage: Maximum cloud coverage of the used scenes in percent.
+    :param formats: MIME type of the outputs by identifier, e.g. "image/tiff" for float outputs. Other outputs are PNG.
+    :return: The JSON body of the request.
+    """
+    formats = formats if formats is not None else {}
+    start_date, end_date = time_interval
+    return {
+        "input": {
+            "bounds": {"bbox": list(bounds), "properties": {"crs": "http://www.opengis.net/def/crs/EPSG/0/4326"}},
+            "data": [{
+                "type": collection,
+                "dataFilter": {
+                    "timeRange": {"from": f"{start_date}T00:00:00Z", "to": f"{end_date}T23:59:59Z"},
+                    "maxCloudCoverage": max_cloud_coverage,
+                },
+            }],
+        },
+        "output": {
+            "width": width,
+            "height": height,
+            "responses": [{"identifier": identifier, "format": {"type": formats.get(identifier, "image/png")}} for identifier in responses],
+        },
+        "evalscript": evalscript,
+    }
+
+
+def decode_tar(stream: BinaryIO) -> Dict[str, np.ndarray]:
+    """
+    Decode the images of a tar response while it is read.
+
+    The archive is read sequentially from the stream and every member is decoded as soon as it has arrived, so neither
+    the archive nor the extracted files are written to disk.
+
+    :param stream: Readable stream of the tar archive returned for a request with several outputs.
+    :return: The decoded image of every output by identifier, in OpenCV channel order. TIFF outputs keep their data
+        type, e.g. float32.
+    :raises ValueError: If a member cannot be decoded.
+    """
+    images = {}
+    with tarfile.open(fileobj=stream, mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            image = cv2.imdecode(np.frombuffer(tar.extractfile(member).read(), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+            if image is None:
+                raise ValueError(f"Could not decode {member.name}")
+            images[member.name.rsplit(".", 1)[0]] = image
+    return images
+
+
+class ProcessApiClient:
+    """
+    Sends requests to the Sentinel Hub Process API and retries temporary failures with exponential backoff.
+
+    The client only needs an HTTP session, so it works with the authenticated OAuth session of Sentinel Hub as well as
+    with a plain session against a local stand-in server.
+    """
+
+    def __init__(self, session: requests.Session, base_url: str = "https://services.sentinel-hub.com", attempts: int = 5,
+                 backoff: float = 1.0, max_backoff: float = 30.0, timeout: float = 120.0):
+        """
+        Initialize the client.
+
+        :param session: HTTP session sending the requests, e.g. an authenticated OAuth2Session.
+        :param base_url: Base URL of the service.
+        :param attempts: Maximum number of attempts per request.
+        :param backoff: Delay in seconds before the first retry. It doubles with every further retry.
+        :param max_backoff: Maximum delay in seconds between two attempts.
+        :param timeout: Timeout of a single attempt in seconds.
+        """
+        self.session = session
+        self.url = base_url.rstrip("/") + PROCESS_API_PATH
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+    def fetch(self, payload: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """
+        Send a request and decode the returned images while the response is streamed in.
+
+        :param payload: Body of the request, see process_payload.
+        :return: The decoded image of every output by identifier.
+        :raises requests.RequestException: If the request still fails after the last attempt or fails permanently.
+        """
+        return self.request(payload, lambda response: decode_tar(response.raw))
+
+    def post(self, payload: Dict[str, Any]) -> bytes:
+        """
+        Send a request and return the body of the response.
+
+        :param payload: Body of the request.
+        :return: The body of the response.
+        :raises requests.RequestException: If the request still fails after the last attempt or fails permanently.
+        """
+        return self.request(payload, lambda response: response.content)
+
+    def request(self, payload: Dict[str, Any], read: Callable[[requests.Response], T]) -> T:
+        """
+        Send a request and read its response, retrying connection errors, timeouts, interrupted transfers, rate limits
+        and server errors.
+
+        :param payload: Body of the request.
+        :param read: Reads the streamed response of a successful attempt.
+        :return: The result of reading the response.
+        :raises requests.RequestException: If the request still fails after the last attempt or fails permanently.
+        """
+        for attempt in range(1, self.attempts + 1):
+            last_attempt = attempt == self.attempts
+            try:
+                with self._send(payload) as response:
+                    if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                        response.raise_for_status()
+                        response.raw.decode_content = True
+                        return read(response)
+            except TRANSIENT_ERRORS:
+                if last_attempt:
+                    raise
+                response = None
+            self._wait(attempt, response)
+
+        raise ValueError(f"The number of attempts must be at least 1, got {self.attempts}")
+
+    def _send(self, payload: Dict[str, Any]) -> requests.Response:
+        """Send a single attempt of a request without reading the body yet."""
+        return self.session.post(self.url, json=payload, headers={"Accept": "application/x-tar"}, timeout=self.timeout, stream=True)
+
+    def _wait(self, attempt: int, response: requests.Response | None) -> None:
+        """Sleep before the next attempt, as long as the server asks for or with exponential backoff and full jitter."""
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            delay = min(float(retry_after), self.max_backoff)
+        else:
+            # Full jitter keeps concurrent downloads from retrying in lockstep.
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        time.sleep(delay)
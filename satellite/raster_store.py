@@ -0,0 +1,111 @@
+import json
+import os
+import tempfile
+from typing import Any, Dict, List
+
+import numpy as np
+
+METADATA_EXTENSION = ".json"
+
+
+class RasterStore:
+    """
+    Directory of raw rasters, each stored as a .npy file with a JSON metadata sidecar.
+
+    Rasters keep their native data type, e.g. float32 index values, and are opened as read-only memory maps, so every
+    module and process reading them shares the pages of the operating system's file cache instead of decoding a copy.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initialize the store.
+
+        :param directory: Directory the rasters are stored in. It is created if necessary.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        """
+        Get the path of the data file of a raster.
+
+        :param name: Name of the raster.
+        :return: Path of the .npy file.
+        """
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def names(self) -> List[str]:
+        """
+        Get the names of all rasters in the store.
+
+        :return: The names in alphabetical order.
+        """
+        return sorted(file_name[:-len(".npy")] for file_name in os.listdir(self.directory) if file_name.endswith(".npy"))
+
+    def contains(self, name: str) -> bool:
+        """
+        Check whether a raster exists.
+
+        :param name: Name of the raster.
+        :return: True if the raster exists.
+        """
+        return os.path.exists(self.path(name))
+
+    def save(self, name: str, array: np.ndarray, **metadata: Any) -> None:
+        """
+        Write a raster and its metadata, replacing the data file atomically.
+
+        :param name: Name of the raster.
+        :param array: Data of the raster.
+        :param metadata: JSON-serializable metadata, e.g. bounds, CRS and time interval.
+        """
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=".npy")
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                np.save(file, array)
+            os.replace(temp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.write_metadata(name, array, **metadata)
+
+    def write_metadata(self, name: str, array: np.ndarray, **metadata: Any) -> None:
+        """
+        Write the metadata sidecar of a raster, e.g. one that was written in place as a memory map.
+
+        :param name: Name of the raster.
+        :param array: Data of the raster, used for its data type and shape.
+        :param metadata: JSON-serializable metadata, e.g. bounds, CRS and time interval.
+        """
+        sidecar = {"dtype": str(array.dtype), "shape": list(array.shape), **metadata}
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=METADATA_EXTENSION)
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+            json.dump(sidecar, file, indent=2, default=str)
+        os.replace(temp_path, os.path.join(self.directory, f"{name}{METADATA_EXTENSION}"))
+
+    def open(self, name: str) -> np.memmap:
+        """
+        Open a raster as read-only memory map.
+
+        :param name: Name of the raster.
+        :return: The memory-mapped raster.
+        :raises KeyError: If the raster does not exist.
+        """
+        if not self.contains(name):
+            raise KeyError(f"Raster not found: {name}")
+        return np.load(self.path(name), mmap_mode="r")
+
+    def metadata(self, name: str) -> Dict[str, Any]:
+        """
+        Read the metadata of a raster.
+
+        :param name: Name of the raster.
+        :return: The metadata, including data type and shape.
+        :raises KeyError: If the raster has no metadata.
+        """
+        try:
+            with open(os.path.join(self.directory, f"{name}{METADATA_EXTENSION}"), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            raise KeyError(f"Raster metadata not found: {name}") from None